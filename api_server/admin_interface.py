@@ -1,6 +1,9 @@
+from sanic.log import logging
 from .__version import __version__
 from .utils.misc import get_job_counter_id, shorten_strings
 
+logger = logging.getLogger('API')
+
 class AdminInterface():
     """
     AIME API Server AdminInterface provided by API Server
@@ -37,6 +40,30 @@ class AdminInterface():
             }
 
 
+    async def api_invalidate_api_key(self, api_key=None):
+        """Remove the cached answers of admin_is_api_key_valid() and admin_is_api_key_authorized_for_endpoint() for 
+        the given API key. Has to be called by the Admin BE when an API key is revoked or its authorizations change, 
+        otherwise the API Server uses the cached answers until their ttl in [AUTHORIZATION_CACHE] expires.
+
+        Args:
+            api_key (str, optional): API key to invalidate. Defaults to None (all API keys).
+        """
+        if self.app.authorization_cache:
+            self.app.authorization_cache.invalidate_api_key(api_key)
+
+
+    async def api_invalidate_endpoint_authorization(self, endpoint_name):
+        """Remove the cached answers of admin_is_api_key_authorized_for_endpoint() for the given endpoint and of 
+        admin_is_api_key_valid() for all API keys. Has to be called by the Admin BE when the authorized API keys of 
+        the endpoint change.
+
+        Args:
+            endpoint_name (str): Name of the endpoint
+        """
+        if self.app.authorization_cache:
+            self.app.authorization_cache.invalidate_endpoint(endpoint_name)
+
+
 
     async def api_get_endpoint_list(self):
         """Retrieve all endpoints known to the API Server.
@@ -149,6 +176,30 @@ class AdminInterface():
 
     # request statistics
     #
+    async def admin_log_events_batch(self, events):
+        """Receive a batch of buffered request and worker events from the API Server. The events are sent by a 
+        background task, so a slow Admin BE doesn't stall the requests and the job dispatch of the API Server. 
+        Can be overwritten by the Admin BE to store the whole batch at once, by default each event is passed to 
+        its method like admin_log_request_start(). An event whose method raises an exception doesn't stop the 
+        following events of the batch.
+
+        Args:
+            events (list[dict]): Events in order of occurrence with the keys 'event' (name of the method handling 
+                the event), 'time' (time the event was logged) and 'args' (dict with the arguments of the method)
+
+        Returns:
+            int: Number of events which could not be logged, None is treated as 0
+        """
+        num_failed = 0
+        for event in events:
+            try:
+                await getattr(self, event['event'])(**event['args'])
+            except Exception as error:
+                num_failed += 1
+                logger.error(f'Admin backend failed to log event {event.get("event")}: {error!r}')
+        return num_failed
+
+
     async def admin_log_request_start(
         self,
         job_id,
@@ -227,7 +278,7 @@ class AdminInterface():
         Returns:
             dict: Worker configuration containing job_type, worker_auth_key, etc.
         """        
-        return self.app.job_handler.get_worker_config(worker_name)
+        return await self.app.job_handler.get_worker_config(worker_name)
 
     async def api_get_worker_model(self, worker_name):
         """Retrieve the served model of the worker with given worker name.
@@ -238,7 +289,19 @@ class AdminInterface():
         Returns:
             dict: Model configuration containing e.g. label, size, quantization, type, family and repo_name
         """
-        return vars(self.app.job_handler.get_worker_model(worker_name))
+        return vars(await self.app.job_handler.get_worker_model(worker_name))
+
+
+    async def api_get_worker_throughput(self, worker_name):
+        """Retrieve the throughput model of the worker with given worker name.
+
+        Args:
+            worker_name (str): Name of the worker
+
+        Returns:
+            dict: Compute durations per effective batch size and generated tokens per second of the worker
+        """
+        return await self.app.job_handler.get_worker_throughput(worker_name)
 
 
 
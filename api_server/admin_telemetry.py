@@ -0,0 +1,129 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import time
+import asyncio
+from collections import deque
+from sanic.log import logging
+
+logger = logging.getLogger('API')
+
+OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest')
+
+
+class AdminTelemetry():
+    """Non-blocking delivery of request and worker events to the admin backend. Events like admin_log_request_start or
+    admin_notify_worker_state_changed are added to a bounded buffer without waiting, so a slow admin backend doesn't
+    stall requests or the job dispatch. A background task delivers the buffered events in batches of up to batch_size
+    events with AdminInterface.admin_log_events_batch(). If the buffer holds max_events, the oldest or the new event is
+    dropped depending on the overflow policy.
+
+    Args:
+        admin_backend (AdminInterface): Admin backend receiving the events
+        max_events (int, optional): Maximum number of buffered events. Defaults to 10000.
+        batch_size (int, optional): Maximum number of events delivered with one call. Defaults to 100.
+        flush_interval (float, optional): Time in seconds to collect events for a batch before delivering them. Defaults to 0.5.
+        overflow (str, optional): Event dropped if the buffer is full. Supported values: ('drop_oldest', 'drop_newest'). Defaults to 'drop_oldest'.
+    """
+    def __init__(self, admin_backend, max_events=10000, batch_size=100, flush_interval=0.5, overflow='drop_oldest'):
+        self.admin_backend = admin_backend
+        self.max_events = max(1, max_events)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        if overflow not in OVERFLOW_POLICIES:
+            logger.warning(f'Unknown overflow policy "{overflow}" for admin telemetry, using "drop_oldest". Supported: {", ".join(OVERFLOW_POLICIES)}')
+            overflow = 'drop_oldest'
+        self.overflow = overflow
+        self.events = deque()
+        self.event_added = asyncio.Event()
+        self.delivery_task = None
+        self.stopping = False
+        self.num_delivered = 0
+        self.num_dropped = 0
+        self.num_failed = 0
+
+
+    @classmethod
+    def from_config(cls, admin_backend, config):
+        """Create the telemetry pipeline from the section [ADMIN_TELEMETRY] of the server configuration.
+
+        Args:
+            admin_backend (AdminInterface): Admin backend receiving the events
+            config (dict): Telemetry configuration with max_events, batch_size, flush_interval and overflow
+
+        Returns:
+            AdminTelemetry: Telemetry pipeline
+        """
+        return cls(
+            admin_backend,
+            config.get('max_events', 10000),
+            config.get('batch_size', 100),
+            config.get('flush_interval', 0.5),
+            config.get('overflow', 'drop_oldest')
+        )
+
+
+    def log_event(self, event, **kwargs):
+        """Add an event to the buffer without waiting for the admin backend.
+
+        Args:
+            event (str): Name of the AdminInterface method handling the event, like 'admin_log_request_start'
+            kwargs: Arguments of the AdminInterface method
+        """
+        if len(self.events) >= self.max_events:
+            self.num_dropped += 1
+            if self.overflow == 'drop_newest':
+                return
+            self.events.popleft()
+        self.events.append({'event': event, 'time': time.time(), 'args': kwargs})
+        self.event_added.set()
+
+
+    def start(self):
+        if self.delivery_task is None:
+            self.stopping = False
+            self.delivery_task = asyncio.ensure_future(self.deliver_events())
+
+
+    async def stop(self):
+        """Stop the background task and deliver the remaining events. The background task isn't canceled, since a
+        canceled delivery would lose the batch already taken from the buffer.
+        """
+        if self.delivery_task is not None:
+            self.stopping = True
+            self.event_added.set()
+            await self.delivery_task
+            self.delivery_task = None
+        while self.events:
+            await self.deliver_batch()
+
+
+    async def deliver_events(self):
+        while not self.stopping:
+            await self.event_added.wait()
+            self.event_added.clear()
+            if self.flush_interval and len(self.events) < self.batch_size and not self.stopping:
+                await asyncio.sleep(self.flush_interval) # Collect further events for the batch
+            while self.events:
+                await self.deliver_batch()
+
+
+    async def deliver_batch(self):
+        batch = [self.events.popleft() for _ in range(min(self.batch_size, len(self.events)))]
+        try:
+            num_failed = await self.admin_backend.admin_log_events_batch(batch) or 0
+            self.num_delivered += len(batch) - num_failed
+            self.num_failed += num_failed
+        except Exception as error:
+            self.num_failed += len(batch)
+            logger.error(f'Admin backend failed to log {len(batch)} events: {error!r}')
+
+
+    def get_status(self):
+        return {
+            'num_buffered': len(self.events),
+            'num_delivered': self.num_delivered,
+            'num_dropped': self.num_dropped,
+            'num_failed': self.num_failed
+        }
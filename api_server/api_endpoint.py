@@ -4,18 +4,22 @@
 
 from sanic.log import logging
 from sanic.response import json as sanic_json
+from sanic.views import stream
 
 import urllib.request # Frage an Toine: Benötigt?
 
 import asyncio
 
 import time
+import math
 from pathlib import Path
 import toml
 
-from .job_queue import JobState, WorkerState
+from .job_queue import JobState, WorkerState, QueueScheduler, JobSettings
 from .utils.misc import StaticRouteHandler, JinjaRouteHandler, shorten_strings, generate_auth_key
-from .input_validation import InputValidationHandler
+from .input_validation import InputValidationHandler, MEDIA_TYPES
+from .utils.ffmpeg import FFmpeg, MediaBytes, MediaUpload
+from .utils.ffmpeg_executor import FFmpegBusyError
 
 
 
@@ -54,11 +58,20 @@ class APIEndpoint():
         self.ep_input_param_config['key'] = { 'type': 'string'}  # add implicit input 
         self.ep_input_param_config['wait_for_result'] = { 'type': 'bool'}     # add implicit input 
         self.worker_job_type, self.worker_auth_key, self.request_timeout = self.get_worker_params()
+        self.progress_wait_timeout = self.config.get('ENDPOINT', {}).get('progress_wait_timeout', 30)
+        self.admission_wait_slo = self.config.get('ENDPOINT', {}).get('admission_wait_slo', 0)
+        self.job_settings = JobSettings.from_config(self.config.get('ENDPOINT', {}))
+        FFmpeg.executor.set_endpoint_quota(self.endpoint_name, self.config.get('ENDPOINT', {}).get('max_media_processes', 0))
+        self.scheduler, self.priority_classes, self.default_priority_class = self.get_scheduler_params()
+        if self.priority_classes:
+            self.ep_input_param_config['priority_class'] = { 'type': 'selection', 'supported': list(self.priority_classes), 'default': self.default_priority_class }   # add implicit input
+        self.input_param_specs = InputValidationHandler.compile_input_param_specs(self.ep_input_param_config)
         self.lock = asyncio.Lock()
         self.__status_data = self.init_ep_status_data()
 
         app.add_route(self.api_request, "/" + self.endpoint_name, methods=self.http_methods, name=self.endpoint_name)
         app.add_route(self.api_progress, "/" + self.endpoint_name + "/progress", methods=self.http_methods, name=self.endpoint_name + "$progress")
+        app.add_route(self.api_cancel, "/" + self.endpoint_name + "/cancel", methods=self.http_methods, name=self.endpoint_name + "$cancel")
         app.add_route(self.client_login, "/" + self.endpoint_name + "/login", methods=self.http_methods, name=self.endpoint_name + "$login")
         app.add_route(self.client_get_endpoint_details, "/api/endpoints/" + self.endpoint_name, methods=self.http_methods, name=self.endpoint_name + "$get_endpoint_details")
 
@@ -214,6 +227,52 @@ class APIEndpoint():
         return job_type, worker_config.get('auth_key'), worker_config.get('request_timeout')
 
 
+    def get_scheduler_params(self):
+        """Parses the job queue scheduler and the priority classes from the [ENDPOINT] section of the endpoint config file.
+
+        Returns:
+            tuple (str, dict, str): Tuple of scheduler, priority classes with their weights and default priority class
+        """
+        endpoint_config = self.config.get('ENDPOINT', {})
+        scheduler = endpoint_config.get('scheduler', QueueScheduler.FIFO)
+        if scheduler not in (QueueScheduler.FIFO, QueueScheduler.FAIR_SHARE):
+            APIEndpoint.logger.error(f'Unknown scheduler {scheduler} in endpoint {self.endpoint_name}, using {QueueScheduler.FIFO}')
+            scheduler = QueueScheduler.FIFO
+        priority_classes = dict()
+        for priority_class, weight in endpoint_config.get('priority_classes', {}).items():
+            if isinstance(weight, (int, float)) and weight > 0:
+                priority_classes[priority_class] = weight
+            else:
+                APIEndpoint.logger.error(f'Weight of priority class {priority_class} in endpoint {self.endpoint_name} has to be a positive number')
+        default_priority_class = endpoint_config.get('default_priority_class')
+        if priority_classes and default_priority_class not in priority_classes:
+            default_priority_class = next(iter(priority_classes))
+        if priority_classes and scheduler == QueueScheduler.FIFO:
+            APIEndpoint.logger.warning(
+                f'Priority classes of endpoint {self.endpoint_name} are ignored with scheduler "{QueueScheduler.FIFO}", '
+                f'set scheduler = "{QueueScheduler.FAIR_SHARE}" to use them'
+            )
+        return scheduler, priority_classes, default_priority_class
+
+
+    def is_priority_class_authorized(self, api_key, priority_class):
+        """Check if the given API key may use the given priority class. The default priority class can be used by all
+        API keys, the other priority classes only by the API keys listed for them in priority_class_keys of the [CLIENTS]
+        section of the endpoint config file.
+
+        Args:
+            api_key (str): API key of the client
+            priority_class (str): Priority class selected by the client
+
+        Returns:
+            bool: True if the API key is authorized for the priority class
+        """
+        if priority_class is None or priority_class == self.default_priority_class:
+            return True
+        return api_key in self.clients_config.get('priority_class_keys', {}).get(priority_class, [])
+
+
+    @stream
     async def api_request(self, request):
         """Client request on route /self.endpoint_name with input parameters for the workers related to the job type 
         given in the input parameters. The client input parameters are validated and prepared for the worker job data. 
@@ -222,6 +281,12 @@ class APIEndpoint():
         If 'wait_for_result' is True the end result of the job is awaited via finalize_request and returned to the client. If False, 
         the client gets a quick confirmation response and the result can be requested on route 
         /self.endpoint_name/progress in the parameter 'job_result'.
+        If the client already has client_request_limit unfinished jobs on this endpoint, the request is rejected with status 429.
+        Requests predicted to exceed the admission_wait_slo or to lapse in the queue are rejected with status 429 and
+        the header Retry-After, see get_admission_retry_after().
+        The route is a streaming route. The body of audio and video uploads with application/octet-stream is only received 
+        after the request is admitted and is written to a temp file chunk by chunk, see receive_media_upload(). The body 
+        of all other requests is received at once. Both are limited to the REQUEST_MAX_SIZE of the server.
 
         Args:
             request (sanic.request.types.Request): Request from client
@@ -231,30 +296,66 @@ class APIEndpoint():
         """
 
         self.__status_data['last_request_time'] = time.time()
-        input_args = request.json if request.method == "POST" else request.args
+        if request.stream:
+            request.stream.request_max_size = request.app.config.REQUEST_MAX_SIZE # Sanic lifts the limit for streaming routes
+        media_upload_param_name = self.get_media_upload_param_name(request)
+        if not media_upload_param_name:
+            await request.receive_body()
+        input_args = self.get_input_args(request)
+        headers = None
         if self.__status_data.get('enabled'):
-            if self.app.job_handler.get_free_queue_slots(self.endpoint_name):
+            if await self.app.job_handler.get_free_queue_slots(self.endpoint_name):
                 self.__status_data['num_requests'] += 1
 
                 validation_errors, error_code = await self.validate_client(request)
 
                 if not validation_errors:
-                    job_data, validation_errors = await self.validate_input_parameters_for_job_data(input_args)
-                    if not validation_errors:
+                    api_key = input_args.get('key') or self.app.registered_keys.get(input_args.get('client_session_auth_key'))
+                    retry_after = await self.get_admission_retry_after() # Only after the client validation, so unauthorized clients don't learn about the server load
+                    if retry_after:
+                        self.__status_data['num_rejected_requests'] += 1
+                        validation_errors = f'Server overloaded, predicted waiting time too long! Retry after {retry_after} seconds.'
+                        headers = {'Retry-After': str(retry_after)}
+                    else:
+                        try:
+                            if media_upload_param_name:
+                                await self.receive_media_upload(request, media_upload_param_name)
+                            job_data, validation_errors = await self.validate_input_parameters_for_job_data(input_args)
+                        except FFmpegBusyError as error:
+                            self.__status_data['num_rejected_requests'] += 1
+                            validation_errors = str(error)
+                            headers = {'Retry-After': str(error.retry_after)}
+                        finally:
+                            await self.remove_media_uploads(input_args)
+                    job = None
+                    if headers:
+                        error_code = 429
+                    elif validation_errors:
+                        error_code = 400 # TODO Define error code for invalid input parameters
+                    elif not self.is_priority_class_authorized(api_key, job_data.get('priority_class')):
+                        validation_errors = f'API key is not authorized for priority class {job_data.get("priority_class")}'
+                        error_code = 402 # Like unauthorized endpoint
+                    else:
+                        priority_class = job_data.pop('priority_class', None)
                         job_data = self.add_session_variables_to_job_data(request, job_data)
                         job_data['endpoint_name'] = self.endpoint_name
 
-                        job = await self.app.job_handler.endpoint_new_job(job_data)
-                        if self.app.admin_backend:
-                            await self.app.admin_backend.admin_log_request_start(
-                                job.id,
-                                input_args.get('key') or self.app.registered_keys.get(input_args.get('client_session_auth_key')),
-                                self.endpoint_name,
-                                request.path,
-                                job.start_time,
-                                await job.state,
-                                request.headers.get('x-forwarded-for') or request.ip,
-                                dict(request.headers)
+                        job = await self.app.job_handler.endpoint_new_job(job_data, api_key, priority_class)
+                        if not job:
+                            validation_errors = f'Client request limit of {self.clients_config.get("client_request_limit")} unfinished requests reached!'
+                            error_code = 429
+                    if job:
+                        if self.app.admin_telemetry:
+                            self.app.admin_telemetry.log_event(
+                                'admin_log_request_start',
+                                job_id=job.id,
+                                api_key=api_key,
+                                endpoint_name=self.endpoint_name,
+                                url_path=request.path,
+                                start_time_utc=job.start_time,
+                                request_state=job.state,
+                                ip_address=request.headers.get('x-forwarded-for') or request.ip,
+                                http_request_header=dict(request.headers)
                             )
                         if input_args.get('wait_for_result', True):
                             response = await self.finalize_request(request, job) 
@@ -265,8 +366,6 @@ class APIEndpoint():
                                 'ep_version': self.version
                             }
                         APIEndpoint.logger.debug(f'Response to client on /{self.endpoint_name}: {str(shorten_strings(response))}')
-                    else:
-                        error_code = 400 # TODO Define error code for invalid input parameters
                 else:
                     self.__status_data['num_unauthorized_requests'] += 1
             else:
@@ -283,32 +382,59 @@ class APIEndpoint():
             if isinstance(validation_errors, list):
                 validation_errors = ', '.join(error_msg for error_msg in validation_errors)
             APIEndpoint.logger.warning(f'Aborted request on endpoint {self.endpoint_name}: {validation_errors}')
-            if self.app.admin_backend:
-                await self.app.admin_backend.admin_log_invalid_request(
-                    input_args.get('key') or self.app.registered_keys.get(input_args.get('client_session_auth_key')),
-                    'request',
-                    self.endpoint_name,
-                    time.time(),
-                    validation_errors,
-                    request.headers.get('x-forwarded-for') or request.ip,
-                    dict(request.headers)
+            if self.app.admin_telemetry:
+                self.app.admin_telemetry.log_event(
+                    'admin_log_invalid_request',
+                    api_key=input_args.get('key') or self.app.registered_keys.get(input_args.get('client_session_auth_key')),
+                    request_type='request',
+                    endpoint_name=self.endpoint_name,
+                    start_time_utc=time.time(),
+                    request_error_msg=validation_errors,
+                    ip_address=request.headers.get('x-forwarded-for') or request.ip,
+                    http_request_header=dict(request.headers)
                 )
-            return sanic_json(response, status=error_code)
+            return sanic_json(response, status=error_code, headers=headers)
 
         return sanic_json(response)
 
+
+    async def get_admission_retry_after(self):
+        """Admission control for new requests. The time until a new request would be finished is predicted from the queue
+        length and the measured throughput of the workers online. A request is not admitted if the predicted time exceeds
+        the admission_wait_slo of the endpoint config (0 = disabled) or if even the lower bound of the predicted time the
+        job waits in the queue exceeds max_time_in_queue, so the job would lapse before a worker could process it.
+
+        Returns:
+            int: Seconds the client should wait before retrying or None if the request is admitted
+        """
+        if self.admission_wait_slo:
+            estimate = await self.app.job_handler.endpoint_get_queue_estimate(self.endpoint_name)
+            if estimate and estimate['value'] > self.admission_wait_slo:
+                return math.ceil(estimate['value'] - self.admission_wait_slo)
+        if self.max_time_in_queue:
+            queue_time_estimate = await self.app.job_handler.endpoint_get_queue_estimate(self.endpoint_name, include_job_duration=False)
+            if queue_time_estimate and queue_time_estimate['lower'] > self.max_time_in_queue:
+                return math.ceil(queue_time_estimate['lower'] - self.max_time_in_queue)
+
     async def process_api_progress(self, request, job):
         response = {"success": True, 'job_id': job.id, 'ep_version': self.version}
         error_code = 200
-        if await job.state == JobState.PROCESSING:
-            if self.app.job_handler.is_job_future_done(job):
+        progress_version = job.progress_version
+        queue_version = job.queue_position_version
+        job_state = await self.app.job_handler.endpoint_get_job_state(job)
+        if job_state == JobState.PROCESSING:
+            if await self.app.job_handler.is_job_future_done(job):
                 response['job_result'] = await self.finalize_request(request, job)
+                progress_version = job.progress_version
+                job_state = await self.app.job_handler.endpoint_get_job_state(job)
                 APIEndpoint.logger.debug(f'Final response to client on /{self.endpoint_name}/progress: {str(shorten_strings(response))}')
-        elif await job.state == JobState.LAPSED:
+        elif job_state == JobState.LAPSED:
             error_code = 400 # Define error code for lapsed job
             response = await self.handle_invalid_progress_request(f'Job {job.id} on {self.endpoint_name} lapsed!', request)
-        response['job_state'] = await job.state
-        if await job.state != JobState.DONE:
+        response['job_state'] = job_state
+        response['progress_version'] = progress_version
+        response['queue_version'] = queue_version
+        if job_state != JobState.DONE:
             response['progress'] = await self.get_and_validate_progress_data(job)
         return response, error_code
 
@@ -318,7 +444,10 @@ class APIEndpoint():
         was False. Takes the progress results from APIServer.job_handler.progress_states put there by 
         APIServer.worker_job_progress() and sends it as response json to the client. When the job is finished the 
         final job result is awaited and taken from the job queue in finalize_request() and sent as response json 
-        to the client. 
+        to the client. If the client passes the 'progress_version' of its last response as 'since_version', the 
+        request is held open until a newer progress update arrives or the endpoint's progress_wait_timeout is reached (long-poll).
+        If the client additionally passes the 'queue_version' of its last response as 'since_queue_version', a change of
+        the queue position of a queued job ends the long-poll as well.
 
         Args:
             request (sanic.request.types.Request): Request with client_session_auth_key from client to 
@@ -332,12 +461,62 @@ class APIEndpoint():
         if validation_errors:
             response = await self.handle_invalid_progress_request(validation_errors, request)
         else:
-            input_args = request.json if request.method == "POST" else request.args
-            job = self.app.job_handler.get_job(input_args.get('job_id'))
+            input_args = self.get_input_args(request)
+            job = await self.app.job_handler.endpoint_get_job(input_args.get('job_id'))
+            since_version = self.get_version_arg(input_args, 'since_version')
+            if since_version is not None:
+                await self.app.job_handler.endpoint_wait_for_job_update(
+                    job, since_version, self.progress_wait_timeout, self.get_version_arg(input_args, 'since_queue_version')
+                )
             response, error_code = await self.process_api_progress(request, job)
         return sanic_json(response, status=error_code)
 
 
+    async def api_cancel(self, request):
+        """Client request on route /self.endpoint_name/cancel to cancel the job with the given job_id. A queued job is 
+        removed from the queue, the worker processing a running job is told to stop in the response to its next 
+        progress update. Requests waiting for the result of the job receive the error 'Job canceled by client'.
+
+        Args:
+            request (sanic.request.types.Request): Request with job_id and key or client_session_auth_key
+
+        Returns:
+            sanic.response.types.JSONResponse: Response to client with the job state after the cancel request
+        """
+        validation_errors, error_code = await self.validate_client(request)
+        if not validation_errors:
+            validation_errors, error_code = await self.validate_progress_request(request)
+        if validation_errors:
+            response = await self.handle_invalid_progress_request(validation_errors, request)
+            return sanic_json(response, status=error_code)
+
+        input_args = self.get_input_args(request)
+        job = await self.app.job_handler.endpoint_get_job(input_args.get('job_id'))
+        if await self.cancel_job(job, 'Job canceled by client'):
+            response = {'success': True, 'job_id': job.id, 'job_state': JobState.CANCELED, 'ep_version': self.version}
+            return sanic_json(response)
+        else:
+            job_state = await self.app.job_handler.endpoint_get_job_state(job)
+            response = {'success': False, 'error': f'Job {job.id} already {job_state}', 'job_id': job.id, 'job_state': job_state, 'ep_version': self.version}
+            return sanic_json(response, status=400)
+
+
+    async def cancel_job(self, job, reason):
+        """Cancel the given job and count it in the status data of the endpoint.
+
+        Args:
+            job (Job): Instance of class Job
+            reason (str): Reason logged in the admin backend
+
+        Returns:
+            bool: True if the job was canceled, False if it was already finished
+        """
+        if await self.app.job_handler.endpoint_cancel_job(job, reason):
+            self.__status_data['num_canceled_requests'] += 1
+            return True
+        return False
+
+
     async def client_login(self, request):
         """Route for client interface to login to the API Server while receiving a client session 
         authentication key.
@@ -348,7 +527,7 @@ class APIEndpoint():
         """
         api_key = request.args.get('key', None)
         if self.app.admin_backend:
-            response = await self.app.admin_backend.admin_is_api_key_valid(
+            response = await self.app.authorization_cache.is_api_key_valid(
                 api_key,
                 request.headers.get('x-forwarded-for') or request.ip
                 )
@@ -361,7 +540,7 @@ class APIEndpoint():
                 )
         client_session_auth_key = generate_auth_key()
         client_version = request.args.get('version','No version given from client')
-        self.app.registered_keys[client_session_auth_key] = api_key
+        await self.app.job_handler.register_client_session(client_session_auth_key, api_key)
         APIEndpoint.logger.debug(f'Client login with {client_version} on endpoint {self.endpoint_name} in version {self.version}. Assigned session authentication key: {client_session_auth_key}')
         return sanic_json(
             {
@@ -451,7 +630,7 @@ class APIEndpoint():
                 'version': self.version,
                 'max_queue_length': self.max_queue_length,
                 'max_time_in_queue': self.max_time_in_queue,
-                'free_queue_slots': self.app.job_handler.get_free_queue_slots(self.endpoint_name),
+                'free_queue_slots': await self.app.job_handler.get_free_queue_slots(self.endpoint_name),
                 'category': self.category,
                 'num_active_workers': len(await self.app.job_handler.get_all_active_workers(self.worker_job_type)),
                 'num_workers': len(workers),
@@ -467,7 +646,7 @@ class APIEndpoint():
                         'framework_version': worker.framework_version,
                         'pytorch_version':  worker.pytorch_version,
                         'model': vars(worker.model),
-                        
+                        'throughput': worker.throughput
                     }
                     for worker in workers
                 ],
@@ -481,21 +660,23 @@ class APIEndpoint():
 
 
     async def handle_invalid_progress_request(self, validation_errors, request):
-        input_args = request.json if request.method == "POST" else request.args
+        input_args = self.get_input_args(request)
         self.__status_data['num_invalid_progress_requests'] += 1
         response = {'success': False, 'error': validation_errors, 'ep_version': self.version}
         if isinstance(validation_errors, list):
             validation_errors = ', '.join(error_msg for error_msg in validation_errors)
         APIEndpoint.logger.warning(f'Aborted progress request on endpoint {self.endpoint_name}: {validation_errors}')
-        await self.app.admin_backend.admin_log_invalid_request(
-            input_args.get('key') or self.app.registered_keys.get(input_args.get('client_session_auth_key')),
-            'progress_request',
-            self.endpoint_name,
-            time.time(),
-            validation_errors,
-            request.headers.get('x-forwarded-for') or request.ip,
-            dict(request.headers)
-        )
+        if self.app.admin_telemetry:
+            self.app.admin_telemetry.log_event(
+                'admin_log_invalid_request',
+                api_key=input_args.get('key') or self.app.registered_keys.get(input_args.get('client_session_auth_key')),
+                request_type='progress_request',
+                endpoint_name=self.endpoint_name,
+                start_time_utc=time.time(),
+                request_error_msg=validation_errors,
+                ip_address=request.headers.get('x-forwarded-for') or request.ip,
+                http_request_header=dict(request.headers)
+            )
 
         return response
 
@@ -503,20 +684,48 @@ class APIEndpoint():
     async def validate_progress_request(self, request):
         validation_errors = list()
         error_code = None
-        input_args = request.json if request.method == "POST" else request.args
+        input_args = self.get_input_args(request)
         job_id = input_args.get('job_id')
         if not job_id:
             validation_errors.append(f'No job_id given')
             error_code = 402 # TODO Define error codes for missing job id
-        elif not self.app.job_handler.get_job(job_id):
+        elif not await self.app.job_handler.endpoint_get_job(job_id):
             validation_errors.append(f'Client has no active request with this job id {job_id}')
             error_code = 402 # TODO Define error codes for invalid job id
+        for arg_name in ('since_version', 'since_queue_version'):
+            try:
+                self.get_version_arg(input_args, arg_name)
+            except ValueError as error:
+                validation_errors.append(str(error))
+                error_code = 400
         return validation_errors, error_code
 
 
+    @staticmethod
+    def get_version_arg(input_args, arg_name):
+        """Get the version number with the given name from the input arguments of a progress request.
+
+        Args:
+            input_args (dict): Input arguments of the request
+            arg_name (str): Name of the version argument, 'since_version' or 'since_queue_version'
+
+        Raises:
+            ValueError: If the version is not an integer
+
+        Returns:
+            int: Version number or None if not given
+        """
+        value = input_args.get(arg_name)
+        if value is None:
+            return
+        if isinstance(value, bool) or not str(value).lstrip('-').isdigit():
+            raise ValueError(f'Invalid {arg_name} {value}, must be an integer')
+        return int(value)
+
+
     async def finalize_request(self, request, job):
         """Awaits the result until the APIServer.worker_job_result_json() puts the job results in the related future 
-        initialized in api_request() to get the results.
+        initialized in api_request() to get the results. If the client disconnects while waiting, the job is canceled.
 
         Args:
             request (sanic.request.types.Request): _description_
@@ -525,7 +734,11 @@ class APIEndpoint():
         Returns:
             dict: Dictionary representation of the response.
         """        
-        result = await self.app.job_handler.endpoint_wait_for_job_result(job)
+        try:
+            result = await self.app.job_handler.endpoint_wait_for_job_result(job)
+        except asyncio.CancelledError:
+            await self.cancel_job(job, 'Job canceled since client disconnected')
+            raise
         response = {'success': True, 'job_id': job.id, 'ep_version': self.version}
 
         #--- extract and store session variables from job
@@ -548,10 +761,107 @@ class APIEndpoint():
         return response
 
 
+    def get_input_args(self, request):
+        """Get the input parameters of the client request. POST requests send the input parameters as JSON or as 
+        form data, multipart/form-data with media input parameters as file uploads. With application/octet-stream the body 
+        contains the raw data of the first media input parameter of the endpoint and the other input parameters are 
+        given in the query string. String values of form fields and query parameters are converted to the types of their
+        input parameters. Uploaded media is kept as MediaBytes and not base64 encoded in the server. Streamed 
+        audio and video uploads are not part of the body and are added later by receive_media_upload().
+
+        Args:
+            request (sanic.request.types.Request): Request from client
+
+        Returns:
+            dict: Input parameters of the request
+        """
+        input_args = getattr(request.ctx, 'input_args', None)
+        if input_args is None:
+            if request.method != 'POST':
+                input_args = request.args
+            else:
+                content_type = request.headers.get('content-type', '').split(';')[0].strip().lower()
+                if content_type in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+                    input_args = {param_name: request.form.get(param_name) for param_name in request.form}
+                    for param_name in request.files:
+                        upload = request.files.get(param_name)
+                        input_args[param_name] = MediaBytes.from_mime_type(upload.body, upload.type)
+                    self.parse_form_values(input_args)
+                elif content_type == 'application/octet-stream':
+                    input_args = {param_name: request.args.get(param_name) for param_name in request.args}
+                    media_param_name = next(
+                        (param_name for param_name, param_config in self.ep_input_param_config.items() if param_config.get('type') in MEDIA_TYPES), 
+                        None
+                    )
+                    if media_param_name and request.body:
+                        input_args[media_param_name] = MediaBytes(request.body)
+                    self.parse_form_values(input_args)
+                else:
+                    input_args = request.json
+            request.ctx.input_args = input_args
+        return input_args
+
+
+    def parse_form_values(self, input_args):
+        """Convert the string values of form fields and query parameters to the types of their input parameters, so 
+        bool, int and float input parameters pass the validation.
+
+        Args:
+            input_args (dict): Input parameters of the request, converted in place
+        """
+        for param_name, value in input_args.items():
+            spec = self.input_param_specs.get(param_name)
+            if spec:
+                input_args[param_name] = spec.parse_form_value(value)
+
+
+    def get_media_upload_param_name(self, request):
+        """Get the name of the input parameter an application/octet-stream body is streamed to. Only audio and video 
+        input parameters are streamed, images are small enough to be received at once and analyzed from memory.
+
+        Args:
+            request (sanic.request.types.Request): Request from client
+
+        Returns:
+            str: Name of the first media input parameter of the endpoint if it is of type audio or video, else None
+        """
+        if request.method == 'POST' and request.headers.get('content-type', '').split(';')[0].strip().lower() == 'application/octet-stream':
+            media_param_name = next(
+                (param_name for param_name, param_config in self.ep_input_param_config.items() if param_config.get('type') in MEDIA_TYPES), 
+                None
+            )
+            if media_param_name and self.ep_input_param_config[media_param_name].get('type') in ('audio', 'video'):
+                return media_param_name
+
+
+    async def receive_media_upload(self, request, param_name):
+        """Stream the request body into a temp file and add it as MediaUpload to the input parameters, so the upload 
+        is neither buffered in the request nor base64 decoded and ffmpeg reads it from the temp file.
+
+        Args:
+            request (sanic.request.types.Request): Streaming request from client
+            param_name (str): Name of the media input parameter
+        """
+        param_type = self.ep_input_param_config[param_name].get('type')
+        media_upload = await MediaUpload(FFmpeg.executor.create_temp_file(param_type), param_type).receive(request.stream)
+        if media_upload.size:
+            self.get_input_args(request)[param_name] = media_upload
+        else:
+            await media_upload.remove()
+
+
+    async def remove_media_uploads(self, input_args):
+        for value in input_args.values():
+            if isinstance(value, MediaUpload):
+                await value.remove()
+
+
     async def validate_input_parameters_for_job_data(self, input_args):
         """Check if worker input parameters received from client are as specified in the endpoint config file
         """
-        input_validator = InputValidationHandler(input_args, self.ep_input_param_config, self.app.input_param_config)
+        input_validator = InputValidationHandler(
+            input_args, self.ep_input_param_config, self.app.input_param_config, self.endpoint_name, self.input_param_specs
+        )
         return await input_validator.validate_input_parameters()
            
 
@@ -566,21 +876,21 @@ class APIEndpoint():
 
 
     async def validate_client(self, request):
-        input_args = request.json if request.method == "POST" else request.args
+        input_args = self.get_input_args(request)
         api_key = input_args.get('key')
         client_session_auth_key = input_args.get('client_session_auth_key')
         error_code = None
         validation_errors = []
         if self.app.admin_backend:
             if api_key:
-                response = await self.app.admin_backend.admin_is_api_key_valid(
+                response = await self.app.authorization_cache.is_api_key_valid(
                     api_key,
                     request.headers.get('x-forwarded-for') or request.ip
                 )
                 if not response.get('valid'):
                     validation_errors.append(response.get('error_msg') or 'API key not valid')
                     error_code = 401 # TODO Define error codes for invalid key
-                elif not await self.app.admin_backend.admin_is_api_key_authorized_for_endpoint(api_key, self.endpoint_name):
+                elif not await self.app.authorization_cache.is_api_key_authorized_for_endpoint(api_key, self.endpoint_name):
                     validation_errors.append(f'Client not authorized for endpoint {self.endpoint_name}!')
                     error_code = 402 # TODO Define error codes for unauthorized endpoint
             elif client_session_auth_key not in self.app.registered_keys:
@@ -614,6 +924,7 @@ class APIEndpoint():
             'num_failed_requests': 0,
             'num_unauthorized_requests': 0,
             'num_canceled_requests': 0,
+            'num_rejected_requests': 0,
             'enabled': True
         }
         return status_data
@@ -622,6 +933,11 @@ class APIEndpoint():
     @property
     async def status_data(self):
         self.__status_data.update(await self.app.job_handler.get_job_type_status(self.worker_job_type))
+        self.__status_data['media_processing'] = FFmpeg.executor.get_status(self.endpoint_name)
+        if self.app.authorization_cache:
+            self.__status_data['authorization_cache'] = self.app.authorization_cache.get_status()
+        if self.app.admin_telemetry:
+            self.__status_data['admin_telemetry'] = self.app.admin_telemetry.get_status()
         return self.__status_data
 
 
@@ -19,14 +19,23 @@ import json
 import asyncio
 
 from .api_endpoint import APIEndpoint
+from .authorization_cache import AuthorizationCache
+from .admin_telemetry import AdminTelemetry
+from .input_validation import InputValidationHandler
 from .job_queue import JobState, JobHandler
+from .job_state_broker import JobStateBroker
 from .openai import OpenAI
+from .worker_websocket import WorkerWebSocket
 from .flags import Flags
 from .utils.misc import StaticRouteHandler, shorten_strings, CustomFormatter
-from .utils.ffmpeg import FFmpeg
+from .utils.ffmpeg import FFmpeg, MediaBytes
+from .utils.media_cache import MediaConversionCache
 
 
 logging.getLogger('asyncio').setLevel(logging.ERROR)
+
+SSE_HEARTBEAT_INTERVAL = 15 # Time in seconds without progress change after a heartbeat comment is sent on /stream_progress
+SSE_RETRY_INTERVAL = 3000 # Time in milliseconds the client waits before reconnecting to /stream_progress
         
 
 
@@ -48,7 +57,10 @@ class APIServer(Sanic):
     host = None
     port = None
     admin_backend = None
+    authorization_cache = None
+    admin_telemetry = None
     openai = None
+    worker_websocket = None
 
     def __init__(self, api_name):
         """Constructor
@@ -67,6 +79,8 @@ class APIServer(Sanic):
     @classmethod
     def connect_admin_backend(cls, admin_backend):
         cls.admin_backend = admin_backend
+        cls.authorization_cache = AuthorizationCache.from_config(admin_backend, cls.server_config.get('AUTHORIZATION_CACHE', {}))
+        cls.admin_telemetry = AdminTelemetry.from_config(admin_backend, cls.server_config.get('ADMIN_TELEMETRY', {}))
 
 
     async def worker_login(self, request):
@@ -170,7 +184,7 @@ class APIServer(Sanic):
                 'error_msg': 'Worker - Server connection broke',
             }
             status_code = 503
-        return sanic_json(response_cmd, status=status_code)
+        return sanic_json(response_cmd, status=status_code, dumps=json.dumps, default=MediaBytes.json_default) # Binary media inputs are base64 encoded here
 
 
     async def worker_job_result_json(self, request):
@@ -281,7 +295,7 @@ class APIServer(Sanic):
 
         if APIServer.job_handler and APIServer.job_handler.job_types and req_json:
             result = {
-                'logged_in': APIServer.job_handler.is_worker_logged_in(req_json.get('auth')),
+                'logged_in': await APIServer.job_handler.is_worker_logged_in(req_json.get('auth')),
                 'job_type_present': bool(APIServer.job_handler.job_types.get(req_json.get('job_type'))),
                 'key_valid': APIServer.job_handler.is_worker_auth_key_valid(req_json.get('auth_key'), req_json.get('job_type'))
             }
@@ -294,7 +308,7 @@ class APIServer(Sanic):
         error_code = None
         validation_errors = []
         if api_key and self.admin_backend:
-            response = await self.admin_backend.admin_is_api_key_valid(
+            response = await self.authorization_cache.is_api_key_valid(
                 api_key,
                 ip_address
             )
@@ -302,7 +316,7 @@ class APIServer(Sanic):
                 validation_errors.append(response.get('error_msg'))
                 error_code = 401
             elif endpoint_name:
-                if not await self.admin_backend.admin_is_api_key_authorized_for_endpoint(api_key, endpoint_name):
+                if not await self.authorization_cache.is_api_key_authorized_for_endpoint(api_key, endpoint_name):
                     validation_errors.append(f'Client not authorized for endpoint {endpoint_name}!')
                     error_code = 402 # TODO Define error codes
         else:
@@ -322,7 +336,7 @@ class APIServer(Sanic):
         """        
         api_key = request.args.get('key', None)
         if self.admin_backend:
-            response = await self.admin_backend.admin_is_api_key_valid(
+            response = await self.authorization_cache.is_api_key_valid(
                 api_key,
                 request.headers.get('x-forwarded-for') or request.ip
             )
@@ -352,7 +366,7 @@ class APIServer(Sanic):
         api_key = request.args.get('key')
         endpoints = list(self.endpoints.keys())
         if api_key:
-            response = await self.admin_backend.admin_is_api_key_valid(
+            response = await self.authorization_cache.is_api_key_valid(
                 api_key,
                 request.headers.get('x-forwarded-for') or request.ip
             )
@@ -364,7 +378,7 @@ class APIServer(Sanic):
                     status = 401
                 )
             endpoints = [
-                endpoint_name for endpoint_name in endpoints if await self.admin_backend.admin_is_api_key_authorized_for_endpoint(api_key,endpoint_name)
+                endpoint_name for endpoint_name in endpoints if await self.authorization_cache.is_api_key_authorized_for_endpoint(api_key,endpoint_name)
             ]
         return sanic_json(
             {
@@ -389,6 +403,7 @@ class APIServer(Sanic):
         APIServer.static_routes = APIServer.server_config.get('STATIC', {})
         APIServer.worker_config = APIServer.server_config.get('WORKERS', {})
         APIServer.openai_config = APIServer.server_config.get('OPENAI', {})
+        FFmpeg.executor.configure(APIServer.server_config.get('FFMPEG', {}))
 
 
 
@@ -415,70 +430,87 @@ class APIServer(Sanic):
             APIServer.logger.error("!!! No Endpoint Configuration found, please specify where to load ml_api_endpoing.cfg with the --ep_config argument")
 
 
-    def init_job_handler(self, app, loop):
-        APIServer.job_handler = JobHandler(app)
+    async def init_job_handler(self, app, loop):
+        job_state_backend = APIServer.server_config.get('SERVER', {}).get('job_state_backend', 'local')
+        if job_state_backend == 'broker':
+            APIServer.job_handler = await JobStateBroker.start_or_connect(app, self.get_job_state_broker_socket())
+        else:
+            if APIServer.args.worker_processes > 1:
+                APIServer.logger.warning(
+                    f'Job state backend "{job_state_backend}" keeps jobs and workers per server process. '
+                    f'Set job_state_backend = "broker" in [SERVER] to share them between the {APIServer.args.worker_processes} worker processes.'
+                )
+            APIServer.job_handler = JobHandler(app)
+        if isinstance(APIServer.job_handler, JobHandler): # Only the process holding the jobs journals them
+            await APIServer.job_handler.restore_jobs_from_journal()
+
+
+    def remove_job_state_broker_socket(self, app, loop):
+        JobStateBroker.remove_socket(self.get_job_state_broker_socket())
+
+
+    def get_job_state_broker_socket(self):
+        return APIServer.server_config.get('SERVER', {}).get('job_state_broker_socket', f'/tmp/aime_api_server_{APIServer.port}.sock')
 
 
     def init_openai(self, app, loop):
         OpenAI(self)
 
 
-    @staticmethod #stream=True in add_route() only works if staticmethod?
-    async def stream_progress_to_client(request):
-        client_session_auth_key = request.args.get('client_session_auth_key')
-        job_id = request.args.get('job_id')
-        if not client_session_auth_key:
-            job_cmd = { 'cmd': "error", 'msg': f"client_session_auth_key missing" }
-            return sanic_json(job_cmd)
-        endpoint_name = APIServer.registered_keys.get(client_session_auth_key)
-        if not endpoint_name:
-            job_cmd = { 'cmd': "error", 'msg': f"client_session_auth_key not authorized" }
-            return sanic_json(job_cmd)
-        if not job_id:
-            job_cmd = { 'cmd': "error", 'msg': f"job_id missing" }
-            return sanic_json(job_cmd)
-
-        job_type = APIServer.endpoints.get(endpoint_name).worker_job_type
-        queue = APIServer.job_handler.job_queues.get(job_type)
-        if not queue:
-            job_cmd = { 'cmd': "error", 'msg': f"Internal Error: Queue not found" }
-            return sanic_json(job_cmd)
-
-
-        async def stream_sse(response):
-            previous_progress_state = {}
-            previous_queue_position = -1
-            job_state = APIServer.job_handler.get_job_state(job_id)
-            while (job_state == JobState.QUEUED) or (job_state == JobState.PROCESSING):
-                progress_state = APIServer.job_handler.progress_states.get(job_id, previous_progress_state)
-                if not progress_state:
-                    progress_state['progress'] = 0                    
-                progress_state['job_state'] = job_state
-
-                queue_position = 0
-                if job_state == JobState.QUEUED:
-                    queue_position = queue.get_rank_for_job_id(job_id)
-
-                if (queue_position != previous_queue_position) or (progress_state != previous_progress_state):
-                    previous_progress_state = progress_state
-                    previous_queue_position = queue_position
-                    progress_state['queue_position'] = queue_position
-                    await response.write(f'data: {json.dumps(progress_state)}\n\n')
-
-                await asyncio.sleep(0.5)
-                job_state = APIServer.job_handler.get_job_state(job_id)
-                if job_state == JobState.PROCESSING:
-                    if APIServer.job_handler.is_job_future_done(job_id):
-                        endpoint = APIServer.endpoints.get(endpoint_name)
-                        progress_state['job_result'] = await endpoint.finalize_request(request, job_id)
-                        job_state = APIServer.job_handler.get_job_state(job_id)
-                        progress_state['job_state'] = job_state
-                        progress_state['progress'] = 100                  
-                        progress_state['queue_position'] = 0
-                        await response.write(f'data: {json.dumps(progress_state)}\n\n')
-
-        headers = {'Content-Type': 'text/event-stream'}
-        return sanic_response.ResponseStream(stream_sse, headers=headers)
+    def init_media_cache(self, app, loop):
+        InputValidationHandler.media_cache = MediaConversionCache.from_config(APIServer.server_config.get('MEDIA_CACHE', {}))
+
+
+    async def stream_progress_to_client(self, request):
+        """Route /stream_progress to receive the progress of a job as server-sent events. An event with the same 
+        content as the response of /endpoint_name/progress is sent whenever the progress state or the queue position 
+        of the job changes. The final event contains the job result and closes the stream. Comment lines are sent as 
+        heartbeat if nothing changes. The id of each event can be sent back in the Last-Event-ID header or the 
+        parameter 'last_event_id' to resume a stream without receiving the last event twice.
+
+        Args:
+            request (sanic.request.types.Request): Client request with job_id and key or client_session_auth_key
+
+        Returns:
+            sanic.response.types.JSONResponse: Response to client in case of invalid request, otherwise the events 
+                are sent via the streaming response
+        """
+        input_args = request.args
+        job = await self.job_handler.endpoint_get_job(input_args.get('job_id'))
+        if not job:
+            return sanic_json({'success': False, 'error': f'Client has no active request with this job id {input_args.get("job_id")}'}, status=402)
+        endpoint = self.endpoints.get(job.endpoint_name)
+        validation_errors, error_code = await endpoint.validate_client(request)
+        if not validation_errors:
+            validation_errors, error_code = await endpoint.validate_progress_request(request)
+        if validation_errors:
+            response = await endpoint.handle_invalid_progress_request(validation_errors, request)
+            return sanic_json(response, status=error_code)
+
+        last_event_id = request.headers.get('last-event-id') or input_args.get('last_event_id')
+        response_stream = await request.respond(
+            content_type='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+        await response_stream.send(f'retry: {SSE_RETRY_INTERVAL}\n\n')
+        last_send_time = time.time()
+        job_running = True
+        while job_running:
+            progress_version = job.progress_version
+            queue_version = job.queue_position_version
+            progress, _ = await endpoint.process_api_progress(request, job)
+            job_running = progress.get('job_state') in (JobState.QUEUED, JobState.PROCESSING) and 'job_result' not in progress
+            event_id = f'{progress.get("progress_version")}-{progress.get("progress", {}).get("queue_position", 0)}'
+            if event_id != last_event_id or not job_running:
+                last_event_id = event_id
+                await response_stream.send(f'id: {event_id}\ndata: {json.dumps(progress)}\n\n')
+                last_send_time = time.time()
+            elif time.time() - last_send_time >= SSE_HEARTBEAT_INTERVAL:
+                await response_stream.send(': heartbeat\n\n')
+                last_send_time = time.time()
+            if job_running:
+                await self.job_handler.endpoint_wait_for_job_update(job, progress_version, SSE_HEARTBEAT_INTERVAL, queue_version)
+        await response_stream.eof()
 
 
     def init(self, args):
@@ -487,10 +519,15 @@ class APIServer(Sanic):
         self.register_listener(self.setup_static_routes, 'before_server_start')
         self.register_listener(self.init_all_endpoints, 'before_server_start')
         self.register_listener(self.init_openai, 'before_server_start')
+        self.register_listener(self.init_media_cache, 'before_server_start')
+        self.register_listener(self.remove_job_state_broker_socket, 'main_process_start')
         self.register_listener(self.init_job_handler, 'after_server_start')
         self.register_listener(FFmpeg.is_ffmpeg_installed, 'after_server_start')
-        self.register_listener(self.start_job_clean_up_background_task, 'after_server_start')
         self.register_listener(self.start_worker_watchdog, 'after_server_start')
+        self.register_listener(self.start_admin_telemetry, 'after_server_start')
+        self.register_listener(self.stop_admin_telemetry, 'before_server_stop')
+        self.register_listener(self.stop_job_journal, 'before_server_stop')
+        self.register_listener(self.close_result_store, 'after_server_stop')
 
 
     def __setup_worker_interface(self):
@@ -499,7 +536,8 @@ class APIServer(Sanic):
         self.add_route(self.worker_job_result_json, "/worker_job_result", methods=["POST"])
         self.add_route(self.worker_job_progress, "/worker_job_progress", methods=["POST", "GET"])
         self.add_route(self.worker_check_server_status, "/worker_check_server_status", methods=["POST"])
-        self.add_route(self.stream_progress_to_client ,"/stream_progress", methods=["POST", "GET"], stream=True)
+        APIServer.worker_websocket = WorkerWebSocket(self)
+        self.add_route(self.stream_progress_to_client ,"/stream_progress", methods=["GET"])
         self.add_route(self.validate_key, "/api/validate_key", methods=["POST", "GET"], name='api$validate_key')
         self.add_route(self.get_endpoints, "/api/endpoints", methods=["POST", "GET"], name='api$get_endpoints')
 
@@ -516,14 +554,25 @@ class APIServer(Sanic):
         self.update_config({key.upper(): value for key, value in config.items()})
 
 
-    async def start_job_clean_up_background_task(self, app, loop):
-        loop.create_task(self.periodically_clean_up_jobs())
+    def start_admin_telemetry(self, app, loop):
+        if self.admin_telemetry:
+            self.admin_telemetry.start()
 
 
-    async def periodically_clean_up_jobs(self, update_interval=5):
-        while True:
-            await self.job_handler.clean_up_jobs()
-            await asyncio.sleep(update_interval)
+    async def stop_admin_telemetry(self, app, loop):
+        if self.admin_telemetry:
+            await self.admin_telemetry.stop()
+
+
+    async def stop_job_journal(self, app, loop):
+        if isinstance(APIServer.job_handler, JobHandler):
+            await APIServer.job_handler.stop_journal()
+
+
+    def close_result_store(self, app, loop):
+        result_store = getattr(APIServer.job_handler, 'result_store', None) # Only in the process holding the jobs
+        if result_store:
+            result_store.close()
 
 
     async def start_worker_watchdog(self, app, loop):
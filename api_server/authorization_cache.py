@@ -0,0 +1,163 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import time
+import asyncio
+from collections import OrderedDict
+
+
+class AuthorizationCache():
+    """Cache between the API server and the admin backend for the validation of API keys and their authorization for
+    endpoints, so requests don't wait for the admin backend, which is usually a database call. Positive answers are
+    cached for ttl seconds, negative answers for negative_ttl seconds. The least recently used entries are evicted if the
+    cache exceeds max_entries. Concurrent requests with the same uncached key share a single call to the admin backend.
+    The admin backend has to invalidate changed or revoked keys with AdminInterface.api_invalidate_api_key() and
+    AdminInterface.api_invalidate_endpoint_authorization().
+
+    Args:
+        admin_backend (AdminInterface): Admin backend answering the uncached requests
+        ttl (float, optional): Time in seconds positive answers are cached, 0 = no caching. Defaults to 60.
+        negative_ttl (float, optional): Time in seconds negative answers are cached, 0 = no caching. Defaults to 10.
+        max_entries (int, optional): Maximum number of cached answers. Defaults to 10000.
+    """
+    def __init__(self, admin_backend, ttl=60, negative_ttl=10, max_entries=10000):
+        self.admin_backend = admin_backend
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # key: tuple(request type, api key, ip address or endpoint name), value: tuple(answer, expiration time)
+        self.pending_requests = dict() # key: tuple(cache key, generation), value: asyncio.Task of the running admin backend call
+        self.generation = 0 # Incremented on invalidation, so answers of calls started before aren't cached
+        self.num_hits = 0
+        self.num_misses = 0
+
+
+    @classmethod
+    def from_config(cls, admin_backend, config):
+        """Create the cache from the section [AUTHORIZATION_CACHE] of the server configuration.
+
+        Args:
+            admin_backend (AdminInterface): Admin backend answering the uncached requests
+            config (dict): Authorization cache configuration with ttl, negative_ttl and max_entries
+
+        Returns:
+            AuthorizationCache: Authorization cache
+        """
+        return cls(
+            admin_backend,
+            config.get('ttl', 60),
+            config.get('negative_ttl', 10),
+            config.get('max_entries', 10000)
+        )
+
+
+    async def is_api_key_valid(self, api_key, ip_address):
+        """Cached AdminInterface.admin_is_api_key_valid().
+
+        Args:
+            api_key (str): API key of the client
+            ip_address (str): IP address of the client
+
+        Returns:
+            dict: Validation result with the keys 'valid' and 'error_msg'
+        """
+        response = await self.get(
+            ('valid', api_key, ip_address),
+            self.admin_backend.admin_is_api_key_valid,
+            api_key,
+            ip_address
+        )
+        return dict(response)
+
+
+    async def is_api_key_authorized_for_endpoint(self, api_key, endpoint_name):
+        """Cached AdminInterface.admin_is_api_key_authorized_for_endpoint().
+
+        Args:
+            api_key (str): API key of the client
+            endpoint_name (str): Name of the endpoint
+
+        Returns:
+            bool: True if the API key is authorized for the endpoint
+        """
+        return await self.get(
+            ('authorized', api_key, endpoint_name),
+            self.admin_backend.admin_is_api_key_authorized_for_endpoint,
+            api_key,
+            endpoint_name
+        )
+
+
+    async def get(self, key, admin_backend_call, *args):
+        entry = self.entries.get(key)
+        if entry is not None:
+            answer, expiration_time = entry
+            if expiration_time > time.monotonic():
+                self.entries.move_to_end(key)
+                self.num_hits += 1
+                return answer
+            del self.entries[key]
+        self.num_misses += 1
+        pending_key = (key, self.generation) # Requests after an invalidation don't join calls started before
+        pending_request = self.pending_requests.get(pending_key)
+        if pending_request is None:
+            pending_request = self.pending_requests[pending_key] = asyncio.ensure_future(
+                self.call_admin_backend(pending_key, admin_backend_call, *args)
+            )
+        return await asyncio.shield(pending_request) # A disconnecting client doesn't cancel the call for the other requests
+
+
+    async def call_admin_backend(self, pending_key, admin_backend_call, *args):
+        key, generation = pending_key
+        try:
+            answer = await admin_backend_call(*args)
+        finally:
+            del self.pending_requests[pending_key]
+        if generation == self.generation:
+            self.put(key, answer)
+        return answer
+
+
+    def put(self, key, answer):
+        is_positive = answer.get('valid') if isinstance(answer, dict) else bool(answer)
+        ttl = self.ttl if is_positive else self.negative_ttl
+        if ttl > 0:
+            self.entries[key] = (answer, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+    def invalidate_api_key(self, api_key=None):
+        """Remove the cached answers of the given API key.
+
+        Args:
+            api_key (str, optional): API key to remove. Defaults to None (all API keys).
+        """
+        self.generation += 1
+        if api_key is None:
+            self.entries.clear()
+        else:
+            for key in [key for key in self.entries if key[1] == api_key]:
+                del self.entries[key]
+
+
+    def invalidate_endpoint(self, endpoint_name):
+        """Remove the cached authorizations for the given endpoint and all cached API key validations, since the
+        validity of a key can depend on the endpoints it is authorized for.
+
+        Args:
+            endpoint_name (str): Name of the endpoint
+        """
+        self.generation += 1
+        for key in [key for key in self.entries if key[0] == 'valid' or key[2] == endpoint_name]:
+            del self.entries[key]
+
+
+    def get_status(self):
+        return {
+            'num_entries': len(self.entries),
+            'num_hits': self.num_hits,
+            'num_misses': self.num_misses
+        }
@@ -0,0 +1,182 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+from dataclasses import dataclass, asdict
+import math
+
+
+ESTIMATOR_ALPHA = 0.1 # Weight of the newest sample in the exponentially weighted moving averages
+CONFIDENCE_FACTOR = 2 # Number of standard deviations between estimate and confidence bounds
+MIN_SAMPLES_FOR_VARIANCE = 3 # Below this number of samples the standard deviation is assumed to be half of the mean
+
+
+@dataclass
+class Estimate:
+    """Estimated value with lower and upper confidence bound.
+    """
+    value: float
+    lower: float
+    upper: float
+
+    def rounded(self, ndigits=1):
+        return Estimate(round(self.value, ndigits), round(self.lower, ndigits), round(self.upper, ndigits))
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class EWMAStatistic():
+    """Exponentially weighted moving average and variance of a series of samples. The first sample initializes the mean,
+    so the average is not biased towards zero while only few samples are known.
+
+    Args:
+        alpha (float, optional): Weight of the newest sample. Defaults to ESTIMATOR_ALPHA.
+    """
+    def __init__(self, alpha=ESTIMATOR_ALPHA):
+        self.alpha = alpha
+        self.mean = 0
+        self.variance = 0
+        self.count = 0
+
+
+    def add(self, value):
+        if self.count:
+            difference = value - self.mean
+            increment = self.alpha * difference
+            self.mean += increment
+            self.variance = (1 - self.alpha) * (self.variance + difference * increment)
+        else:
+            self.mean = value
+        self.count += 1
+
+
+    @property
+    def std(self):
+        if self.count < MIN_SAMPLES_FOR_VARIANCE:
+            return self.mean / 2
+        return math.sqrt(self.variance)
+
+
+    def get_estimate(self):
+        """Get the mean with confidence bounds of CONFIDENCE_FACTOR standard deviations.
+
+        Returns:
+            Estimate: Estimated mean with lower and upper bound
+        """
+        deviation = CONFIDENCE_FACTOR * self.std
+        return Estimate(self.mean, max(0, self.mean - deviation), self.mean + deviation)
+
+
+    def to_dict(self):
+        return {'mean': round(self.mean, 3), 'std': round(self.std, 3), 'count': self.count}
+
+
+class ThroughputModel():
+    """Throughput model of a single worker. Tracks the compute duration of the finished jobs per effective batch size,
+    which is the maximum number of jobs the worker processed in parallel while the job was running, and for language
+    models the number of generated tokens per second of each job.
+    """
+    def __init__(self):
+        self.durations = dict() # key: effective batch size, value: EWMAStatistic of the compute duration in seconds
+        self.tokens_per_second = EWMAStatistic() # generated tokens per second of a single job
+
+
+    @property
+    def has_samples(self):
+        return bool(self.durations)
+
+
+    def add_finished_job(self, compute_duration, batch_size=1, num_generated_tokens=None):
+        """Add the compute duration of a finished job to the model.
+
+        Args:
+            compute_duration (float): Compute duration of the job in seconds
+            batch_size (int, optional): Effective batch size the job was processed with. Defaults to 1.
+            num_generated_tokens (int, optional): Number of tokens generated for language model jobs. Defaults to None.
+        """
+        if compute_duration is None or compute_duration <= 0:
+            return
+        batch_size = max(1, batch_size or 1)
+        self.durations.setdefault(batch_size, EWMAStatistic()).add(compute_duration)
+        if num_generated_tokens:
+            self.tokens_per_second.add(num_generated_tokens / compute_duration)
+
+
+    def get_job_duration(self, batch_size=1):
+        """Get the estimated compute duration of a job processed with the given batch size. If no job with this batch size
+        was finished yet, the duration of the nearest known batch size is used.
+
+        Args:
+            batch_size (int, optional): Effective batch size. Defaults to 1.
+
+        Returns:
+            Estimate: Estimated compute duration in seconds or None if no job was finished yet
+        """
+        if not self.durations:
+            return None
+        statistic = self.durations.get(batch_size)
+        if not statistic:
+            statistic = self.durations[min(self.durations, key=lambda known_batch_size: abs(known_batch_size - batch_size))]
+        return statistic.get_estimate()
+
+
+    def get_throughput(self, batch_size=1):
+        """Get the estimated number of jobs per second the worker finishes with the given batch size.
+
+        Args:
+            batch_size (int, optional): Effective batch size. Defaults to 1.
+
+        Returns:
+            Estimate: Estimated throughput in jobs per second or None if no job was finished yet
+        """
+        duration = self.get_job_duration(batch_size)
+        if duration:
+            return Estimate(
+                batch_size / duration.value,
+                batch_size / duration.upper,
+                batch_size / duration.lower if duration.lower else math.inf
+            )
+
+
+    def to_dict(self):
+        return {
+            'job_durations': {batch_size: statistic.to_dict() for batch_size, statistic in sorted(self.durations.items())},
+            'tokens_per_second': self.tokens_per_second.to_dict() if self.tokens_per_second.count else None
+        }
+
+
+def estimate_queue_time(num_jobs_ahead, workers, include_job_duration=True):
+    """Estimate the time until a queued job with num_jobs_ahead jobs in front of it in the queue is finished by the given
+    pool of workers. The job starts as soon as the jobs ahead fill the free batch slots of the workers and enough of the
+    running and queued jobs are finished at the combined throughput of all workers running with full batches. Workers
+    without finished jobs yet are assumed to be as fast as the mean of the known workers.
+
+    Args:
+        num_jobs_ahead (int): Number of jobs in front of the job in the queue
+        workers (list): Online workers (Worker) processing the queue
+        include_job_duration (bool, optional): Whether the compute duration of the job itself is included, otherwise
+            the time until the job is started is estimated. Defaults to True.
+
+    Returns:
+        Estimate: Estimated time in seconds until the job is finished or None if there are no workers or no finished jobs yet
+    """
+    known_workers = [worker for worker in workers if worker.throughput_model.has_samples]
+    if not known_workers:
+        return None
+    throughputs = [worker.throughput_model.get_throughput(worker.batch_capacity) for worker in known_workers]
+    durations = [worker.throughput_model.get_job_duration(worker.batch_capacity) for worker in known_workers]
+    pool_factor = len(workers) / len(known_workers)
+    pool_throughput = Estimate(*(sum(getattr(throughput, bound) for throughput in throughputs) * pool_factor for bound in ('value', 'lower', 'upper')))
+    job_duration = Estimate(*(
+        sum(getattr(duration, bound) for duration in durations) / len(durations) if include_job_duration else 0
+        for bound in ('value', 'lower', 'upper')
+    ))
+
+    free_slots = sum(max(0, worker.batch_capacity - len(worker.running_jobs)) for worker in workers)
+    num_jobs_to_finish = max(0, num_jobs_ahead - free_slots + 1)
+    return Estimate(
+        num_jobs_to_finish / pool_throughput.value + job_duration.value,
+        num_jobs_to_finish / pool_throughput.upper + job_duration.lower,
+        num_jobs_to_finish / pool_throughput.lower + job_duration.upper
+    )
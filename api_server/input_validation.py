@@ -1,8 +1,9 @@
 
 import operator
 import json
-from .utils.ffmpeg import FFmpeg, MediaParams, FORMAT_CODEC_DICT
+from .utils.ffmpeg import FFmpeg, MediaParams, MediaUpload, FORMAT_CODEC_DICT
 from .utils.misc import shorten_strings, run_in_executor
+from .utils.media_cache import MediaConversionCache
 
 TYPES_DICT = {
     'string': str,
@@ -20,6 +21,123 @@ TYPES_DICT = {
     'text_context': str
     }
 MEDIA_TYPES = ['image', 'audio', 'video']
+BOOL_STRINGS = {'true': True, '1': True, 'false': False, '0': False}
+
+
+def parse_string_value(value, value_type):
+    """Parse the string form of an input parameter value, like sent in form data or in the query string. Booleans are
+    parsed from 'true', 'false', '1' and '0', since bool('false') is True.
+
+    Args:
+        value (str): String value
+        value_type (type): Type to convert the value to
+
+    Raises:
+        ValueError: If the value can't be converted to the type
+
+    Returns:
+        Converted value
+    """
+    if value_type is bool:
+        parsed_value = BOOL_STRINGS.get(value.strip().lower())
+        if parsed_value is None:
+            raise ValueError(f'Invalid boolean value: {value}')
+        return parsed_value
+    return value_type(value)
+
+
+class ValueSpec():
+    """Limits and supported values of an input parameter or of a media attribute, read once from its configuration.
+    The supported values are kept as list for error messages and as frozenset for lookups in constant time.
+
+    Args:
+        config (dict): Configuration of the value
+        supported (list, optional): Supported values. Defaults to None.
+        default (optional): Default value. Defaults to None.
+    """
+    def __init__(self, config, supported=None, default=None):
+        self.config = config or dict()
+        self.supported = supported
+        self.supported_set = self.get_frozenset(supported)
+        self.default = default
+        self.auto_convert = self.config.get('auto_convert')
+        self.maximum = self.config.get('max') or self.config.get('maximum')
+        self.minimum = self.config.get('min') or self.config.get('minimum')
+        self.align = self.config.get('align')
+
+
+    @staticmethod
+    def get_frozenset(values):
+        if isinstance(values, (list, tuple)):
+            try:
+                return frozenset(values)
+            except TypeError:
+                pass # Unhashable supported values like lists are looked up in the list
+
+
+    def is_supported(self, value):
+        if self.supported_set is not None:
+            try:
+                return value in self.supported_set
+            except TypeError:
+                pass
+        return value in self.supported
+
+
+class InputParameterSpec(ValueSpec):
+    """Validation plan of an input parameter compiled from its endpoint configuration at server start, so the 
+    validation of a request doesn't walk through the configuration again. Media input parameters hold the specs of their 
+    media attributes with the supported values already converted to the ffmpeg names, chat context parameters the specs 
+    of the supported media types.
+
+    Args:
+        name (str): Name of the input parameter
+        config (dict): Endpoint configuration of the input parameter
+        param_type (str, optional): Type of the input parameter. Defaults to the type in config or 'string'.
+    """
+    def __init__(self, name, config, param_type=None):
+        super().__init__(config, config.get('supported'), config.get('default'))
+        self.name = name
+        self.param_type = param_type or config.get('type', 'string')
+        self.required = config.get('required')
+        self.max_length = config.get('max_length')
+        if self.param_type == 'selection':
+            expected_value = self.default or (self.supported[0] if self.supported else None)
+            self.expected_value_type = type(expected_value) if expected_value is not None else None
+        else:
+            self.expected_value_type = TYPES_DICT.get(self.param_type)
+        self.media_attributes = dict() # key: media attribute name, value: ValueSpec
+        if self.param_type in MEDIA_TYPES:
+            for attribute_name, attribute_config in config.items():
+                if isinstance(attribute_config, dict):
+                    self.media_attributes[attribute_name] = ValueSpec(
+                        attribute_config,
+                        FFmpeg.get_ffmpeg_conform_parameter(attribute_config.get('supported'), attribute_name),
+                        FFmpeg.get_ffmpeg_conform_parameter(attribute_config.get('default'), attribute_name)
+                    )
+        self.media_specs = dict() # key: media type supported in chat context, value: InputParameterSpec
+        if self.param_type == 'chat_context':
+            for media_type in config.get('support', []):
+                if media_type in MEDIA_TYPES:
+                    self.media_specs[media_type] = InputParameterSpec(name, config.get(media_type, {}), media_type)
+
+
+    def parse_form_value(self, value):
+        """Convert the string value of a form field or query parameter to the type of a bool, int or float input 
+        parameter. Values that can't be converted are returned unchanged and rejected by the validation.
+
+        Args:
+            value: Value of the form field or query parameter
+
+        Returns:
+            Converted value
+        """
+        if isinstance(value, str) and self.expected_value_type in (bool, int, float):
+            try:
+                return parse_string_value(value, self.expected_value_type)
+            except ValueError:
+                pass
+        return value
 
 
 class InputValidationHandler():
@@ -29,20 +147,28 @@ class InputValidationHandler():
         input_params (dict): Dictionary containing all input parameters.
         ep_input_param_config (dict): Endpoint configuration of all input parameters.
         server_input_param_config (dict): Server configuration of all input parameters.
+        endpoint_name (str, optional): Name of the endpoint, to apply its quota of concurrent ffmpeg processes. Defaults to None.
+        input_param_specs (dict, optional): Compiled input parameters from compile_input_param_specs(). Defaults to None (compiled from ep_input_param_config).
     """       
+    media_cache = None # MediaConversionCache shared by all requests, initialized from [MEDIA_CACHE] in the server config
 
-    def __init__(self, input_params, ep_input_param_config, server_input_param_config):
+    def __init__(self, input_params, ep_input_param_config, server_input_param_config, endpoint_name=None, input_param_specs=None):
         """Handler to validate and convert API server input parameters.
 
         Args:
             input_params (dict): Dictionary containing all input parameters.
             ep_input_param_config (dict): Endpoint configuration of all input parameters.
             server_input_param_config (dict): Server configuration of all input parameters.
+            endpoint_name (str, optional): Name of the endpoint, to apply its quota of concurrent ffmpeg processes. Defaults to None.
+            input_param_specs (dict, optional): Compiled input parameters from compile_input_param_specs(). Defaults to None (compiled from ep_input_param_config).
         """        
         self.input_params = input_params
         self.ep_input_param_config = ep_input_param_config
         self.server_input_param_config = server_input_param_config
+        self.endpoint_name = endpoint_name
+        self.input_param_specs = input_param_specs or self.compile_input_param_specs(ep_input_param_config)
         self.validation_errors = list()
+        self.spec = None
         self.param_config = dict()
         self.param_type = str()
         self.ep_input_param_name = str()
@@ -50,6 +176,20 @@ class InputValidationHandler():
         self.convert_data = False
 
 
+    @staticmethod
+    def compile_input_param_specs(ep_input_param_config):
+        """Compile the endpoint configuration of the input parameters to validation plans. Called once per endpoint at 
+        server start, the plans are shared by all requests of the endpoint.
+
+        Args:
+            ep_input_param_config (dict): Endpoint configuration of all input parameters.
+
+        Returns:
+            dict: Key: name of the input parameter, value: InputParameterSpec
+        """
+        return {param_name: InputParameterSpec(param_name, param_config) for param_name, param_config in ep_input_param_config.items()}
+
+
     async def validate_input_parameters(self):
         """Validate all input parameters.
 
@@ -58,16 +198,19 @@ class InputValidationHandler():
         """        
         job_data = dict()
         self.check_for_unknown_parameters()
-        for ep_input_param_name, param_config in self.ep_input_param_config.items():
-            self.param_config = param_config
-            self.param_type = param_config.get('type', 'string')
-            self.ep_input_param_name = ep_input_param_name
+        for ep_input_param_name, spec in self.input_param_specs.items():
+            self.set_spec(spec)
             value = self.validate_required_argument(self.input_params.get(ep_input_param_name))       
             value = self.validate_input_type(value)
             if self.param_type == 'selection':
                 job_data[ep_input_param_name] = self.validatate_selection_parameter(value)
             elif isinstance(value, (int, float)):
                 job_data[ep_input_param_name] = self.validate_number(value)
+            elif isinstance(value, (bytes, MediaUpload)) and self.param_type in MEDIA_TYPES:
+                if FFmpeg.ffmpeg_installed:
+                    job_data[ep_input_param_name] = await self.validate_media(value)
+                else:
+                    self.validation_errors.append('Media input parameters like "image" and "audio" are disabled since FFmpeg is not installed on the API Server!')
             elif isinstance(value, str):
                 if self.param_type == 'string':
                     job_data[ep_input_param_name] = self.validate_string(value)
@@ -88,17 +231,25 @@ class InputValidationHandler():
                         job_data[ep_input_param_name] = self.validate_text_context(value)
                 elif self.param_type in MEDIA_TYPES:
                     if FFmpeg.ffmpeg_installed:
-                        job_data[ep_input_param_name] = await self.validate_media_base64_string(value)
+                        job_data[ep_input_param_name] = await self.validate_media(value)
                     else:
                         self.validation_errors.append('Media input parameters like "image" and "audio" are disabled since FFmpeg is not installed on the API Server!')
 
         return job_data, self.validation_errors
 
 
+    def set_spec(self, spec):
+        self.spec = spec
+        self.param_config = spec.config
+        self.param_type = spec.param_type
+        self.ep_input_param_name = spec.name
+
+
     def get_all_parameters_of_type_chat_context(self):
         chat_context_parameters = list()
         for param_name, param_value in self.input_params.items():
-            if param_value and self.ep_input_param_config.get(param_name, {}).get('type') == 'chat_context':
+            spec = self.input_param_specs.get(param_name)
+            if param_value and spec and spec.param_type == 'chat_context':
                 chat_context_parameters.append(param_name)
         return chat_context_parameters
     
@@ -106,7 +257,7 @@ class InputValidationHandler():
     def check_for_unknown_parameters(self):
         unknown_params = list()
         for param in self.input_params.keys():
-            if param not in self.ep_input_param_config:
+            if param not in self.input_param_specs:
                 unknown_params.append(param)
         if unknown_params:
             self.validation_errors.append(f'Invalid input parameter(s): {", ".join(unknown_params)}')
@@ -114,38 +265,37 @@ class InputValidationHandler():
 
     def validate_required_argument(self, value):
         if value is None:
-            if self.param_config.get('required'):
+            if self.spec.required:
                 self.validation_errors.append(f'Missing required argument: {self.ep_input_param_name}')
             else:
-                return self.param_config.get('default', None)
+                return self.spec.default
         return value
 
     def validatate_selection_parameter(self, value):
-        if value not in self.param_config.get('supported'):
-            if self.param_config.get('auto_convert') == True:
-                if self.param_config.get('default'):
-                    return self.param_config.get('default')
-                elif self.param_config.get('supported'):
-                    return self.param_config.get('supported')[0]
+        if not self.spec.is_supported(value):
+            if self.spec.auto_convert == True:
+                if self.spec.default:
+                    return self.spec.default
+                elif self.spec.supported:
+                    return self.spec.supported[0]
             else:
                 self.validation_errors.append(
-                    f'Parameter {self.ep_input_param_name} = {value} not in supported values {self.param_config.get("supported")}!'
+                    f'Parameter {self.ep_input_param_name} = {value} not in supported values {self.spec.supported}!'
                     f'\nSet auto_convert = true for {self.ep_input_param_name} in the [INPUT] section of the endpoint config file to avoid this error.\n')
         else:
             return value
 
 
     def validate_input_type(self, value):
-        if self.param_config.get('type') == 'selection':
-            expected_value_type = type(self.param_config.get('default') or self.param_config.get('supported')[0])
-        else:
-            expected_value_type = TYPES_DICT[self.param_config.get('type', 'string')]
+        if isinstance(value, (bytes, MediaUpload)) and self.param_type in MEDIA_TYPES:
+            return value
+        expected_value_type = self.spec.expected_value_type or TYPES_DICT[self.param_type]
         if value is not None and not isinstance(value, expected_value_type):
             if expected_value_type in (int, float) and isinstance(value, (int, float)):
                 return expected_value_type(value)
-            elif self.param_config.get('auto_convert'):
+            elif self.spec.auto_convert:
                 try:
-                    return expected_value_type(value)
+                    return parse_string_value(value, expected_value_type) if isinstance(value, str) else expected_value_type(value)
                 except (ValueError, TypeError):
                     self.validation_errors.append(f'Could not convert {self.ep_input_param_name}={shorten_strings(value)} from {type(value)} to {expected_value_type}!')
             else:
@@ -159,14 +309,14 @@ class InputValidationHandler():
         return self.validate_numerical_value(
             param_value,
             self.ep_input_param_name,
-            self.param_config
+            self.spec
         )
         
 
     def validate_string(self, value):
-        max_length = self.param_config.get('max_length', None)
+        max_length = self.spec.max_length
         if max_length is not None and len(value) > max_length:
-            if self.param_config.get('auto_convert'):
+            if self.spec.auto_convert:
                 return max_length
             else:
                 self.validation_errors.append(f'Length of argument {self.ep_input_param_name}={shorten_strings(value)} exceeds the maximum length ({max_length})!')
@@ -236,10 +386,14 @@ class InputValidationHandler():
         for media_type in MEDIA_TYPES:
             multimodal_data = item.get(media_type)
             if multimodal_data:
-                if media_type in self.param_config.get('support', []):
-                    self.param_type = media_type
-                    self.param_config = self.param_config.get(media_type, {})
-                    item[media_type] = await self.validate_media_base64_string(multimodal_data)
+                chat_context_spec = self.spec
+                media_spec = chat_context_spec.media_specs.get(media_type)
+                if media_spec:
+                    self.set_spec(media_spec)
+                    try:
+                        item[media_type] = await self.validate_media(multimodal_data)
+                    finally:
+                        self.set_spec(chat_context_spec)
                 else:
                     self.validation_errors.append(
                         f'Media of type {media_type} is not allowed in input parameter {self.ep_input_param_name}'
@@ -257,37 +411,64 @@ class InputValidationHandler():
                 )
 
 
-    async def validate_media_base64_string(self, media_base64):
-        """Validation of given base64 representation of media input parameter. Checks the media attributes with ffprobe and validates it with the server and the endpoint configuration. 
+    async def validate_media(self, media):
+        """Validation of given base64 representation or binary data of media input parameter. Checks the media attributes with ffprobe and validates it with the server and the endpoint configuration. 
         If auto_convert is True in endpoint configuration, media input parameter will be converted to valid target media attributes with ffmpeg defined in the endpoint config.
+        Binary and converted media is returned as MediaBytes, so it is only base64 encoded if it is sent as JSON to an API worker.
 
         Args:
-            media_base64 (str): Base64 representation of media input parameter
+            media (str, bytes or MediaUpload): Base64 representation, binary data or streamed upload of media input parameter
 
         Returns:
-            str: Base64 representation of validated and converted media input parameter
+            str or MediaBytes: Base64 representation of unconverted base64 input or binary data of validated and converted media input parameter
         """        
+        if self.media_cache:
+            cache_key = await run_in_executor(
+                MediaConversionCache.get_key,
+                    media,
+                    self.param_type,
+                    self.param_config,
+                    self.server_input_param_config.get(self.param_type)
+            )
+            cached_media = await self.media_cache.get(cache_key)
+            if cached_media is not None:
+                return cached_media
+        validated_media = await self.analyze_and_convert_media(media)
+        if self.media_cache and validated_media is not None and not self.validation_errors:
+            await self.media_cache.put(cache_key, validated_media)
+        return validated_media
+
+
+    async def analyze_and_convert_media(self, media):
         ffmpeg_media = FFmpeg(
             self.ep_input_param_name,
-            media_base64,
+            media if isinstance(media, str) else None,
             self.param_config,
             self.validation_errors,
-            arg_type=self.param_type
+            media_binary=media if isinstance(media, bytes) else None,
+            media_upload=media if isinstance(media, MediaUpload) else None,
+            arg_type=self.param_type,
+            endpoint_name=self.endpoint_name
         )
-        await ffmpeg_media.analyze()
-        if not self.validation_errors:
-            await run_in_executor(
-                self.validate_media_parameters_on_server,
-                    ffmpeg_media.media_params
-            )
-            target_media_params = await run_in_executor(
-                self.validate_media_parameters_on_endpoint,
-                    ffmpeg_media.media_params
-            )
+        try:
+            await ffmpeg_media.analyze()
             if not self.validation_errors:
-                if target_media_params != {key: value for key, value in ffmpeg_media.media_params.items() if key != "encoder"}:
-                    await ffmpeg_media.convert(target_media_params)
-                return await ffmpeg_media.get_data()
+                await run_in_executor(
+                    self.validate_media_parameters_on_server,
+                        ffmpeg_media.media_params
+                )
+                target_media_params = await run_in_executor(
+                    self.validate_media_parameters_on_endpoint,
+                        ffmpeg_media.media_params
+                )
+                if not self.validation_errors:
+                    if target_media_params != {key: value for key, value in ffmpeg_media.media_params.items() if key != "encoder"}:
+                        await ffmpeg_media.convert(target_media_params)
+                    if isinstance(media, str) and not ffmpeg_media.media_converted:
+                        return await ffmpeg_media.get_data('base64')
+                    return await ffmpeg_media.get_data('media_bytes')
+        finally:
+            await ffmpeg_media.remove_temp_files()
 
 
     def validate_media_parameters_on_server(self, params):
@@ -350,24 +531,23 @@ class InputValidationHandler():
 
     def validate_supported_values(self, param_value, param_name):
         
-        arg_param_definition = self.param_config.get(param_name)
-        if arg_param_definition:
-            supported_value_list = FFmpeg.get_ffmpeg_conform_parameter(arg_param_definition.get('supported'), param_name)
+        attribute_spec = self.spec.media_attributes.get(param_name)
+        if attribute_spec and attribute_spec.config:
+            supported_value_list = attribute_spec.supported
             param_value = FFmpeg.get_ffmpeg_conform_parameter(param_value, param_name)
             value_container = param_value.split(',') if isinstance(param_value, str) else [param_value]
             if supported_value_list:
                 for value in value_container:
-                    if value in supported_value_list:
+                    if attribute_spec.is_supported(value):
                         return value
-                if not any(value in supported_value_list for value in value_container):
-                    if arg_param_definition.get('auto_convert'):
-                        return FFmpeg.get_ffmpeg_conform_parameter(arg_param_definition.get('default'), param_name)
-                    else: 
-                        self.validation_errors.append(
-                            f'{"Invalid" if param_value else "Unknown"} {param_name}{": " + param_value + " " if param_value else ""}!\n'+\
-                            f'Only {", ".join(supported_value_list)} are supported by this endpoint!\n'+\
-                            f'Set {param_name}.{{ auto_convert = true }} in the [INPUT] section of the endpoint config file to avoid this error.'
-                        )
+                if attribute_spec.auto_convert:
+                    return attribute_spec.default
+                else: 
+                    self.validation_errors.append(
+                        f'{"Invalid" if param_value else "Unknown"} {param_name}{": " + param_value + " " if param_value else ""}!\n'+\
+                        f'Only {", ".join(supported_value_list)} are supported by this endpoint!\n'+\
+                        f'Set {param_name}.{{ auto_convert = true }} in the [INPUT] section of the endpoint config file to avoid this error.'
+                    )
             else:
                 return param_value
         else:
@@ -378,33 +558,33 @@ class InputValidationHandler():
         target_param_value = self.validate_numerical_value(
             param_value,
             f'{self.ep_input_param_name}.{param_name}',
-            self.param_config.get(param_name)
+            self.spec.media_attributes.get(param_name)
         )
         return target_param_value
 
 
-    def validate_numerical_value(self, param_value, param_name, definition):
-        if definition:
+    def validate_numerical_value(self, param_value, param_name, value_spec):
+        if value_spec and value_spec.config:
             param_value = self.convert_to_limit(
                 param_value,
                 param_name,
-                definition.get('max') or definition.get('maximum'),
-                definition.get('auto_convert'),
+                value_spec.maximum,
+                value_spec.auto_convert,
                 'max'
             )
             param_value = self.convert_to_limit(
                 param_value,
                 param_name,
-                definition.get('min') or definition.get('minimum'),
-                definition.get('auto_convert'),
+                value_spec.minimum,
+                value_spec.auto_convert,
                 'min'
             )
             return self.convert_to_align_value(
                 param_value,
                 param_name,
-                definition.get('align'),
-                definition.get('min') or definition.get('minimum'),
-                definition.get('auto_convert')
+                value_spec.align,
+                value_spec.minimum,
+                value_spec.auto_convert
             )
         else:
             return param_value
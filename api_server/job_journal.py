@@ -0,0 +1,254 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import os
+import json
+import time
+import fcntl
+import asyncio
+from pathlib import Path
+from sanic.log import logging
+
+from .utils.ffmpeg import MediaBytes
+from .utils.misc import run_in_executor
+
+logger = logging.getLogger('API')
+
+MEGABYTE = 1024 * 1024
+
+
+class JobJournalError(Exception):
+    pass
+
+
+class JobJournal():
+    """Append-only journal of the jobs of the job handler, so queued, processing and finished jobs survive a restart of
+    the API server. Each line of the journal file is a JSON event:
+
+        new: Job was created, with endpoint name, job data, API key and priority class
+        start: Job was started by a worker
+        progress: Last progress update of the worker (checkpoint)
+        result: Worker sent the result of the job
+        cancel, lapse: Job was canceled or lapsed
+        done: Client fetched the result
+        delete: Job was deleted after its result lifetime
+
+    Events are buffered and written by a background task every flush_interval seconds with a single write and fsync
+    (group commit), so logging an event never waits for the disk. Progress events of the same job in the buffer replace
+    each other. If the file exceeds max_size, it is rewritten with a snapshot of the current jobs. The lock file
+    <file>.lock is locked for the lifetime of the journal, so only one server process writes the journal, also while
+    the journal file is replaced by the compaction.
+
+    Args:
+        file (str): Path of the journal file
+        flush_interval (float, optional): Time in seconds events are collected before they are written. Defaults to 0.1.
+        fsync (bool, optional): Whether every write is synced to the disk. Defaults to True.
+        max_size (int, optional): Size of the journal file in bytes to compact it at. Defaults to 256 MB.
+    """
+    def __init__(self, file, flush_interval=0.1, fsync=True, max_size=256 * MEGABYTE):
+        self.file = Path(file)
+        self.lock_file = self.file.with_name(f'{self.file.name}.lock')
+        self.lock_file_handle = None
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_size = max_size
+        self.file_handle = None
+        self.events = list() # Encoded events not written yet
+        self.progress_events = dict() # key: job_id, value: index of the buffered progress event of the job in self.events
+        self.event_added = asyncio.Event()
+        self.commit_task = None
+        self.stopping = False
+        self.get_snapshot = None # Coroutine function returning the events describing the current jobs, for compaction
+        self.size = 0
+        self.num_events = 0
+        self.num_commits = 0
+        self.num_compactions = 0
+
+
+    @classmethod
+    def from_config(cls, config):
+        """Create the journal from the section [JOB_JOURNAL] of the server configuration.
+
+        Args:
+            config (dict): Job journal configuration with enabled, file, flush_interval, fsync and max_size in MB
+
+        Returns:
+            JobJournal: Job journal or None if the journal is disabled
+        """
+        if config.get('enabled'):
+            return cls(
+                config.get('file') or 'aime_api_server_jobs.journal',
+                config.get('flush_interval', 0.1),
+                config.get('fsync', True),
+                config.get('max_size', 256) * MEGABYTE
+            )
+
+
+    def open(self):
+        """Lock the lock file and open the journal file.
+
+        Raises:
+            JobJournalError: If the journal is locked by another process or can't be opened
+        """
+        try:
+            self.file.parent.mkdir(parents=True, exist_ok=True)
+            lock_file_handle = open(self.lock_file, 'ab')
+        except OSError as error:
+            raise JobJournalError(f'Could not open lock file of job journal {self.lock_file}: {error}')
+        try:
+            fcntl.flock(lock_file_handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file_handle.close()
+            raise JobJournalError(f'Job journal {self.file} is locked by another process')
+        try:
+            self.file_handle = open(self.file, 'ab')
+        except OSError as error:
+            lock_file_handle.close()
+            raise JobJournalError(f'Could not open job journal {self.file}: {error}')
+        self.lock_file_handle = lock_file_handle
+        self.size = self.file.stat().st_size
+
+
+    def replay(self):
+        """Read the journal file and merge the events per job. Incomplete lines written during a crash are skipped.
+
+        Returns:
+            dict: key: job_id, value: dict with the last event of each event type of the job, in the order the jobs were created
+        """
+        jobs = dict()
+        try:
+            with open(self.file, 'rb') as file:
+                for line in file:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        logger.warning(f'Skipped invalid line in job journal {self.file}')
+                        continue
+                    job_id = event.get('job_id')
+                    event_type = event.get('event')
+                    if event_type == 'new':
+                        jobs.pop(job_id, None)
+                        jobs[job_id] = {'new': event}
+                    elif event_type == 'delete':
+                        jobs.pop(job_id, None)
+                    elif job_id in jobs:
+                        jobs[job_id][event_type] = event
+        except FileNotFoundError:
+            pass
+        return jobs
+
+
+    def log_event(self, event, job_id, **kwargs):
+        """Add an event to the buffer without waiting for the disk.
+
+        Args:
+            event (str): Event type, like 'new' or 'result'
+            job_id (str): Job id
+            kwargs: Data of the event
+        """
+        line = self.encode({'event': event, 'job_id': job_id, 'time': time.time(), **kwargs})
+        if event == 'progress':
+            index = self.progress_events.get(job_id)
+            if index is not None:
+                self.events[index] = line # Only the last progress checkpoint is needed
+                return
+            self.progress_events[job_id] = len(self.events)
+        self.events.append(line)
+        self.num_events += 1
+        self.event_added.set()
+
+
+    def start(self):
+        if self.commit_task is None:
+            self.commit_task = asyncio.ensure_future(self.commit_events())
+
+
+    async def stop(self):
+        """Stop the background task, write the remaining events and close the journal file. The background task isn't
+        canceled, since a canceled commit would leave the write of its events running in the executor.
+        """
+        if self.commit_task is not None:
+            self.stopping = True
+            self.event_added.set()
+            await self.commit_task
+            self.commit_task = None
+        await self.commit()
+        if self.file_handle is not None:
+            self.file_handle.close()
+            self.file_handle = None
+        if self.lock_file_handle is not None:
+            self.lock_file_handle.close() # Releases the lock
+            self.lock_file_handle = None
+
+
+    async def commit_events(self):
+        while not self.stopping:
+            await self.event_added.wait()
+            self.event_added.clear()
+            if self.flush_interval and not self.stopping:
+                await asyncio.sleep(self.flush_interval) # Collect further events for the group commit
+            await self.commit()
+            if self.size > self.max_size and self.get_snapshot:
+                await self.compact()
+
+
+    async def commit(self):
+        if self.events and self.file_handle is not None:
+            events = self.events
+            self.events = list()
+            self.progress_events.clear()
+            try:
+                self.size += await run_in_executor(self.write_events, self.file_handle, events)
+                self.num_commits += 1
+            except OSError as error:
+                logger.error(f'Could not write {len(events)} events to job journal {self.file}: {error!r}')
+
+
+    async def compact(self):
+        """Rewrite the journal file with the events describing the current jobs. Events logged while the snapshot is
+        taken stay in the buffer and are written after the snapshot. They don't conflict with the snapshot, since
+        replaying an event of a job twice leads to the same job.
+        """
+        events = [self.encode(event) for event in await self.get_snapshot()]
+        temp_file = self.file.with_name(f'{self.file.name}.tmp')
+        try:
+            file_handle = open(temp_file, 'wb')
+        except OSError as error:
+            logger.error(f'Could not compact job journal {self.file}: {error!r}')
+            return
+        try:
+            size = await run_in_executor(self.write_events, file_handle, events)
+            os.replace(temp_file, self.file) # The file handle stays open and appends to the new journal file
+        except OSError as error:
+            file_handle.close()
+            logger.error(f'Could not compact job journal {self.file}: {error!r}')
+            return
+        self.file_handle.close()
+        self.file_handle = file_handle
+        self.size = size
+        self.num_compactions += 1
+
+
+    def write_events(self, file_handle, events):
+        data = b''.join(events)
+        file_handle.write(data)
+        file_handle.flush()
+        if self.fsync:
+            os.fsync(file_handle.fileno())
+        return len(data)
+
+
+    @staticmethod
+    def encode(event):
+        return json.dumps(event, default=MediaBytes.json_default).encode() + b'\n'
+
+
+    def get_status(self):
+        return {
+            'size': self.size,
+            'num_buffered_events': len(self.events),
+            'num_events': self.num_events,
+            'num_commits': self.num_commits,
+            'num_compactions': self.num_compactions
+        }
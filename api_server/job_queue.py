@@ -4,16 +4,26 @@
 
 import asyncio
 import threading
+import itertools
+import collections
+import math
 from dataclasses import dataclass, asdict
 import statistics
 import time
-from .utils.misc import shorten_strings, get_job_counter_id
+from sanic.log import logging
+from .utils.misc import shorten_strings, get_job_counter_id, run_in_executor
 import uuid
 import hashlib
 from .__version import __version__
+from .estimator import ThroughputModel, Estimate, estimate_queue_time
+from .result_store import ResultStore
+from .job_journal import JobJournal, JobJournalError
 
+logger = logging.getLogger('API')
 
-WEIGHT_FACTOR_ALPHA = 0.05
+RANK_INDEX_MIN_SIZE = 64
+DEFAULT_BATCH_SCAN_WINDOW = 64
+DEFAULT_BATCH_MAX_AGE = 10
 
 class JobState():
     UNKNOWN = 'unknown'
@@ -24,6 +34,11 @@ class JobState():
     LAPSED = 'lapsed'
 
 
+class QueueScheduler():
+    FIFO = 'fifo'
+    FAIR_SHARE = 'fair_share'
+
+
 class WorkerState():
     PROCESSING = 'processing'
     WAITING = 'waiting'
@@ -32,15 +47,256 @@ class WorkerState():
 
 
 class AtomicCounter():
+    """Counter shared by the coroutines of the event loop. The increment contains no await, so it can't be interrupted
+    by another coroutine and needs no lock.
+    """
+    __slots__ = ('_counter', )
+
     def __init__(self):
         self._counter = 0
-        self._lock = asyncio.Lock()
-        
+
 
     async def next(self):
-        async with self._lock:
-            self._counter += 1
-            return self._counter
+        self._counter += 1
+        return self._counter
+
+
+    def advance_to(self, value):
+        self._counter = max(self._counter, value)
+
+
+class JobSettings():
+    """Timeouts of the jobs of an endpoint. Created once per endpoint and shared by reference by all its jobs, so the
+    endpoint configuration isn't looked up for every new job.
+
+    Args:
+        job_inactivity_timeout (float): Time in seconds a processing job may get no progress update before it lapses
+        max_time_in_queue (float): Time in seconds a job may wait in the queue before it lapses
+        result_lifetime (float): Time in seconds the result of a finished job is kept
+    """
+    __slots__ = ('job_inactivity_timeout', 'max_time_in_queue', 'result_lifetime')
+
+    def __init__(self, job_inactivity_timeout, max_time_in_queue, result_lifetime):
+        self.job_inactivity_timeout = job_inactivity_timeout
+        self.max_time_in_queue = max_time_in_queue
+        self.result_lifetime = result_lifetime
+
+
+    @classmethod
+    def from_config(cls, config):
+        """Create the job settings from the section [ENDPOINT] of the endpoint configuration.
+
+        Args:
+            config (dict): Endpoint configuration
+
+        Returns:
+            JobSettings: Job settings of the endpoint
+        """
+        return cls(
+            config.get('job_inactivity_timeout'),
+            config.get('max_time_in_queue'),
+            config.get('result_lifetime')
+        )
+
+
+class FenwickTree():
+    """Binary indexed tree over a fixed number of slots. Supports point updates and prefix sums in O(log n).
+
+    Args:
+        size (int): Number of slots
+    """
+    def __init__(self, size):
+        self.size = size
+        self._tree = [0] * (size + 1)
+
+
+    def add(self, index, value):
+        index += 1
+        while index <= self.size:
+            self._tree[index] += value
+            index += index & -index
+
+
+    def prefix_sum(self, index):
+        """Sum of the slots [0, index).
+        """
+        total = 0
+        while index > 0:
+            total += self._tree[index]
+            index -= index & -index
+        return total
+
+
+    def range_sum(self, start, end):
+        """Sum of the slots [start, end) on the ring of all slots, so start > end wraps around.
+        """
+        if start <= end:
+            return self.prefix_sum(end) - self.prefix_sum(start)
+        else:
+            return self.prefix_sum(self.size) - self.prefix_sum(start) + self.prefix_sum(end)
+
+
+class BatchPolicy():
+    """Batch compatibility policy of a job type, configured in the [WORKER] section of the endpoint config.
+    Jobs are only batched together if they got the same group key, built from the job inputs listed in batch_group_by.
+    Each input is mapped to a bucket of the given bucket size: numbers by their value, strings, binary media, lists and
+    chat contexts by their length. A bucket size of 0 requires equal values.
+
+    Args:
+        worker_config (dict): [WORKER] section of the endpoint config
+
+    Examples:
+
+        Endpoint config:
+
+        .. highlight:: toml
+        .. code-block:: toml
+
+            [WORKER]
+            batch_group_by = { chat_context = 4096 }    # Batch chat contexts of similar length in buckets of 4096 characters
+            batch_group_by = { height = 0, width = 0, num_samples = 0 }   # Only batch images with the same size and number of samples
+            batch_scan_window = 64  # Number of queued jobs scanned for compatible jobs
+            batch_max_age = 10  # Time in seconds after which a queued job can't be overtaken by younger compatible jobs anymore
+    """
+    def __init__(self, worker_config):
+        self.group_by = worker_config.get('batch_group_by') or dict()
+        self.scan_window = worker_config.get('batch_scan_window', DEFAULT_BATCH_SCAN_WINDOW)
+        self.max_age = worker_config.get('batch_max_age', DEFAULT_BATCH_MAX_AGE)
+
+
+    def get_group_key(self, job):
+        """Get the batch group key of the given job. Jobs with equal group keys are compatible to be processed in the same batch.
+
+        Args:
+            job (Job): Job object
+
+        Returns:
+            tuple: Bucket of each input in batch_group_by
+        """
+        return tuple(
+            self.get_bucket(job.job_data.get(input_name), bucket_size)
+            for input_name, bucket_size in self.group_by.items()
+        )
+
+
+    def get_bucket(self, value, bucket_size):
+        if not bucket_size:
+            return self.get_hashable_value(value)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            size = value
+        elif isinstance(value, (str, bytes)):
+            size = len(value)
+        elif isinstance(value, list):
+            size = sum(
+                len(str(item.get('content', ''))) if isinstance(item, dict) else len(str(item))
+                for item in value
+            )
+        else:
+            return self.get_hashable_value(value)
+        return int(size // bucket_size)
+
+
+    @staticmethod
+    def get_hashable_value(value):
+        """Get a hashable representation of the given job input, which is equal for equal inputs.
+
+        Args:
+            value: Job input
+
+        Returns:
+            Hashable representation of the job input. Binary media is represented by its hash, lists and dicts by tuples.
+        """
+        if isinstance(value, bytes): # Hash of the data instead of the repr of the whole media
+            return hash(value)
+        elif isinstance(value, (list, tuple)):
+            return tuple(BatchPolicy.get_hashable_value(item) for item in value)
+        elif isinstance(value, dict):
+            return tuple(sorted((key, BatchPolicy.get_hashable_value(item)) for key, item in value.items()))
+        return value
+
+
+class DeadlineScheduler():
+    """Fires a callback exactly when the deadline of a job expires, using the timer heap of the event loop. Each job
+    has at most one pending deadline: max_time_in_queue while queued, job_inactivity_timeout while processing and
+    result_lifetime after the result arrived or the job lapsed. Scheduling a new deadline for a job replaces the pending one.
+    Scheduling and canceling cost O(log n), no periodic sweep over all jobs is needed.
+    """
+    def __init__(self):
+        self.timer_handles = dict() # key: job_id, value: asyncio.TimerHandle
+
+
+    def schedule(self, job_id, deadline, callback, *args):
+        """Schedule the coroutine function callback to be called with args at the given deadline.
+
+        Args:
+            job_id (str): Job id
+            deadline (float): Unix timestamp of the deadline
+            callback (coroutine function): Called with args when the deadline expires
+        """
+        self.cancel(job_id)
+        loop = asyncio.get_running_loop()
+        self.timer_handles[job_id] = loop.call_at(
+            loop.time() + max(0, deadline - time.time()), self.__fire, job_id, callback, args
+        )
+
+
+    def cancel(self, job_id):
+        timer_handle = self.timer_handles.pop(job_id, None)
+        if timer_handle:
+            timer_handle.cancel()
+
+
+    def __fire(self, job_id, callback, args):
+        self.timer_handles.pop(job_id, None)
+        task = asyncio.ensure_future(callback(*args))
+        task.add_done_callback(lambda task: self.__log_exception(task, job_id, callback))
+
+
+    @staticmethod
+    def __log_exception(task, job_id, callback):
+        if not task.cancelled() and task.exception():
+            logger.error(f'Deadline callback {callback.__name__} of job {job_id} failed', exc_info=task.exception())
+
+
+    def __len__(self):
+        return len(self.timer_handles)
+
+
+class FairShareFlow():
+    """Jobs of one API key waiting in a JobQueue with fair share scheduling. All jobs of the API key share one flow, no
+    matter their priority class, so an API key can't get several shares by spreading its jobs across priority classes.
+
+    Args:
+        priority_classes (dict): Weights of the priority classes. The weight of the priority class of the next job is
+            the number of jobs taken from this flow per round.
+    """
+    def __init__(self, priority_classes):
+        self.jobs = collections.deque()
+        self.priority_classes = priority_classes
+        self.deficit = 0
+        self.head_seq = 0 # flow_seq of self.jobs[0]
+        self.next_seq = 0
+
+
+    def append(self, job):
+        job.flow_seq = self.next_seq
+        self.next_seq += 1
+        self.jobs.append(job)
+
+
+    def popleft(self):
+        self.head_seq += 1
+        return self.jobs.popleft()
+
+
+    def drop_removed_jobs_at_head(self):
+        while self.jobs and self.jobs[0].queue_seq is None:
+            self.popleft()
+
+
+    @property
+    def weight(self):
+        return self.priority_classes.get(self.jobs[0].priority_class, 1) if self.jobs else 1
 
 
 class JobQueue(asyncio.Queue):
@@ -48,12 +304,66 @@ class JobQueue(asyncio.Queue):
     via route /endpoint_name with a job_id and collects the job_data. The workers asking for jobs on worker_job_request_json get
     the job_data for the next job in the queue to process. Also monitors states of workers in registered_workers and mean_job_durations.
 
+    Each job gets a monotonically increasing enqueue sequence number job.queue_seq. Jobs removed from the middle of the queue
+    stay as placeholders in self._queue until they reach the head and are counted in a FenwickTree indexed by their
+    sequence number, so the rank of a job is job.queue_seq - head_seq - (removed jobs ahead) in O(log n).
+
+    With the scheduler QueueScheduler.FAIR_SHARE the jobs are additionally kept in one FairShareFlow per API key. The
+    next job is taken from the flows by deficit round robin, so each flow gets a share of the workers weighted by the
+    priority class of its next job, no matter how many jobs other API keys have queued. The rank of a job is then estimated
+    by the number of jobs the other flows get served until the job is reached in its own flow.
+
+    Args:
+        max_length (int): Maximum number of queued jobs
+        scheduler (str): QueueScheduler.FIFO or QueueScheduler.FAIR_SHARE
+        priority_classes (dict): Weights of the priority classes used with fair share scheduling
     """    
-    def __init__(self, max_length):
+    def __init__(self, max_length, scheduler=QueueScheduler.FIFO, priority_classes=None):
+        self.scheduler = scheduler
+        self.priority_classes = priority_classes or dict()
         super().__init__(maxsize=max_length)
         self.max_length = max_length
 
 
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self._head_seq = 0 # queue_seq of self._queue[0]
+        self._next_seq = 0
+        self._num_removed = 0
+        self._removed = FenwickTree(max(RANK_INDEX_MIN_SIZE, maxsize))
+        self.position_version = 0 # Incremented whenever the positions of queued jobs change
+        self.position_changed_event = asyncio.Event()
+        self._flows = dict() # key: api_key, value: FairShareFlow
+        self._active_flows = collections.deque() # keys of self._flows in round robin order
+
+
+    def _put(self, job):
+        if len(self._queue) >= self._removed.size:
+            self.__resize_rank_index(2 * self._removed.size)
+        job.queue_seq = self._next_seq
+        self._next_seq += 1
+        self._queue.append(job)
+        if self.scheduler == QueueScheduler.FAIR_SHARE:
+            self.__put_to_flow(job)
+
+
+    def _get(self):
+        if self.scheduler == QueueScheduler.FAIR_SHARE:
+            job = self.__get_from_flows()
+            self.__mark_removed(job)
+        else:
+            job = self._queue.popleft()
+            self._head_seq += 1
+            job.queue_seq = None
+            self.__drop_removed_jobs_at_head()
+        self.notify_position_change()
+        return job
+
+
+    def qsize(self):
+        return len(self._queue) - self._num_removed
+
+
     @property
     def free_slots(self):
         return self.max_length - len(self)
@@ -65,7 +375,6 @@ class JobQueue(asyncio.Queue):
         Returns:
             dict: Job object of the next job in the queue
         """        
-        await self.remove_lapsed_jobs()
         return await asyncio.wait_for(super().get(), timeout=timeout)
 
 
@@ -84,15 +393,83 @@ class JobQueue(asyncio.Queue):
 
 
     def get_queue(self):
-        return self._queue
+        return [job for job in self._queue if job.queue_seq is not None]
+
+
+    def get_waiting_jobs(self, max_num):
+        """Get up to max_num jobs from the head of the queue in queue order without removing them.
+
+        Args:
+            max_num (int): Maximum number of jobs
+
+        Returns:
+            list: Job objects of the waiting jobs
+        """
+        return list(itertools.islice((job for job in self._queue if job.queue_seq is not None), max_num))
+
+
+    def get_rank(self, job):
+        """Get the position of the given job in the queue starting with 1. Returns 0 if the job is not queued.
+
+        Args:
+            job (Job): Job object
 
+        Returns:
+            int: Position of the job in the queue
+        """        
+        if job.queue_seq is None:
+            return 0
+        if self.scheduler == QueueScheduler.FAIR_SHARE:
+            return self.__get_fair_share_rank(job)
+        num_removed_ahead = self._removed.range_sum(
+            self._head_seq % self._removed.size,
+            job.queue_seq % self._removed.size
+        )
+        return job.queue_seq - self._head_seq - num_removed_ahead + 1
+
+
+    def remove(self, job):
+        """Remove the given job from any position of the queue in O(log n).
+
+        Args:
+            job (Job): Job object
 
-    async def get_rank(self, job_id):
-        await self.remove_lapsed_jobs()
-        for rank, job in enumerate(self._queue):
-            if job.id == job_id:
-                return rank +1
-        return 0
+        Returns:
+            bool: True if the job was queued, False otherwise
+        """        
+        if job.queue_seq is None:
+            return False
+        self.__mark_removed(job)
+        self.task_done()
+        self._wakeup_next(self._putters)
+        self.notify_position_change()
+        return True
+
+
+    def notify_position_change(self):
+        """Increment the position version and wake up all readers waiting in wait_for_position_change().
+        """
+        self.position_version += 1
+        self.position_changed_event.set()
+        self.position_changed_event = asyncio.Event()
+
+
+    async def wait_for_position_change(self, since_version, timeout):
+        """Wait until the position version of the queue is newer than the given version or the timeout is reached.
+
+        Args:
+            since_version (int): Last position version known to the reader
+            timeout (float): Maximum time to wait in seconds
+
+        Returns:
+            int: Current position version of the queue
+        """
+        if self.position_version <= since_version:
+            try:
+                await asyncio.wait_for(self.position_changed_event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.position_version
 
 
     def peek(self):
@@ -101,17 +478,66 @@ class JobQueue(asyncio.Queue):
         return None
 
     def __len__(self):
-        return len(self._queue)
+        return self.qsize()
+
+
+    def __mark_removed(self, job):
+        self._removed.add(job.queue_seq % self._removed.size, 1)
+        self._num_removed += 1
+        job.queue_seq = None
+        self.__drop_removed_jobs_at_head()
+
+
+    def __put_to_flow(self, job):
+        flow_key = job.api_key
+        flow = self._flows.get(flow_key)
+        if not flow:
+            flow = self._flows[flow_key] = FairShareFlow(self.priority_classes)
+            self._active_flows.append(flow_key)
+        flow.append(job)
+        job.flow_key = flow_key
+
+
+    def __get_from_flows(self):
+        while True:
+            flow_key = self._active_flows[0]
+            flow = self._flows[flow_key]
+            flow.drop_removed_jobs_at_head()
+            if not flow.jobs:
+                self._active_flows.popleft()
+                del self._flows[flow_key]
+            elif flow.deficit >= 1:
+                flow.deficit -= 1
+                return flow.popleft()
+            else:
+                flow.deficit += flow.weight
+                self._active_flows.rotate(-1)
 
 
-    async def remove_lapsed_jobs(self):
-        while self._queue:
-            job = self.peek()
-            if job and await job.state == JobState.LAPSED:
-                self.get_nowait()
-                self.task_done()
-            else:
-                break
+    def __get_fair_share_rank(self, job):
+        flow = self._flows.get(job.flow_key)
+        rank_in_flow = job.flow_seq - flow.head_seq + 1
+        num_rounds = rank_in_flow / flow.weight
+        num_jobs_of_other_flows = sum(
+            min(len(other_flow.jobs), math.ceil(num_rounds * other_flow.weight))
+            for other_flow in self._flows.values() if other_flow is not flow
+        )
+        return min(rank_in_flow + num_jobs_of_other_flows, self.qsize())
+
+
+    def __drop_removed_jobs_at_head(self):
+        while self._queue and self._queue[0].queue_seq is None:
+            self._queue.popleft()
+            self._removed.add(self._head_seq % self._removed.size, -1)
+            self._head_seq += 1
+            self._num_removed -= 1
+
+
+    def __resize_rank_index(self, size):
+        self._removed = FenwickTree(size)
+        for offset, job in enumerate(self._queue):
+            if job.queue_seq is None:
+                self._removed.add((self._head_seq + offset) % size, 1)
                 
 
 
@@ -125,6 +551,11 @@ class JobHandler():
             app (Sanic): Sanic server instance
         """        
         self.app = app
+        self.jobs = dict() # key: job_id, value: JobType
+        self.workers = dict() # key: worker_auth, value: Worker
+        self.deadlines = DeadlineScheduler()
+        self.result_store = ResultStore.from_config(app.server_config.get('RESULT_STORE', {}))
+        self.journal = JobJournal.from_config(app.server_config.get('JOB_JOURNAL', {}))
         self.job_types = self.init_all_job_types()
         self.lock = asyncio.Lock()
 
@@ -134,7 +565,7 @@ class JobHandler():
         job_types = dict()
         for endpoint_name, endpoint in self.app.endpoints.items():
             job_type_name = endpoint.worker_job_type
-            job_type = job_types[job_type_name] if job_type_name in job_types else JobType(self.app, endpoint)
+            job_type = job_types[job_type_name] if job_type_name in job_types else JobType(self.app, endpoint, self)
             job_type.endpoints[endpoint_name] = endpoint
             job_types[job_type_name] = job_type
 
@@ -171,17 +602,19 @@ class JobHandler():
 
 
             
-    async def worker_job_request(self, req_json):
+    async def worker_job_request(self, req_json, session_authorized=False):
         """Worker job request to the JobHandler.
         Args:
             req_json (dict): Job request from worker
+            session_authorized (bool, optional): Worker was already authorized at login of a persistent connection, 
+                so the auth key is not validated again. Defaults to False.
 
         Returns:
             dict: Job data of incoming job at a related endpoint or {'cmd': 'no_job'} if timed out.
         """       
 
         worker_auth = req_json.get('auth')
-        response_cmd = self.validate_worker_request(req_json)
+        response_cmd = self.validate_worker_request(req_json, session_authorized)
         if response_cmd.get('success'):
             job_type = self.get_job_type(worker_auth=worker_auth)
             return await job_type.worker_job_request(req_json)
@@ -207,10 +640,24 @@ class JobHandler():
                 return response_cmd
 
 
-    async def worker_update_progress_state(self, progress_result):
+    async def worker_requeue_jobs(self, worker_auth, job_ids):
+        """Put jobs started by the given worker back to the queue if the response with the jobs couldn't be sent to 
+        the worker.
+
+        Args:
+            worker_auth (str): Name of the worker
+            job_ids (list): Ids of the jobs
+        """
+        job_type = self.get_job_type(worker_auth=worker_auth)
+        if job_type:
+            await job_type.requeue_jobs(worker_auth, job_ids)
+
+
+    async def worker_update_progress_state(self, progress_result, session_authorized=False):
         """Update progress state with incoming progress updates from the worker to make it accessable to the endpoint. 
         Args:
             progress_result (dict): Progress result from worker
+            session_authorized (bool, optional): Worker was already authorized at login of a persistent connection. Defaults to False.
 
         Returns:
             dict: Response dict to worker with success message.
@@ -221,7 +668,7 @@ class JobHandler():
             worker_auth = progress_result.get('progress_data', {}).get('auth')
             progress_result['auth'] = worker_auth
 
-        response_cmd = self.validate_worker_request(progress_result)
+        response_cmd = self.validate_worker_request(progress_result, session_authorized)
         if response_cmd.get('success'):
             job_type = self.get_job_type(worker_auth=worker_auth)
             return await job_type.set_progress_state(progress_result)
@@ -234,16 +681,17 @@ class JobHandler():
 
 
 
-    async def worker_set_job_result(self, req_json):
+    async def worker_set_job_result(self, req_json, session_authorized=False):
         """Set job result with incoming result from the worker to make it accessable to the endpoint. 
         Args:
             req_json (dict): Job result from worker
+            session_authorized (bool, optional): Worker was already authorized at login of a persistent connection. Defaults to False.
 
         Returns:
             dict: Response dict to worker with success message.
         """
         worker_auth = req_json.get('auth')
-        response_cmd = self.validate_worker_request(req_json)
+        response_cmd = self.validate_worker_request(req_json, session_authorized)
         if response_cmd.get('success'):
             job_type = self.get_job_type(worker_auth=worker_auth)
             response_cmd = await job_type.set_job_result(req_json)
@@ -257,21 +705,61 @@ class JobHandler():
 
     ### Endpoint methods
 
-    async def endpoint_new_job(self, job_data):
-        """For endpoints: Init new job and put it to the related job queue.
+    async def endpoint_new_job(self, job_data, api_key=None, priority_class=None):
+        """For endpoints: Init new job and put it to the related job queue, unless the client reached its
+        client_request_limit. The limit is checked and the job is registered for the client without an await in between,
+        so concurrent requests of the client can't both pass the check.
 
         Args:
             job_data (dict): Job data of api request
+            api_key (str, optional): API key of the client, used for fair share scheduling and the client request limit. Defaults to None.
+            priority_class (str, optional): Priority class of the job for fair share scheduling. Defaults to None.
 
         Returns:
-            api_server.job_queue.Job: Newly created instance of Job()
+            api_server.job_queue.Job: Newly created instance of Job() or None if the client request limit is reached
         """
         endpoint_name = job_data.get('endpoint_name')
         job_type = self.get_job_type(endpoint_name=endpoint_name)
-        if job_type:
+        if job_type and not await self.is_client_request_limit_reached(endpoint_name, api_key):
             self.app.logger.debug(f'Client request on /{endpoint_name} with following input parameter: ')
             self.app.logger.debug(str(shorten_strings(job_data)))
-            return await job_type.new_job(job_data)
+            return await job_type.new_job(job_data, api_key, priority_class)
+
+
+    async def endpoint_get_queue_estimate(self, endpoint_name, include_job_duration=True):
+        """For endpoints: Get the estimated time until a new job on the endpoint would be finished, based on the current
+        queue length and the throughput of the workers online.
+
+        Args:
+            endpoint_name (str): Name of the endpoint
+            include_job_duration (bool, optional): Whether the compute duration of the new job is included, otherwise
+                the time the new job would wait in the queue is estimated. Defaults to True.
+
+        Returns:
+            dict: Estimated time in seconds with confidence bounds or None if unknown. Example: {'value': 12.5, 'lower': 8.1, 'upper': 20.3}
+        """
+        job_type = self.get_job_type(endpoint_name=endpoint_name)
+        if job_type:
+            return await job_type.get_queue_drain_estimate(include_job_duration)
+
+
+    async def is_client_request_limit_reached(self, endpoint_name, api_key):
+        """For endpoints: Check if the client with given API key has as many unfinished jobs on the endpoint as the
+        client_request_limit in the [CLIENTS] section of the endpoint config allows. A limit of 0 means no limit.
+
+        Args:
+            endpoint_name (str): Name of the endpoint
+            api_key (str): API key of the client
+
+        Returns:
+            bool: True if no further request of the client is accepted
+        """
+        endpoint = self.app.endpoints.get(endpoint_name)
+        job_type = self.get_job_type(endpoint_name=endpoint_name)
+        client_request_limit = endpoint.clients_config.get('client_request_limit') if endpoint else None
+        if client_request_limit and api_key and job_type:
+            return await job_type.get_num_unfinished_client_jobs(endpoint_name, api_key) >= client_request_limit
+        return False
 
     
     async def endpoint_get_progress_state(self, job):
@@ -283,7 +771,7 @@ class JobHandler():
         Returns:
             dict: Current progress state of related job
         """
-        job_type = self.get_job_type(job.id)
+        job_type = self.get_job_type(job.id) if job else None # Job is None if it was deleted before a call via the JobStateBroker
         if job_type:
             return await job_type.get_progress_state(job)
 
@@ -297,11 +785,71 @@ class JobHandler():
         Returns:
             dict: Current progress state of related job
         """
-        job_type = self.get_job_type(job.id)
+        job_type = self.get_job_type(job.id) if job else None
         if job_type:
-            result = await job.result_future
+            await asyncio.shield(job.result_future) # The future is shared by all requests waiting for the job
+            result = await self.result_store.get(job.id)
             await self.finish_job(job)
-            return result
+            return result or {'error': f'Result of job {job.id} expired'}
+        return {'error': 'Client has no active request with this job id'}
+
+
+    async def endpoint_cancel_job(self, job, reason='Job canceled'):
+        """For endpoints: Cancel the given job. A queued job is removed from the queue, the worker of a running job
+        gets the cancel flag in the response to its next progress update.
+
+        Args:
+            job (api_server.job_queue.Job): Instance of class Job
+            reason (str, optional): Reason logged in the admin backend. Defaults to 'Job canceled'.
+
+        Returns:
+            bool: True if the job was canceled, False if it was already finished
+        """
+        job_type = self.get_job_type(job.id) if job else None
+        if job_type:
+            return await job_type.cancel_job(job, reason)
+        return False
+
+
+    async def endpoint_get_job_state(self, job):
+        """For endpoints: Get the current state of the given job.
+
+        Args:
+            job (api_server.job_queue.Job): Instance of class Job
+
+        Returns:
+            str: State of the job
+        """
+        return job.state if job else JobState.UNKNOWN
+
+
+    async def endpoint_wait_for_job_update(self, job, since_version, timeout, since_queue_version=None):
+        """For endpoints: Wait until the job with given job id got a progress update newer than since_version.
+        If since_queue_version is given and the job is still queued, a change of its queue position wakes up the waiter as well.
+
+        Args:
+            job (api_server.job_queue.Job): Instance of class Job
+            since_version (int): Last progress version known to the client
+            timeout (float): Maximum time to wait in seconds
+            since_queue_version (int, optional): Last queue position version known to the client. Defaults to None.
+
+        Returns:
+            int: Current progress version of related job
+        """
+        if job:
+            queue = self.get_queue(job.endpoint_name)
+            if since_queue_version is None or job.queue_seq is None or queue is None:
+                return await job.wait_for_update(since_version, timeout)
+            waiters = [
+                asyncio.ensure_future(job.wait_for_update(since_version, timeout)),
+                asyncio.ensure_future(queue.wait_for_position_change(since_queue_version, timeout))
+            ]
+            try:
+                await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            finally: # Also if the request waiting here is canceled on client disconnect
+                for waiter in waiters:
+                    waiter.cancel()
+            return job.progress_version
 
 
     async def get_job_type_status(self, job_type_name):
@@ -316,7 +864,10 @@ class JobHandler():
                     'num_workers_online': 1,
                     'num_processing_requests': 1,
                     'num_pending_requests': 2,
-                    'num_free_slots': 0
+                    'num_free_slots': 0,
+                    'queue_drain_estimate': {'value': 12.5, 'lower': 8.1, 'upper': 20.3},
+                    'result_store': {'num_results': 3, 'resident_size': 1048576, 'num_spilled_results': 0, ...},
+                    'job_journal': {'size': 52381, 'num_buffered_events': 0, 'num_events': 12, ...}
                 }
 
         """        
@@ -326,7 +877,10 @@ class JobHandler():
                 'num_workers_online': await job_type.get_num_workers_online(),
                 'num_processing_requests': job_type.get_num_running_jobs(),
                 'num_pending_requests': len(job_type.queue),
-                'num_free_slots': job_type.free_slots
+                'num_free_slots': job_type.free_slots,
+                'queue_drain_estimate': await job_type.get_queue_drain_estimate(),
+                'result_store': self.result_store.get_status(),
+                'job_journal': self.journal.get_status() if self.journal else None
             }
 
 
@@ -341,11 +895,10 @@ class JobHandler():
         Returns:
             bool: True if worker_auth is found in JobHandler() else False
         """        
-        for job_type in self.job_types.values():
-            if worker_auth in job_type.workers:
-                worker = job_type.workers.get(worker_auth)
-                await worker.enable()
-                return True
+        worker = self.get_worker(worker_auth)
+        if worker:
+            await worker.enable()
+            return True
         return False
 
 
@@ -358,11 +911,10 @@ class JobHandler():
         Returns:
             bool: True if worker_auth is found in JobHandler() else False
         """        
-        for job_type in self.job_types.values():
-            if worker_auth in job_type.workers:
-                worker = job_type.workers.get(worker_auth)
-                await worker.disable()
-                return True
+        worker = self.get_worker(worker_auth)
+        if worker:
+            await worker.disable()
+            return True
         return False
 
 
@@ -421,12 +973,12 @@ class JobHandler():
         Returns:
             str: Current worker state: 'processing', 'waiting', 'offline' or 'disabled'
         """
-        for job_type in self.job_types.values():
-            if worker_auth in job_type.workers:
-                return await job_type.get_worker_state(worker_auth)
+        worker = self.get_worker(worker_auth)
+        if worker:
+            return worker.state
 
 
-    def get_worker_config(self, worker_auth):
+    async def get_worker_config(self, worker_auth):
         """Get the configuration of the worker with given name from the related endpoint configuration.
 
         Args:
@@ -435,18 +987,34 @@ class JobHandler():
         Returns:
             dict: Worker configuration containing job_type, worker_auth_key, etc.
         """        
-        for job_type in self.job_types.values():
-            if worker_auth in job_type.workers:
-                for endpoint in self.app.endpoints.values():
-                    if endpoint.worker_job_type == job_type.name:
-                        return endpoint.config.get('WORKER', {})
+        job_type = self.get_job_type(worker_auth=worker_auth)
+        if job_type:
+            endpoint = next(iter(job_type.endpoints.values()))
+            return endpoint.config.get('WORKER', {})
 
 
-    def get_worker_model(self, worker_auth):
-        for job_type in self.job_types.values():
-            worker = job_type.workers.get(worker_auth)
-            if worker:
-                return worker.model
+    async def get_worker_model(self, worker_auth):
+        worker = self.get_worker(worker_auth)
+        if worker:
+            return worker.model
+
+
+    async def get_worker_throughput(self, worker_auth):
+        """Get the throughput model of the worker with given name.
+
+        Args:
+            worker_auth (str): Name of the worker
+
+        Returns:
+            dict: Compute durations per effective batch size and generated tokens per second. Example:
+                {
+                    'job_durations': {1: {'mean': 4.2, 'std': 0.3, 'count': 12}, 4: {'mean': 5.1, 'std': 0.6, 'count': 40}},
+                    'tokens_per_second': {'mean': 38.5, 'std': 2.1, 'count': 52}
+                }
+        """
+        worker = self.get_worker(worker_auth)
+        if worker:
+            return worker.throughput
 
 
     # Helper Methods
@@ -472,11 +1040,23 @@ class JobHandler():
 
 
     def get_job(self, job_id):
-        job_type = self.get_job_type(job_id)
+        job_type = self.jobs.get(job_id)
         if job_type:
             return job_type.jobs.get(job_id)
 
 
+    async def endpoint_get_job(self, job_id):
+        """For endpoints: Get the job with given job id.
+
+        Args:
+            job_id (str): Job id
+
+        Returns:
+            api_server.job_queue.Job: Instance of class Job or None if the job is unknown
+        """
+        return self.get_job(job_id)
+
+
     def get_result_future(self, job):
         job_type = self.get_job_type(job.id)
         if job_type:
@@ -487,17 +1067,19 @@ class JobHandler():
         return bool(self.get_result_future(job_id))
 
     
-    def get_free_queue_slots(self, endpoint_name):
+    async def get_free_queue_slots(self, endpoint_name):
         job_type = self.get_job_type(endpoint_name=endpoint_name)
         if job_type:
             return job_type.free_queue_slots
 
 
     def get_job_type(self, job_id=None, endpoint_name=None, worker_auth=None):
-        if job_id or worker_auth:
-            for job_type_name, job_type in self.job_types.items():
-                if job_id in job_type.jobs or worker_auth in job_type.workers:
-                    return job_type
+        if job_id:
+            return self.jobs.get(job_id)
+        elif worker_auth:
+            worker = self.workers.get(worker_auth)
+            if worker:
+                return worker.job_type
         elif endpoint_name:
             endpoint = self.app.endpoints.get(endpoint_name)
             if endpoint:
@@ -505,11 +1087,11 @@ class JobHandler():
 
 
 
-    def validate_worker_request(self, req_json):
+    def validate_worker_request(self, req_json, session_authorized=False):
         auth = req_json.get('auth')
         job_type = self.get_job_type(worker_auth=auth)
         if job_type:
-            key_valid = job_type.is_worker_auth_key_valid(req_json.get('auth_key'))
+            key_valid = session_authorized or job_type.is_worker_auth_key_valid(req_json.get('auth_key'))
             return {
                 'success': key_valid,
                 'error_msg': None if key_valid else f'Worker {auth} not authorized on job type {job_type.name}' 
@@ -521,7 +1103,7 @@ class JobHandler():
             }
 
 
-    def is_worker_logged_in(self, auth):
+    async def is_worker_logged_in(self, auth):
         return bool(self.get_job_type(worker_auth=auth))
 
 
@@ -540,10 +1122,8 @@ class JobHandler():
             return job_type.queue
 
     def get_worker(self, worker_auth):
-        for job_type in self.job_types.values():
-            if worker_auth in job_type.workers:
-                return job_type.workers.get(worker_auth)
-           
+        return self.workers.get(worker_auth)
+
 
     async def get_estimate_time(self, job_id):
         job_type = self.get_job_type(job_id)
@@ -551,36 +1131,91 @@ class JobHandler():
             return await job_type.get_estimate_time(job_id)
       
 
-    def is_job_future_done(self, job):
-        job_type = self.get_job_type(job.id)
+    async def is_job_future_done(self, job):
+        job_type = self.get_job_type(job.id) if job else None
         if job_type:
             return job_type.is_job_future_done(job)
         else:
             return False
 
 
-    async def clean_up_jobs(self):
-        for job_type in self.job_types.values():
-            await job_type.clean_up_old_jobs()
-            await job_type.clean_up_lapsed_jobs_in_all_workers()
-
-
     async def check_for_offline_workers(self):
         workers = await self.get_all_workers() # Check for offline workers already in get_all_workers
 
 
     async def set_worker_offline(self, auth):
         worker = self.get_worker(auth)
-        await worker.set_state(WorkerState.OFFLINE)
+        if worker:
+            await worker.set_state(WorkerState.OFFLINE)
+
+
+    async def register_client_session(self, client_session_auth_key, api_key):
+        """Register the client session authentication key assigned on client login.
+
+        Args:
+            client_session_auth_key (str): Client session authentication key
+            api_key (str): API key of the client
+        """
+        self.app.registered_keys[client_session_auth_key] = api_key
+
+
+    ### Job journal methods
+
+    async def restore_jobs_from_journal(self):
+        """Open the job journal, restore the jobs of the journal and start journaling. Queued jobs are put back to
+        their queues in their original order, finished jobs get their result back, so clients can fetch it with the
+        job id of a request sent before the restart.
+        """
+        if not self.journal:
+            return
+        try:
+            self.journal.open()
+        except JobJournalError as error:
+            self.app.logger.warning(f'{error}. Jobs of this server process are not journaled.')
+            self.journal = None
+            return
+        journaled_jobs = await run_in_executor(self.journal.replay)
+        num_restored_jobs = 0
+        for job_events in journaled_jobs.values():
+            job_type = self.get_job_type(endpoint_name=job_events['new'].get('endpoint_name'))
+            if job_type:
+                job = await job_type.restore_job(job_events)
+                counter = job.id.rpartition('#')[2]
+                if counter.isdigit(): # New job ids continue the counter of the restored jobs
+                    Job.id_counter.advance_to(int(counter))
+                num_restored_jobs += 1
+        self.journal.get_snapshot = self.get_journal_snapshot
+        await self.journal.compact() # Drop the events of deleted jobs
+        self.journal.start()
+        self.app.logger.info(f'Restored {num_restored_jobs} jobs from job journal {self.journal.file}')
+
+
+    async def get_journal_snapshot(self):
+        """Get the events describing the current jobs, for the compaction of the job journal.
+
+        Returns:
+            list: Journal events
+        """
+        events = list()
+        for job_type in self.job_types.values():
+            for job in list(job_type.jobs.values()):
+                events.extend(await job_type.get_journal_events(job))
+        return events
+
+
+    async def stop_journal(self):
+        if self.journal:
+            await self.journal.stop()
 
 
     def clean_up_worker_double(self, req_json):
         worker_parameters = req_json.get('worker_parameters')
-        for job_type_name, job_type in self.job_types.items():
-            worker_name = worker_parameters.get('auth')
-            if worker_name in job_type.workers.keys() and worker_parameters.get('job_type') != job_type_name:
-                del job_type.workers[worker_name]
-                self.app.logger.info(f'Worker {worker_name} changed it\'s job type from {job_type_name} to {worker_parameters.get("job_type")}')
+        worker_name = worker_parameters.get('auth')
+        worker = self.workers.get(worker_name)
+        if worker and worker_parameters.get('job_type') != worker.job_type.name:
+            del worker.job_type.workers[worker_name]
+            del self.workers[worker_name]
+            self.app.logger.info(f'Worker {worker_name} changed it\'s job type from {worker.job_type.name} to {worker_parameters.get("job_type")}')
 
 
     def convert_to_login_request(self, req_json):
@@ -620,22 +1255,27 @@ class JobHandler():
 
 
 class JobType():
-    def __init__(self, app, endpoint):
+    def __init__(self, app, endpoint, job_handler):
         """Handles jobs, job queues, and the workers of all endpoints connected to this job type.
 
         Args:
             app (Sanic): Sanic server instance
+            endpoint (APIEndpoint): First endpoint connected to this job type
+            job_handler (JobHandler): Job handler keeping the global job and worker index
         """        
         self.app = app
+        self.job_handler = job_handler
         self.endpoints = {endpoint.endpoint_name: endpoint}
         self.name = endpoint.worker_job_type
-        self.queue = JobQueue(endpoint.max_queue_length)
+        self.queue = JobQueue(endpoint.max_queue_length, endpoint.scheduler, endpoint.priority_classes)
         self.request_timeout = endpoint.request_timeout
+        self.batch_policy = BatchPolicy(endpoint.config.get('WORKER', {}))
         
         self.app.logger.info(f'Queue for job type: {self.name} initialized')
         self.worker_auth_key = hashlib.sha256(endpoint.worker_auth_key.encode()).hexdigest()
         self.workers = dict() # key worker_auth
         self.jobs = dict() # key: job_id 
+        self.client_jobs = dict() # key: (endpoint_name, api_key), value: dict of unfinished jobs by job_id, for endpoints with client_request_limit
 
     @property
     def free_slots(self):
@@ -653,6 +1293,9 @@ class JobType():
             worker.update_parameters(req_json)
         else:
             worker = self.init_worker(req_json)
+            for job in self.jobs.values():
+                if job.worker_auth == worker_auth and job.state == JobState.PROCESSING and not job.result_received_time:
+                    worker.running_jobs[job.id] = job # Job restored from the job journal, still processed by the worker
         self.app.logger.info(
             f'Worker {worker_auth} logged in on job_type {worker.job_type.name}'
         )
@@ -669,27 +1312,73 @@ class JobType():
         try:
             job = await self.queue.get(timeout=self.request_timeout)    # wait on queue for job
             self.queue.task_done()   # take it out of the queue
-            await self.start_job(job, worker)
-            job_batch_data = await self.fill_job_batch_with_waiting_jobs(job, req_json)
-            endpoint = self.app.endpoints.get(job.endpoint_name)
-            return {
-                'cmd': 'job',
-                'endpoint_name': job.endpoint_name,
-                'input_descriptions': endpoint.ep_input_param_config,
-                'progress_output_descriptions': endpoint.ep_progress_param_config.get('OUTPUTS'),
-                'final_output_descriptions': endpoint.ep_output_param_config,
-                'job_data': job_batch_data
-            }
         except asyncio.TimeoutError:
             await worker.job_request_timed_out()
             return {'cmd': 'no_job'}
+        # The job is out of the queue, so starting the job batch is shielded from the cancellation of the job request.
+        # If the job request is canceled meanwhile, the started jobs are put back to the queue.
+        start_task = asyncio.ensure_future(self.start_job_batch(job, worker, req_json))
+        try:
+            return await asyncio.shield(start_task)
+        except asyncio.CancelledError:
+            asyncio.ensure_future(self.requeue_job_batch(start_task, worker.auth))
+            raise
+
+
+    async def start_job_batch(self, job, worker, req_json):
+        await self.start_job(job, worker)
+        job_batch_data = await self.fill_job_batch_with_waiting_jobs(job, req_json)
+        endpoint = self.app.endpoints.get(job.endpoint_name)
+        return {
+            'cmd': 'job',
+            'endpoint_name': job.endpoint_name,
+            'input_descriptions': endpoint.ep_input_param_config,
+            'progress_output_descriptions': endpoint.ep_progress_param_config.get('OUTPUTS'),
+            'final_output_descriptions': endpoint.ep_output_param_config,
+            'job_data': job_batch_data
+        }
+
+
+    async def requeue_job_batch(self, start_task, worker_auth):
+        response_cmd = await start_task
+        await self.requeue_jobs(worker_auth, [job_data.get('job_id') for job_data in response_cmd.get('job_data', [])])
+
+
+    async def requeue_jobs(self, worker_auth, job_ids):
+        """Put jobs started by the given worker back to the queue, since the worker never received them. The jobs keep
+        their start time, so max_time_in_queue still counts from their creation.
+
+        Args:
+            worker_auth (str): Name of the worker the jobs were started by
+            job_ids (list): Ids of the jobs
+        """
+        worker = self.workers.get(worker_auth)
+        for job_id in job_ids:
+            job = self.jobs.get(job_id)
+            if job and job.state == JobState.PROCESSING and job.worker_auth == worker_auth and not job.result_received_time:
+                if worker:
+                    await worker.requeue_job(job)
+                await job.requeue()
+                if self.job_handler.journal:
+                    self.job_handler.journal.log_event('new', job.id, **self.get_journal_job_data(job)) # Replaces the start event on replay
+                self.job_handler.deadlines.schedule(job.id, job.start_time + job.settings.max_time_in_queue, self.lapse_job, job, 'Job lapsed in queue')
+                try:
+                    self.queue.put_nowait(job)
+                except asyncio.QueueFull:
+                    await self.lapse_job(job, 'Job lapsed since the queue was full when it was put back')
 
 
     async def set_progress_state(self, req_json):
         job = self.jobs.get(req_json.get('job_id'))
         if job and job.result_future:
-            await job.set_progress_state(req_json)
             worker = self.workers.get(req_json.get('auth'))
+            if job.state == JobState.CANCELED:
+                if worker:
+                    await worker.cancel_job(job)
+                return {'success': True, 'job_id': job.id, 'canceled': True}
+            await job.set_progress_state(req_json)
+            if self.job_handler.journal:
+                self.job_handler.journal.log_event('progress', job.id, progress_state=req_json)
             if worker:
                 return await worker.set_progress_state(req_json)
 
@@ -700,24 +1389,158 @@ class JobType():
         job = self.jobs.get(req_json.get('job_id'))
         worker = self.workers.get(req_json.get('auth'))
         if job and job.result_future and worker:
+            if job.state == JobState.CANCELED:
+                return await worker.cancel_job(job)
             req_json['worker_interface_version'] = worker.interface_version
             await job.set_job_result(req_json)
+            self.remove_client_job(job)
+            if self.job_handler.journal:
+                self.job_handler.journal.log_event('result', job.id, result=req_json, result_received_time=job.result_received_time)
+            self.job_handler.deadlines.schedule(job.id, job.result_received_time + job.settings.result_lifetime, self.delete_job, job)
             self.app.logger.info(f"Worker '{worker.auth}' processed job {get_job_counter_id(job.id)}")
             return await worker.finish_job(job)
         return {'cmd': 'warning', 'msg': f'Job with job id {req_json.get("job_id")} not found in worker {req_json.get("auth")}!'}
 
 
-    async def new_job(self, job_data):
+    async def new_job(self, job_data, api_key=None, priority_class=None):
         job = await Job.new(job_data, self.app)
+        job.api_key = api_key
+        job.priority_class = priority_class
         self.jobs[job.id] = job 
+        self.job_handler.jobs[job.id] = self
+        if api_key and self.app.endpoints.get(job.endpoint_name).clients_config.get('client_request_limit'):
+            self.client_jobs.setdefault((job.endpoint_name, api_key), dict())[job.id] = job
+        if self.job_handler.journal:
+            self.job_handler.journal.log_event('new', job.id, **self.get_journal_job_data(job))
         await self.queue.put(job)
+        self.job_handler.deadlines.schedule(job.id, job.start_time + job.settings.max_time_in_queue, self.lapse_job, job, 'Job lapsed in queue')
         return job
 
 
+    async def restore_job(self, job_events):
+        """Restore a job from its events in the job journal. Queued jobs are put back to the queue. Processing jobs
+        stay assigned to their worker, which can send progress and result after logging in again, and lapse after the
+        job_inactivity_timeout otherwise.
+
+        Args:
+            job_events (dict): Last event of each event type of the job, from JobJournal.replay()
+
+        Returns:
+            Job: Restored job
+        """
+        new_event = job_events['new']
+        job = Job(dict(new_event['job_data'], job_id=new_event['job_id'], endpoint_name=new_event['endpoint_name']), self.app)
+        job.api_key = new_event.get('api_key')
+        job.priority_class = new_event.get('priority_class')
+        job.start_time = new_event.get('start_time', job.start_time)
+        self.jobs[job.id] = job
+        self.job_handler.jobs[job.id] = self
+        start_event = job_events.get('start')
+        if start_event:
+            job.worker_auth = start_event.get('worker_auth')
+            job.start_time_compute = start_event.get('start_time_compute')
+            job.state = JobState.PROCESSING
+            if 'progress' in job_events:
+                job.progress_state = job_events['progress'].get('progress_state') or dict()
+        result_event = job_events.get('result')
+        if 'lapse' in job_events:
+            job.state = JobState.LAPSED
+            job.result_received_time = job_events['lapse']['time']
+            self.job_handler.result_store.put(job.id, {'error': job_events['lapse'].get('reason') or 'Job lapsed'})
+            job.result_future.set_result(None)
+        elif 'cancel' in job_events:
+            job.state = JobState.CANCELED
+            job.result_received_time = job_events['cancel']['time']
+            self.job_handler.result_store.put(job.id, {'error': job_events['cancel'].get('reason')})
+            job.result_future.set_result(None)
+        elif result_event:
+            job.result_received_time = result_event.get('result_received_time')
+            job.metrics = result_event['result'].get('metrics', {})
+            self.job_handler.result_store.put(job.id, result_event['result'])
+            job.result_future.set_result(None)
+            if 'done' in job_events:
+                job.state = JobState.DONE
+                job.progress_state.clear()
+
+        if not job.result_received_time and job.api_key and self.app.endpoints.get(job.endpoint_name).clients_config.get('client_request_limit'):
+            self.client_jobs.setdefault((job.endpoint_name, job.api_key), dict())[job.id] = job
+        if job.result_received_time:
+            self.job_handler.deadlines.schedule(job.id, job.result_received_time + job.settings.result_lifetime, self.delete_job, job)
+        elif job.state == JobState.PROCESSING:
+            self.job_handler.deadlines.schedule(job.id, job.last_update + job.settings.job_inactivity_timeout, self.check_job_inactivity, job)
+        else:
+            self.job_handler.deadlines.schedule(job.id, job.start_time + job.settings.max_time_in_queue, self.lapse_job, job, 'Job lapsed in queue')
+            try:
+                self.queue.put_nowait(job)
+            except asyncio.QueueFull:
+                await self.lapse_job(job, 'Job lapsed since the queue was full after the server restart')
+        return job
+
+
+    async def get_journal_events(self, job):
+        """Get the journal events describing the current state of the given job, for the compaction of the job journal.
+
+        Args:
+            job (Job): Job object
+
+        Returns:
+            list: Journal events of the job
+        """
+        events = [{'event': 'new', 'job_id': job.id, 'time': job.start_time, **self.get_journal_job_data(job)}]
+        if job.start_time_compute:
+            events.append({'event': 'start', 'job_id': job.id, 'time': job.start_time_compute, 'worker_auth': job.worker_auth, 'start_time_compute': job.start_time_compute})
+        if job.state == JobState.LAPSED:
+            result = await self.job_handler.result_store.get(job.id) or {}
+            events.append({'event': 'lapse', 'job_id': job.id, 'time': job.result_received_time, 'reason': result.get('error')})
+        elif job.state == JobState.CANCELED:
+            result = await self.job_handler.result_store.get(job.id) or {}
+            events.append({'event': 'cancel', 'job_id': job.id, 'time': job.result_received_time, 'reason': result.get('error')})
+        elif job.result_received_time:
+            result = await self.job_handler.result_store.get(job.id)
+            if result is not None:
+                events.append({'event': 'result', 'job_id': job.id, 'time': job.result_received_time, 'result': result, 'result_received_time': job.result_received_time})
+            if job.state == JobState.DONE:
+                events.append({'event': 'done', 'job_id': job.id, 'time': job.result_received_time})
+        elif job.state == JobState.PROCESSING and job.progress_state:
+            events.append({'event': 'progress', 'job_id': job.id, 'time': job.last_update, 'progress_state': job.progress_state})
+        return events
+
+
+    def get_journal_job_data(self, job):
+        return {
+            'endpoint_name': job.endpoint_name,
+            'job_data': job.job_data,
+            'api_key': job.api_key,
+            'priority_class': job.priority_class,
+            'start_time': job.start_time
+        }
+
+
+    async def get_num_unfinished_client_jobs(self, endpoint_name, api_key):
+        return len(self.client_jobs.get((endpoint_name, api_key), {}))
+
+
+    def remove_client_job(self, job):
+        """Remove the job from the unfinished jobs of its client, when its result arrived or it was canceled, lapsed or deleted.
+
+        Args:
+            job (Job): Job object
+        """
+        client_key = (job.endpoint_name, job.api_key)
+        client_jobs = self.client_jobs.get(client_key)
+        if client_jobs is not None:
+            client_jobs.pop(job.id, None)
+            if not client_jobs:
+                del self.client_jobs[client_key]
+
+
     async def get_progress_state(self, job):
         if job:
             job.progress_state['queue_position'] = await job.queue_position
-            job.progress_state['estimate'] = await self.get_estimate_time(job.id)
+            estimate = await self.get_estimate(job)
+            job.progress_state['estimate'] = estimate.value if estimate else -1
+            job.progress_state['estimate_lower'] = estimate.lower if estimate else -1
+            job.progress_state['estimate_upper'] = estimate.upper if estimate else -1
             job.progress_state['num_workers_online'] = await self.get_num_workers_online()
             if not job.progress_state.get('progress'):
                 job.progress_state['progress'] = 0
@@ -727,12 +1550,16 @@ class JobType():
     async def start_job(self, job, worker):
         if job and worker:
             await worker.start_job(job)
-            if self.app.admin_backend:
-                await self.app.admin_backend.admin_log_request_start_processing(
-                    job.id,
-                    worker.auth,
-                    job.start_time_compute,
-                    JobState.PROCESSING #await job.state
+            self.job_handler.deadlines.schedule(job.id, job.last_update + job.settings.job_inactivity_timeout, self.check_job_inactivity, job)
+            if self.job_handler.journal:
+                self.job_handler.journal.log_event('start', job.id, worker_auth=worker.auth, start_time_compute=job.start_time_compute)
+            if self.app.admin_telemetry:
+                self.app.admin_telemetry.log_event(
+                    'admin_log_request_start_processing',
+                    job_id=job.id,
+                    worker_name=worker.auth,
+                    start_time_compute_utc=job.start_time_compute,
+                    request_state=job.state
                 )
 
     def get_num_running_jobs(self, endpoint_name=None):
@@ -741,7 +1568,7 @@ class JobType():
 
     async def is_job_queued(self, job_id):
         job = self.jobs.get(job_id)
-        return await job.state == JobState.QUEUED if job else False
+        return job.state == JobState.QUEUED if job else False
 
 
     def is_job_future_done(self, job):
@@ -757,7 +1584,7 @@ class JobType():
     async def get_job_state(self, job_id):
         job = self.jobs.get(job_id)
         if job:
-            return await job.state
+            return job.state
         else:
             return JobState.UNKNOWN
 
@@ -767,21 +1594,61 @@ class JobType():
         job_batch_data = [job.job_data]
         max_job_batch = req_json.get('max_job_batch')
         if max_job_batch > 1:
-            while (len(job_batch_data) < max_job_batch):
-                job = self.fetch_waiting_job()
-                if job:
-                    if await self.is_job_queued(job.id):
-                        job = self.add_start_times(job) # backward compatibility for awi < 0.9.7. To be removed in future versions
-                        job_batch_data.append(job.job_data)
-                        await self.start_job(job, self.workers.get(req_json.get('auth')))
-                else:
-                    break
+            if self.batch_policy.group_by:
+                waiting_jobs = await self.fetch_compatible_waiting_jobs(job, max_job_batch - 1)
+            else:
+                waiting_jobs = await self.fetch_waiting_jobs(max_job_batch - 1)
+            for job in waiting_jobs:
+                job = self.add_start_times(job) # backward compatibility for awi < 0.9.7. To be removed in future versions
+                job_batch_data.append(job.job_data)
+                await self.start_job(job, self.workers.get(req_json.get('auth')))
         return job_batch_data
 
 
+    async def fetch_waiting_jobs(self, max_num):
+        jobs = list()
+        while len(jobs) < max_num:
+            job = self.fetch_waiting_job()
+            if job:
+                if await self.is_job_queued(job.id):
+                    jobs.append(job)
+            else:
+                break
+        return jobs
+
+
+    async def fetch_compatible_waiting_jobs(self, first_job, max_num):
+        """Take up to max_num jobs with the same batch group key as the first job of the batch out of the first
+        batch_scan_window jobs in the queue. Younger compatible jobs are only allowed to overtake an incompatible job until
+        it waited longer than batch_max_age in the queue, so no job starves.
+
+        Args:
+            first_job (Job): First job of the batch
+            max_num (int): Maximum number of jobs to fetch
+
+        Returns:
+            list: Compatible jobs, removed from the queue
+        """
+        group_key = self.batch_policy.get_group_key(first_job)
+        now = time.time()
+        jobs = list()
+        for job in self.queue.get_waiting_jobs(self.batch_policy.scan_window):
+            if len(jobs) >= max_num:
+                break
+            if not await self.is_job_queued(job.id):
+                continue
+            if self.batch_policy.get_group_key(job) == group_key:
+                self.queue.remove(job)
+                jobs.append(job)
+            elif now - job.start_time > self.batch_policy.max_age:
+                break
+        return jobs
+
+
     def init_worker(self, req_json):
         worker = Worker(self.app, self, req_json)
-        self.workers[req_json.get('worker_parameters').get('auth')] = worker
+        self.workers[worker.auth] = worker
+        self.job_handler.workers[worker.auth] = worker
         return worker
 
 
@@ -800,29 +1667,51 @@ class JobType():
 
 
     async def get_estimate_time(self, job_id):
-        job = self.jobs.get(job_id)
+        estimate = await self.get_estimate(self.jobs.get(job_id))
+        return estimate.value if estimate else -1
+
+
+    async def get_estimate(self, job):
+        """Get the estimated time until the given job is finished with confidence bounds. Processing jobs are estimated
+        by the throughput model of their worker, queued jobs by the throughput of all workers online.
+
+        Args:
+            job (Job): Job object
+
+        Returns:
+            Estimate: Estimated time in seconds or None if unknown
+        """
         if job:
-            job_state = await job.state
+            job_state = job.state
             if job_state == JobState.DONE:
-                return 0
+                return Estimate(0, 0, 0)
             elif job_state == JobState.PROCESSING:
                 worker = self.workers.get(job.worker_auth)
-                return worker.get_estimate_time(job)
+                if worker:
+                    return worker.get_estimate(job)
             elif job_state == JobState.QUEUED:
-                num_workers_online = await self.get_num_workers_online()
-                if num_workers_online:
-                    worker = next(iter(self.workers.values()))     
-                    return max(
-                        0,
-                        calculate_estimate_time(
-                            worker.mean_compute_duration * (await job.queue_position + 1) / num_workers_online,
-                            job.start_time
-                        )
-                    )
-                else:
-                    return -1
-            else:
-                return -1
+                return await self.get_queue_estimate(await job.queue_position - 1)
+
+
+    async def get_queue_estimate(self, num_jobs_ahead, include_job_duration=True):
+        """Get the estimated time until a job with num_jobs_ahead queued jobs in front of it is finished.
+
+        Args:
+            num_jobs_ahead (int): Number of jobs in front of the job in the queue
+            include_job_duration (bool, optional): Whether the compute duration of the job is included. Defaults to True.
+
+        Returns:
+            Estimate: Estimated time in seconds or None if unknown
+        """
+        estimate = estimate_queue_time(max(0, num_jobs_ahead), await self.get_all_available_workers(), include_job_duration)
+        if estimate:
+            return estimate.rounded()
+
+
+    async def get_queue_drain_estimate(self, include_job_duration=True):
+        estimate = await self.get_queue_estimate(len(self.queue), include_job_duration)
+        if estimate:
+            return estimate.to_dict()
 
 
     async def get_num_workers_online(self):
@@ -845,6 +1734,11 @@ class JobType():
         return [worker for worker in self.workers.values() if not worker.state == WorkerState.OFFLINE]
 
 
+    async def get_all_available_workers(self):
+        await self.check_for_offline_workers()
+        return [worker for worker in self.workers.values() if worker.state not in (WorkerState.OFFLINE, WorkerState.DISABLED)]
+
+
     async def get_worker_state(self, worker_auth):
         worker = self.workers.get(worker_auth)
         if worker:
@@ -854,6 +1748,8 @@ class JobType():
     async def finish_job(self, job):
         if job:
             await job.finish()
+            if self.job_handler.journal and job.state == JobState.DONE:
+                self.job_handler.journal.log_event('done', job.id)
 
 
     async def enable(self, worker_auth):
@@ -868,16 +1764,76 @@ class JobType():
             await worker.disable()
 
 
-    async def clean_up_old_jobs(self):
-        for job in self.jobs.copy().values():
-            if job.result_received_time and (time.time() - job.result_received_time) > job.result_lifetime:
-                await self.app.admin_backend.admin_log_request_deleted(job.id)
-                del self.jobs[job.id]
+    async def check_job_inactivity(self, job):
+        """Deadline of the job inactivity timeout of a processing job. Since progress updates don't reschedule the deadline,
+        it is rescheduled here to the inactivity timeout after the last update if the job got an update in the meantime.
+        """
+        if job.state == JobState.PROCESSING and not job.result_received_time:
+            deadline = job.last_update + job.settings.job_inactivity_timeout
+            if time.time() < deadline:
+                self.job_handler.deadlines.schedule(job.id, deadline, self.check_job_inactivity, job)
+            else:
+                await self.lapse_job(job, 'Job lapsed without progress update')
 
 
-    async def clean_up_lapsed_jobs_in_all_workers(self):
-        for worker in self.workers.values():
-            await worker.clean_up_lapsed_jobs()
+    async def lapse_job(self, job, reason='Job lapsed'):
+        """Set the state of the given queued or processing job to lapsed, remove it from the queue or its worker and
+        schedule its deletion after the result lifetime.
+
+        Args:
+            job (Job): Job object
+            reason (str, optional): Reason logged in the admin backend. Defaults to 'Job lapsed'.
+        """
+        if job.state in (JobState.QUEUED, JobState.PROCESSING) and not job.result_received_time:
+            self.queue.remove(job)
+            worker = self.workers.get(job.worker_auth)
+            if worker and worker.running_jobs.pop(job.id, None):
+                worker.num_lapsed_jobs += 1
+            await job.lapse(reason)
+            self.remove_client_job(job)
+            if self.job_handler.journal:
+                self.job_handler.journal.log_event('lapse', job.id, reason=reason)
+            self.app.logger.info(f'{reason}: {get_job_counter_id(job.id)}')
+            self.job_handler.deadlines.schedule(job.id, job.result_received_time + job.settings.result_lifetime, self.delete_job, job)
+
+
+    async def cancel_job(self, job, reason='Job canceled'):
+        """Cancel the given queued or processing job. A queued job is removed from the queue immediately. A processing
+        job stays assigned to its worker until the worker gets the cancel flag in the response to its next progress
+        update or sends its result.
+
+        Args:
+            job (Job): Job object
+            reason (str, optional): Reason logged in the admin backend. Defaults to 'Job canceled'.
+
+        Returns:
+            bool: True if the job was canceled, False if it was already finished
+        """
+        if job.state in (JobState.QUEUED, JobState.PROCESSING) and not job.result_received_time:
+            self.queue.remove(job)
+            await job.cancel(reason)
+            self.remove_client_job(job)
+            if self.job_handler.journal:
+                self.job_handler.journal.log_event('cancel', job.id, reason=reason)
+            self.app.logger.info(f'{reason}: {get_job_counter_id(job.id)}')
+            self.job_handler.deadlines.schedule(job.id, job.result_received_time + job.settings.result_lifetime, self.delete_job, job)
+            return True
+        return False
+
+
+    async def delete_job(self, job):
+        self.job_handler.deadlines.cancel(job.id)
+        self.remove_client_job(job)
+        worker = self.workers.get(job.worker_auth)
+        if worker:
+            worker.running_jobs.pop(job.id, None)
+        if self.jobs.pop(job.id, None):
+            self.job_handler.jobs.pop(job.id, None)
+            await self.job_handler.result_store.remove(job.id)
+            if self.job_handler.journal:
+                self.job_handler.journal.log_event('delete', job.id)
+            if self.app.admin_telemetry:
+                self.app.admin_telemetry.log_event('admin_log_request_deleted', job_id=job.id)
 
 
     def add_start_times(self, job):
@@ -892,7 +1848,12 @@ class JobType():
 
 
 class Worker():
-    
+    __slots__ = (
+        'app', 'job_type', 'worker_parameters', 'auth', 'lock', 'state', 'num_finished_jobs', 'num_lapsed_jobs', 'retry',
+        'max_batch_size', 'free_slots', 'gpu_name', 'num_gpus', 'version', 'interface_version', 'last_request_time', 'model',
+        'framework', 'framework_version', 'pytorch_version', 'running_jobs', 'throughput_model'
+    )
+
     def __init__(self, app, job_type, req_json):
         """Worker object representing a GPU Worker instance.
 
@@ -924,7 +1885,7 @@ class Worker():
         self.framework_version = self.worker_parameters.get('framework_version')
         self.pytorch_version = self.worker_parameters.get('pytorch_version')
         self.running_jobs = dict() # key job_id
-        self.mean_compute_duration = int()
+        self.throughput_model = ThroughputModel()
 
 
     def update_parameters(self, req_json):
@@ -944,8 +1905,14 @@ class Worker():
 
     async def set_state(self, new_state):
         if self.state != new_state:
-            await self.app.admin_backend.admin_notify_worker_state_changed(self.auth, self.state, new_state)
+            if self.app.admin_telemetry:
+                self.app.admin_telemetry.log_event(
+                    'admin_notify_worker_state_changed', worker_name=self.auth, old_state=self.state, new_state=new_state
+                )
             self.state = new_state
+            if new_state == WorkerState.OFFLINE:
+                for job in list(self.running_jobs.values()):
+                    await self.job_type.lapse_job(job, f'Job lapsed since worker {self.auth} went offline')
 
 
     async def enable(self):
@@ -957,6 +1924,16 @@ class Worker():
         await self.set_state(WorkerState.DISABLED)
 
 
+    @property
+    def batch_capacity(self):
+        return max(1, self.max_batch_size or 1)
+
+
+    @property
+    def throughput(self):
+        return self.throughput_model.to_dict()
+
+
     def get_num_running_jobs(self, endpoint_name):
         return sum(1 for job in self.running_jobs.values() if not endpoint_name or job.endpoint_name == endpoint_name)
 
@@ -990,6 +1967,8 @@ class Worker():
                 await self.check_and_update_state()
                 await self.set_state(WorkerState.PROCESSING)
                 self.running_jobs[job.id] = job
+                for running_job in self.running_jobs.values():
+                    running_job.effective_batch_size = max(running_job.effective_batch_size, len(self.running_jobs))
 
 
     async def set_progress_state(self, req_json):
@@ -1010,42 +1989,68 @@ class Worker():
         async with self.lock:
             self.num_finished_jobs += 1
             self.running_jobs.pop(job.id, None)
-            self.mean_compute_duration = (1 - WEIGHT_FACTOR_ALPHA) * self.mean_compute_duration + WEIGHT_FACTOR_ALPHA * job.compute_duration
+            self.throughput_model.add_finished_job(job.compute_duration, job.effective_batch_size, job.num_generated_tokens)
             await self.check_and_update_state()
         return {'cmd': 'ok'}
 
 
+    async def cancel_job(self, job):
+        async with self.lock:
+            if self.running_jobs.pop(job.id, None):
+                self.app.logger.info(f"Worker '{self.auth}' canceled job {get_job_counter_id(job.id)}")
+            await self.check_and_update_state()
+        return {'cmd': 'ok'}
+
+
+    async def requeue_job(self, job):
+        async with self.lock:
+            if self.running_jobs.pop(job.id, None):
+                self.app.logger.info(f"Worker '{self.auth}' didn't receive job {get_job_counter_id(job.id)}, job put back to the queue")
+            if not self.running_jobs and self.state == WorkerState.PROCESSING: # Keeps the worker offline if its connection was closed
+                await self.set_state(WorkerState.WAITING)
+
+
     async def check_and_update_state(self):
         self.last_request_time = time.time()
         if not self.running_jobs and not self.state == WorkerState.DISABLED:
             await self.set_state(WorkerState.WAITING)
 
 
-    async def clean_up_lapsed_jobs(self):
-        for job_id, job in self.running_jobs.copy().items():
-            if await job.state == JobState.LAPSED:
-                self.running_jobs.pop(job_id, None)
-                self.num_lapsed_jobs += 1
-
-
     async def check_for_offline_workers(self):
         async with self.lock:
             if time.time() - self.last_request_time > 2 * self.job_type.request_timeout and not self.state == WorkerState.DISABLED:
                 await self.set_state(WorkerState.OFFLINE)
 
 
-    def get_estimate_time(self, job):
-        return max(
-            0,
-            calculate_estimate_time(
-                self.mean_compute_duration, 
-                job.start_time_compute
+    def get_estimate(self, job):
+        """Get the estimated remaining compute time of the given running job.
+
+        Args:
+            job (Job): Job object
+
+        Returns:
+            Estimate: Estimated remaining time in seconds or None if no job of this worker was finished yet
+        """
+        duration = self.throughput_model.get_job_duration(max(job.effective_batch_size, len(self.running_jobs)))
+        if duration:
+            return Estimate(
+                max(0, calculate_estimate_time(duration.value, job.start_time_compute)),
+                max(0, calculate_estimate_time(duration.lower, job.start_time_compute)),
+                max(0, calculate_estimate_time(duration.upper, job.start_time_compute))
             )
-        )
 
 
 
 class Job():
+    # Jobs are retained until their result_lifetime expired, so the footprint per job is kept small: The attributes are
+    # slots, the timeouts are shared by all jobs of the endpoint and the event waking up readers only exists while a
+    # reader is waiting. Jobs have no lock, since their state changes contain no await and can't be interrupted.
+    __slots__ = (
+        'id', 'endpoint_name', 'job_data', 'app', 'settings', 'worker_auth', 'queue_seq', 'api_key', 'priority_class',
+        'flow_key', 'flow_seq', 'effective_batch_size', 'num_generated_tokens', 'last_update', 'state', 'progress_state',
+        'progress_version', 'update_event', 'result_future', 'start_time', 'start_time_compute', 'result_received_time',
+        'duration', 'compute_duration', 'pending_duration', 'metrics'
+    )
     id_counter = AtomicCounter()
 
     def __init__(self, job_data, app):
@@ -1059,15 +2064,21 @@ class Job():
         self.endpoint_name = job_data.pop('endpoint_name')
         self.job_data = job_data
         self.app = app
+        self.settings = app.endpoints.get(self.endpoint_name).job_settings # JobSettings shared by all jobs of the endpoint
         self.worker_auth = str()
-        self.job_inactivity_timeout = self.app.endpoints.get(self.endpoint_name).config.get('ENDPOINT', {}).get('job_inactivity_timeout')
-        self.max_time_in_queue = self.app.endpoints.get(self.endpoint_name).max_time_in_queue
-        self.result_lifetime = self.app.endpoints.get(self.endpoint_name).config.get('ENDPOINT', {}).get('result_lifetime')
+        self.queue_seq = None # Enqueue sequence number, set by JobQueue while the job is queued
+        self.api_key = None
+        self.priority_class = None
+        self.flow_key = None # Key of the FairShareFlow of the job with fair share scheduling
+        self.flow_seq = None
+        self.effective_batch_size = 0 # Maximum number of jobs processed in parallel by the worker while this job was running
+        self.num_generated_tokens = None
         self.last_update = time.time()
-        self.__state = JobState.QUEUED
+        self.state = JobState.QUEUED
         self.progress_state = dict()
-        self.lock = asyncio.Lock()
-        self.result_future = asyncio.Future(loop=app.loop)
+        self.progress_version = 0 # Incremented on every state or progress change of the job
+        self.update_event = None # asyncio.Event, created by the first reader waiting in wait_for_update()
+        self.result_future = asyncio.Future(loop=app.loop) # Done when the result is in the result store of the job handler
         self.start_time = time.time()
         self.start_time_compute = None
         self.result_received_time = None
@@ -1078,34 +2089,44 @@ class Job():
         self.metrics = dict()
 
 
-    @property
-    async def state(self):
-        if not self.__state == JobState.LAPSED and self.is_lapsed():
-            self.__state = JobState.LAPSED
-            self.result_received_time = time.time()
-            if self.app.admin_backend:
-                await self.app.admin_backend.admin_log_request_end(
-                    self.id,
-                    self.worker_auth,
-                    self.start_time_compute,
-                    self.result_received_time,
-                    self.__state,
-                    self.metrics,
-                    f'Job lapsed'
-                )
-        return self.__state
-
-
-    def is_lapsed(self):
-        now = time.time()
-        worker = self.app.job_handler.get_worker(self.worker_auth)
-        if self.__state == JobState.QUEUED and (now - self.start_time) > self.max_time_in_queue:
-            return True
-        elif self.__state == JobState.PROCESSING and ((now - self.last_update) > self.job_inactivity_timeout or worker.state == WorkerState.OFFLINE):
-            worker.running_jobs.pop(self.id, None)
-            return True
-        else:
-            return False
+    async def lapse(self, reason='Job lapsed'):
+        self.state = JobState.LAPSED
+        self.result_received_time = time.time()
+        if not self.result_future.done():
+            self.app.job_handler.result_store.put(self.id, {'error': reason})
+            self.result_future.set_result(None)
+        if self.app.admin_telemetry:
+            self.app.admin_telemetry.log_event(
+                'admin_log_request_end',
+                job_id=self.id,
+                worker_name=self.worker_auth,
+                start_time_compute_utc=self.start_time_compute,
+                end_time_utc=self.result_received_time,
+                request_state=self.state,
+                metrics=self.metrics,
+                request_error_msg=reason
+            )
+        self.notify_update()
+
+
+    async def cancel(self, reason='Job canceled'):
+        self.state = JobState.CANCELED
+        self.result_received_time = time.time()
+        if not self.result_future.done():
+            self.app.job_handler.result_store.put(self.id, {'error': reason})
+            self.result_future.set_result(None)
+        if self.app.admin_telemetry:
+            self.app.admin_telemetry.log_event(
+                'admin_log_request_end',
+                job_id=self.id,
+                worker_name=self.worker_auth,
+                start_time_compute_utc=self.start_time_compute,
+                end_time_utc=self.result_received_time,
+                request_state=self.state,
+                metrics=self.metrics,
+                request_error_msg=reason
+            )
+        self.notify_update()
 
 
     @classmethod
@@ -1130,62 +2151,110 @@ class Job():
         counter = await cls.id_counter.next()
         return f'{uuid.uuid4()}#{counter}'
 
+    @property
+    def queue_position_version(self):
+        queue = self.app.job_handler.get_queue(self.endpoint_name)
+        return queue.position_version if queue is not None else 0
+
+
     @property
     async def queue_position(self):
-        if await self.state == JobState.PROCESSING:
+        if self.state == JobState.PROCESSING:
             return 0
         else:
             queue = self.app.job_handler.get_queue(self.endpoint_name)
             if queue is not None:
-                return await queue.get_rank(self.id)
+                return queue.get_rank(self)
             else:
                 return -1
 
 
     async def set_progress_state(self, req_json):
-        async with self.lock:
-            self.progress_state = req_json
-            self.last_update = time.time()
-            self.__state = JobState.PROCESSING
-            progress_data = req_json.get('progress_data', None)
-            if progress_data:
-                self.metrics = progress_data.get('metrics', {})
-            else:
-                self.metrics = {}
+        self.progress_state = req_json
+        self.last_update = time.time()
+        progress_data = req_json.get('progress_data', None)
+        if progress_data:
+            self.metrics = progress_data.get('metrics', {})
+        else:
+            self.metrics = {}
+        self.notify_update()
 
 
     async def set_job_result(self, req_json):
-        async with self.lock:
-            self.result_received_time = time.time()
-            self.duration = self.result_received_time - self.start_time
-            self.compute_duration = self.result_received_time - self.start_time_compute
-            self.pending_duration = self.start_time - self.start_time_compute
-            self.metrics = req_json.get('metrics', {})
-            self.result_future.set_result(self.add_meta_data(req_json))
-        if self.app.admin_backend:
-            await self.app.admin_backend.admin_log_request_end(
-                self.id,
-                self.worker_auth,
-                self.start_time_compute,
-                self.result_received_time,
-                'success' if not req_json.get('error') else 'failed',
-                self.metrics,
-                req_json.get('error')
+        self.result_received_time = time.time()
+        self.duration = self.result_received_time - self.start_time
+        self.compute_duration = self.result_received_time - self.start_time_compute
+        self.pending_duration = self.start_time - self.start_time_compute
+        self.metrics = req_json.get('metrics', {})
+        self.num_generated_tokens = req_json.get('num_generated_tokens') or self.metrics.get('num_generated_tokens')
+        if not self.result_future.done():
+            self.app.job_handler.result_store.put(self.id, self.add_meta_data(req_json))
+            self.result_future.set_result(None)
+        self.notify_update()
+        if self.app.admin_telemetry:
+            self.app.admin_telemetry.log_event(
+                'admin_log_request_end',
+                job_id=self.id,
+                worker_name=self.worker_auth,
+                start_time_compute_utc=self.start_time_compute,
+                end_time_utc=self.result_received_time,
+                request_state='success' if not req_json.get('error') else 'failed',
+                metrics=self.metrics,
+                request_error_msg=req_json.get('error')
             )
 
 
 
     async def start(self, worker_auth):
-        async with self.lock:
-            self.worker_auth = worker_auth
-            self.__state = JobState.PROCESSING
-            self.start_time_compute = time.time()
+        self.worker_auth = worker_auth
+        self.state = JobState.PROCESSING
+        self.start_time_compute = time.time()
+        self.last_update = self.start_time_compute
+        self.notify_update()
+
+
+    async def requeue(self):
+        self.worker_auth = str()
+        self.state = JobState.QUEUED
+        self.start_time_compute = None
+        self.last_update = time.time()
+        self.notify_update()
 
 
     async def finish(self):
-        async with self.lock:
-            self.__state = JobState.DONE
-            self.progress_state.clear()
+        if self.state != JobState.CANCELED:
+            self.state = JobState.DONE
+        self.progress_state.clear()
+        self.notify_update()
+
+
+    def notify_update(self):
+        """Increment the progress version and wake up all readers waiting in wait_for_update().
+        """
+        self.progress_version += 1
+        if self.update_event is not None:
+            self.update_event.set()
+            self.update_event = None
+
+
+    async def wait_for_update(self, since_version, timeout):
+        """Wait until the progress version of the job is newer than the given version or the timeout is reached.
+
+        Args:
+            since_version (int): Last progress version known to the reader
+            timeout (float): Maximum time to wait in seconds
+
+        Returns:
+            int: Current progress version of the job
+        """
+        if self.progress_version <= since_version:
+            if self.update_event is None:
+                self.update_event = asyncio.Event()
+            try:
+                await asyncio.wait_for(self.update_event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.progress_version
 
 
     def add_meta_data(self, req_json):
@@ -0,0 +1,496 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import asyncio
+import errno
+import hashlib
+import inspect
+import json
+import os
+import socket
+import struct
+from dataclasses import asdict
+
+from .job_queue import JobHandler, Job, Worker, WorkerModel, JobState
+from .utils.ffmpeg import MediaBytes
+
+
+FRAME_HEADER = struct.Struct('!II') # Size of the JSON payload and number of binary attachments
+ATTACHMENT_HEADER = struct.Struct('!I') # Size of a binary attachment
+CONNECT_TIMEOUT = 10 # Time in seconds a server process tries to connect to the job state broker
+
+# JobHandler methods the server processes are allowed to call on the job state broker
+BROKER_METHODS = {
+    'worker_login',
+    'worker_job_request',
+    'worker_requeue_jobs',
+    'worker_update_progress_state',
+    'worker_set_job_result',
+    'endpoint_new_job',
+    'is_client_request_limit_reached',
+    'endpoint_cancel_job',
+    'endpoint_get_queue_estimate',
+    'endpoint_get_job',
+    'endpoint_get_progress_state',
+    'endpoint_wait_for_job_result',
+    'endpoint_wait_for_job_update',
+    'get_job_type_status',
+    'enable_worker',
+    'disable_worker',
+    'get_num_workers_online',
+    'get_all_workers',
+    'get_all_active_workers',
+    'get_worker_state',
+    'get_worker_config',
+    'get_worker_model',
+    'get_worker_throughput',
+    'get_job_state',
+    'get_job_snapshot',
+    'is_job_queued',
+    'is_job_future_done',
+    'get_estimate_time',
+    'get_free_queue_slots',
+    'is_worker_logged_in',
+    'set_worker_offline',
+    'register_client_session',
+}
+
+WORKER_ATTRIBUTES = (
+    'auth',
+    'state',
+    'max_batch_size',
+    'free_slots',
+    'gpu_name',
+    'num_gpus',
+    'version',
+    'interface_version',
+    'framework',
+    'framework_version',
+    'pytorch_version',
+    'throughput',
+)
+
+
+class JobStateBrokerError(Exception):
+    pass
+
+
+class JobStateBroker(JobHandler):
+    """Job handler sharing its job queues, jobs and workers with the other API server processes via a unix socket,
+    so client requests and worker job requests meet in the same job queue no matter which server process received them.
+    The first server process able to bind the socket becomes the broker, all other server processes use a JobHandlerClient.
+
+    Args:
+        app (Sanic): Sanic server instance
+        socket_path (str): Path of the unix socket
+    """
+    def __init__(self, app, socket_path):
+        super().__init__(app)
+        self.socket_path = socket_path
+        self.server = None
+        self.connections = dict() # key: asyncio.StreamWriter, value: dict with write lock and running calls
+
+
+    @classmethod
+    async def start_or_connect(cls, app, socket_path):
+        """Start the job state broker on the given socket or connect to the broker of another server process
+        if the socket is already bound.
+
+        Args:
+            app (Sanic): Sanic server instance
+            socket_path (str): Path of the unix socket
+
+        Returns:
+            JobStateBroker or JobHandlerClient: Job handler to be used by this server process
+        """
+        broker_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            broker_socket.bind(socket_path)
+        except OSError as error:
+            broker_socket.close()
+            if error.errno != errno.EADDRINUSE:
+                raise
+            job_handler = JobHandlerClient(app, socket_path)
+            await job_handler.connect()
+            app.logger.info(f'--- connected to job state broker on {socket_path}')
+            return job_handler
+        broker = cls(app, socket_path)
+        broker.server = await asyncio.start_unix_server(broker.handle_connection, sock=broker_socket)
+        app.logger.info(f'--- job state broker listening on {socket_path}')
+        return broker
+
+
+    @staticmethod
+    def remove_socket(socket_path):
+        """Remove the socket file left by a previous server run.
+
+        Args:
+            socket_path (str): Path of the unix socket
+        """
+        try:
+            os.unlink(socket_path)
+        except FileNotFoundError:
+            pass
+
+
+    async def register_client_session(self, client_session_auth_key, api_key):
+        await super().register_client_session(client_session_auth_key, api_key)
+        await self.broadcast({'event': 'client_session_registered', 'args': [client_session_auth_key, api_key]})
+
+
+    async def get_job_snapshot(self, job):
+        if job:
+            return {
+                'state': job.state,
+                'progress_version': job.progress_version,
+                'queue_position_version': job.queue_position_version
+            }
+        return {'state': JobState.UNKNOWN}
+
+
+    async def handle_connection(self, reader, writer):
+        connection = self.connections[writer] = {'write_lock': asyncio.Lock(), 'calls': dict()}
+        await self.send(writer, {'event': 'registered_keys', 'args': [dict(self.app.registered_keys)]})
+        try:
+            while True:
+                request = await read_frame(reader)
+                if request is None:
+                    break
+                if 'cancel' in request:
+                    call = connection['calls'].pop(request['cancel'], None)
+                    if call:
+                        call.cancel()
+                else:
+                    connection['calls'][request.get('id')] = asyncio.ensure_future(self.handle_request(writer, request))
+        finally:
+            for call in connection['calls'].values():
+                call.cancel()
+            del self.connections[writer]
+            writer.close()
+
+
+    async def handle_request(self, writer, request):
+        response = {'id': request.get('id')}
+        method = request.get('method')
+        try:
+            if method not in BROKER_METHODS:
+                raise JobStateBrokerError(f'Method {method} not available on job state broker')
+            result = getattr(self, method)(*self.decode(request.get('args', [])), **self.decode(request.get('kwargs', {})))
+            if inspect.isawaitable(result):
+                result = await result
+            response['result'] = self.encode(result)
+        except Exception as error:
+            self.app.logger.error(f'Job state broker call {method} failed: {error!r}')
+            response['error'] = repr(error)
+        connection = self.connections.get(writer)
+        if connection:
+            connection['calls'].pop(request.get('id'), None)
+            try:
+                await self.send(writer, response)
+            except ConnectionError:
+                pass
+
+
+    async def broadcast(self, message):
+        for writer in list(self.connections):
+            try:
+                await self.send(writer, message)
+            except ConnectionError:
+                pass
+
+
+    async def send(self, writer, message):
+        async with self.connections[writer]['write_lock']:
+            write_frame(writer, message)
+            await writer.drain()
+
+
+    def encode(self, obj):
+        if isinstance(obj, Job):
+            return {'__job__': {
+                'id': obj.id,
+                'endpoint_name': obj.endpoint_name,
+                'start_time': obj.start_time,
+                'progress_version': obj.progress_version,
+                'queue_position_version': obj.queue_position_version,
+                'state': obj.state
+            }}
+        elif isinstance(obj, Worker):
+            worker = {attribute: getattr(obj, attribute) for attribute in WORKER_ATTRIBUTES}
+            worker['model'] = asdict(obj.model)
+            return {'__worker__': worker}
+        elif isinstance(obj, WorkerModel):
+            return {'__worker_model__': asdict(obj)}
+        elif isinstance(obj, dict):
+            return {key: self.encode(value) for key, value in obj.items()}
+        elif isinstance(obj, (list, tuple)):
+            return [self.encode(value) for value in obj]
+        return obj
+
+
+    def decode(self, obj):
+        if isinstance(obj, dict):
+            if '__job__' in obj:
+                return self.get_job(obj['__job__'].get('id')) # None if the job was deleted meanwhile, the broker methods handle None
+            return {key: self.decode(value) for key, value in obj.items()}
+        elif isinstance(obj, list):
+            return [self.decode(value) for value in obj]
+        return obj
+
+
+
+class JobHandlerClient():
+    """Job handler of a server process forwarding all calls to the JobStateBroker of another server process.
+    Provides the same methods as JobHandler() used by the endpoints, the worker routes and the AdminInterface().
+
+    Args:
+        app (Sanic): Sanic server instance
+        socket_path (str): Path of the unix socket of the job state broker
+    """
+    def __init__(self, app, socket_path):
+        self.app = app
+        self.socket_path = socket_path
+        self.job_types = self.init_all_job_types()
+        self.reader = None
+        self.writer = None
+        self.write_lock = asyncio.Lock()
+        self.pending_calls = dict() # key: call id, value: asyncio.Future
+        self.call_counter = 0
+        self.connected = False
+
+
+    def init_all_job_types(self):
+        job_types = dict() # key: job_type_name, value: hashed worker auth key
+        for endpoint in self.app.endpoints.values():
+            job_types.setdefault(endpoint.worker_job_type, hashlib.sha256(endpoint.worker_auth_key.encode()).hexdigest())
+        return job_types
+
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + CONNECT_TIMEOUT
+        while True:
+            try:
+                self.reader, self.writer = await asyncio.open_unix_connection(self.socket_path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if loop.time() > deadline:
+                    raise JobStateBrokerError(f'No job state broker listening on {self.socket_path}')
+                await asyncio.sleep(0.1)
+        self.connected = True
+        asyncio.ensure_future(self.read_responses())
+
+
+    async def read_responses(self):
+        try:
+            while True:
+                message = await read_frame(self.reader)
+                if message is None:
+                    break
+                if 'event' in message:
+                    self.handle_event(message)
+                else:
+                    future = self.pending_calls.pop(message.get('id'), None)
+                    if future and not future.done():
+                        if 'error' in message:
+                            future.set_exception(JobStateBrokerError(message['error']))
+                        else:
+                            future.set_result(self.decode(message.get('result')))
+        finally:
+            self.connected = False # Further calls fail immediately instead of waiting for an answer that never comes
+            self.writer.close()
+        self.app.logger.error(f'Connection to job state broker on {self.socket_path} lost')
+        for future in self.pending_calls.values():
+            if not future.done():
+                future.set_exception(JobStateBrokerError('Connection to job state broker lost'))
+        self.pending_calls.clear()
+
+
+    def handle_event(self, message):
+        event = message.get('event')
+        if event == 'client_session_registered':
+            client_session_auth_key, api_key = message.get('args')
+            self.app.registered_keys[client_session_auth_key] = api_key
+        elif event == 'registered_keys':
+            self.app.registered_keys.update(message.get('args')[0])
+
+
+    async def call(self, method, *args, **kwargs):
+        """Call the given method on the job state broker and wait for its result.
+
+        Raises:
+            JobStateBrokerError: If the call failed on the broker or the connection to the broker is lost
+        """
+        if not self.connected:
+            raise JobStateBrokerError(f'Not connected to job state broker on {self.socket_path}')
+        self.call_counter += 1
+        call_id = self.call_counter
+        future = asyncio.get_running_loop().create_future()
+        self.pending_calls[call_id] = future
+        try:
+            await self.send({'id': call_id, 'method': method, 'args': self.encode(args), 'kwargs': self.encode(kwargs)})
+        except ConnectionError as error:
+            self.pending_calls.pop(call_id, None)
+            raise JobStateBrokerError(f'Connection to job state broker lost: {error!r}')
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if self.pending_calls.pop(call_id, None) and self.connected:
+                try:
+                    await self.send({'cancel': call_id})
+                except ConnectionError:
+                    pass
+            raise
+
+
+    async def send(self, message):
+        async with self.write_lock:
+            write_frame(self.writer, message)
+            await self.writer.drain()
+
+
+    def encode(self, obj):
+        if isinstance(obj, RemoteJob):
+            return {'__job__': {'id': obj.id}}
+        elif isinstance(obj, dict):
+            return {key: self.encode(value) for key, value in obj.items()}
+        elif isinstance(obj, (list, tuple)):
+            return [self.encode(value) for value in obj]
+        return obj
+
+
+    def decode(self, obj):
+        if isinstance(obj, dict):
+            if '__job__' in obj:
+                return RemoteJob(self, **obj['__job__'])
+            elif '__worker__' in obj:
+                return RemoteWorker(**obj['__worker__'])
+            elif '__worker_model__' in obj:
+                return WorkerModel(**obj['__worker_model__'])
+            return {key: self.decode(value) for key, value in obj.items()}
+        elif isinstance(obj, list):
+            return [self.decode(value) for value in obj]
+        return obj
+
+
+    async def endpoint_get_job_state(self, job):
+        if job:
+            snapshot = await self.call('get_job_snapshot', job)
+            job.progress_version = snapshot.get('progress_version', job.progress_version)
+            job.queue_position_version = snapshot.get('queue_position_version', job.queue_position_version)
+            job.state = snapshot.get('state')
+            return job.state
+
+
+    async def endpoint_wait_for_job_update(self, job, since_version, timeout, since_queue_version=None):
+        if job:
+            progress_version = await self.call('endpoint_wait_for_job_update', job, since_version, timeout, since_queue_version)
+            if progress_version is not None:
+                job.progress_version = progress_version
+            return progress_version
+
+
+    async def register_client_session(self, client_session_auth_key, api_key):
+        self.app.registered_keys[client_session_auth_key] = api_key
+        await self.call('register_client_session', client_session_auth_key, api_key)
+
+
+    def is_worker_auth_key_valid(self, auth_key, job_type_name):
+        worker_auth_key = self.job_types.get(job_type_name)
+        return bool(worker_auth_key) and worker_auth_key == hashlib.sha256(auth_key.encode()).hexdigest()
+
+
+    async def check_for_offline_workers(self):
+        # Done by the job state broker
+        pass
+
+
+def remote_method(method):
+    async def call_broker(self, *args, **kwargs):
+        return await self.call(method, *args, **kwargs)
+    call_broker.__name__ = method
+    return call_broker
+
+
+for method in BROKER_METHODS:
+    if not hasattr(JobHandlerClient, method):
+        setattr(JobHandlerClient, method, remote_method(method))
+
+
+class RemoteJob():
+    """Job of the job state broker as seen by another server process. The job state is the state at the last answer
+    of the broker and is refreshed by JobHandlerClient.endpoint_get_job_state(), the progress versions are updated with
+    every answer of the broker.
+
+    Args:
+        job_handler (JobHandlerClient): Job handler connected to the job state broker
+        id (str): Job id
+        endpoint_name (str): Name of the endpoint of the job
+        start_time (float): Time the job was created
+        progress_version (int): Progress version of the job
+        queue_position_version (int): Position version of the queue of the job
+        state (str): State of the job
+    """
+    def __init__(self, job_handler, id, endpoint_name, start_time, progress_version, queue_position_version, state=None):
+        self.job_handler = job_handler
+        self.id = id
+        self.endpoint_name = endpoint_name
+        self.start_time = start_time
+        self.progress_version = progress_version
+        self.queue_position_version = queue_position_version
+        self.state = state
+
+
+class RemoteWorker():
+    """Worker of the job state broker as seen by another server process.
+    """
+    def __init__(self, model, **worker_attributes):
+        self.model = WorkerModel(**model)
+        for attribute, value in worker_attributes.items():
+            setattr(self, attribute, value)
+
+
+def write_frame(writer, message):
+    """Write the message as JSON payload to the stream. Binary data like media inputs (MediaBytes) is not base64 
+    encoded but replaced by a reference and appended to the payload as binary attachment.
+    """
+    attachments = list()
+    payload = json.dumps(message, default=lambda obj: encode_attachment(obj, attachments)).encode()
+    writer.write(FRAME_HEADER.pack(len(payload), len(attachments)) + payload)
+    for attachment in attachments:
+        writer.write(ATTACHMENT_HEADER.pack(len(attachment)))
+        writer.write(attachment)
+
+
+async def read_frame(reader):
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+        payload_size, num_attachments = FRAME_HEADER.unpack(header)
+        payload = await reader.readexactly(payload_size)
+        attachments = list()
+        for _ in range(num_attachments):
+            attachment_header = await reader.readexactly(ATTACHMENT_HEADER.size)
+            attachments.append(await reader.readexactly(ATTACHMENT_HEADER.unpack(attachment_header)[0]))
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    if attachments:
+        return json.loads(payload, object_hook=lambda obj: decode_attachment(obj, attachments))
+    return json.loads(payload)
+
+
+def encode_attachment(obj, attachments):
+    if isinstance(obj, bytes):
+        attachments.append(obj)
+        return {
+            '__bytes__': len(attachments) - 1,
+            'media_type': getattr(obj, 'media_type', None),
+            'media_format': getattr(obj, 'media_format', None)
+        }
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def decode_attachment(obj, attachments):
+    if '__bytes__' in obj:
+        return MediaBytes(attachments[obj['__bytes__']], obj.get('media_type'), obj.get('media_format'))
+    return obj
@@ -187,19 +187,51 @@ class OpenAI():
         if stream:
             response_stream = await request.respond(content_type='text/event-stream')
             
-            job = self.app.job_handler.get_job(job_id)
+            job = await self.app.job_handler.endpoint_get_job(job_id)
             job_running = True
             prev_len = 0
-            while job_running:
-                response, error_code = await endpoint.process_api_progress(request, job)
-                if response['job_state'] == JobState.PROCESSING or response['job_state'] == JobState.QUEUED:
-                    progress_data = response['progress'].get('progress_data', {})
-                    text = progress_data.get('text', "")
-                    new_len = len(text)
-
-                    if(new_len > prev_len):
+            try:
+                while job_running:
+                    progress_version = job.progress_version
+                    response, error_code = await endpoint.process_api_progress(request, job)
+                    if response['job_state'] == JobState.PROCESSING or response['job_state'] == JobState.QUEUED:
+                        progress_data = response['progress'].get('progress_data', {})
+                        text = progress_data.get('text', "")
+                        new_len = len(text)
+
+                        if(new_len > prev_len):
+                            content = text[prev_len:]
+                            prev_len = new_len
+                            progress_response = {
+                                "id":"chatcmpl-" + job_id,
+                                "object":"chat.completion.chunk",
+                                "created": self.__timestamp(),
+                                "model": model, 
+                                "system_fingerprint": system_fingerprint, 
+                                "choices":[
+                                    {
+                                        "index":0,
+                                        "delta":{"role":"assistant","content": content},
+                                        "logprobs":None,
+                                        "finish_reason":None
+                                    }
+                                ]
+                            }
+                            await response_stream.send("data: " + json.dumps(progress_response) + "\n\n")
+
+                        await self.app.job_handler.endpoint_wait_for_job_update(job, progress_version, endpoint.progress_wait_timeout)
+
+                    else:
+                        job_running = False
+                        response = response.get('job_result', {})
+                        text = response.get('text', "")
                         content = text[prev_len:]
-                        prev_len = new_len
+                        prompt_tokens =  response.get('prompt_length', 0)
+                        completion_tokens = response.get('num_generated_tokens', 0)
+                        total_tokens = response.get('current_context_length', 0)
+
+                        response = self.__create_chat_completion_response(model, job_id, content, prompt_tokens, completion_tokens, total_tokens)
+
                         progress_response = {
                             "id":"chatcmpl-" + job_id,
                             "object":"chat.completion.chunk",
@@ -211,42 +243,15 @@ class OpenAI():
                                     "index":0,
                                     "delta":{"role":"assistant","content": content},
                                     "logprobs":None,
-                                    "finish_reason":None
+                                    "finish_reason":"stop"
                                 }
                             ]
                         }
-                        await response_stream.send("data: " + json.dumps(progress_response) + "\n\n")
 
-                    await asyncio.sleep(0.1)
-
-                else:
-                    job_running = False
-                    response = response.get('job_result', {})
-                    text = response.get('text', "")
-                    content = text[prev_len:]
-                    prompt_tokens =  response.get('prompt_length', 0)
-                    completion_tokens = response.get('num_generated_tokens', 0)
-                    total_tokens = response.get('current_context_length', 0)
-
-                    response = self.__create_chat_completion_response(model, job_id, content, prompt_tokens, completion_tokens, total_tokens)
-
-                    progress_response = {
-                        "id":"chatcmpl-" + job_id,
-                        "object":"chat.completion.chunk",
-                        "created": self.__timestamp(),
-                        "model": model, 
-                        "system_fingerprint": system_fingerprint, 
-                        "choices":[
-                            {
-                                "index":0,
-                                "delta":{"role":"assistant","content": content},
-                                "logprobs":None,
-                                "finish_reason":"stop"
-                            }
-                        ]
-                    }
-
-                    await response_stream.send("data: " + json.dumps(progress_response) + "\n\n")
+                        await response_stream.send("data: " + json.dumps(progress_response) + "\n\n")
+            except asyncio.CancelledError:
+                await endpoint.cancel_job(job, 'Job canceled since client disconnected')
+                raise
 
             await response_stream.send("data: [DONE]\n\n")
             await response_stream.eof()
@@ -0,0 +1,216 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import os
+import json
+import shutil
+import sqlite3
+import asyncio
+import tempfile
+import threading
+from collections import OrderedDict
+from sanic.log import logging
+
+from .utils.misc import run_in_executor
+from .utils.ffmpeg import MediaBytes
+
+logger = logging.getLogger('API')
+
+MEGABYTE = 1024 * 1024
+
+
+class ResultStore():
+    """Store of the results of finished jobs, kept until the result_lifetime of the job expired and the job is deleted.
+    Results are kept in memory up to max_size. If the results in memory exceed max_size, the oldest results are spilled
+    by a background task as JSON to a table in a sqlite file and read back when the client fetches the result with
+    /progress. The sqlite file is created in a private directory in spill_dir, only accessible by the server process.
+    Putting a result never waits for the disk, so the worker sending the result isn't slowed down.
+
+    Args:
+        max_size (int, optional): Maximum size of the results in memory in bytes, 0 = all results are spilled. Defaults to 512 MB.
+        spill_dir (str, optional): Directory in which the private directory of the sqlite file is created. Defaults to None (temp directory).
+    """
+    def __init__(self, max_size=512 * MEGABYTE, spill_dir=None):
+        self.max_size = max_size
+        self.spill_dir = spill_dir
+        self.spill_file = None # Created with the first spilled result
+        self.connection = None # Opened with the first spilled result
+        self.connection_lock = threading.Lock() # The executor threads share the connection
+        self.entries = OrderedDict() # key: job_id, value: tuple(result, size), oldest first
+        self.size = 0
+        self.spilled = dict() # key: job_id, value: size of the result as JSON
+        self.spill_size = 0
+        self.spill_task = None
+        self.num_spills = 0
+        self.num_spill_reads = 0
+        self.num_spill_errors = 0
+
+
+    @classmethod
+    def from_config(cls, config):
+        """Create the result store from the section [RESULT_STORE] of the server configuration.
+
+        Args:
+            config (dict): Result store configuration with max_size in MB and spill_dir
+
+        Returns:
+            ResultStore: Result store
+        """
+        return cls(
+            config.get('max_size', 512) * MEGABYTE,
+            config.get('spill_dir') or None
+        )
+
+
+    def put(self, job_id, result):
+        """Add the result of the given job to the store and start spilling the oldest results if the results in
+        memory exceed max_size.
+
+        Args:
+            job_id (str): Job id
+            result (dict): Result of the job
+        """
+        self.remove_entry(job_id)
+        size = self.get_result_size(result)
+        self.entries[job_id] = (result, size)
+        self.size += size
+        if self.size > self.max_size and (self.spill_task is None or self.spill_task.done()):
+            self.spill_task = asyncio.ensure_future(self.spill())
+
+
+    async def get(self, job_id):
+        """Get the result of the given job from memory or from the spill file.
+
+        Args:
+            job_id (str): Job id
+
+        Returns:
+            dict: Result of the job or None if the result is unknown
+        """
+        entry = self.entries.get(job_id)
+        if entry is not None:
+            return entry[0]
+        if job_id in self.spilled:
+            result = await run_in_executor(self.read_spilled_result, job_id)
+            if result is not None:
+                self.num_spill_reads += 1
+            return result
+
+
+    async def remove(self, job_id):
+        """Remove the result of the given job from memory and from the spill file.
+
+        Args:
+            job_id (str): Job id
+        """
+        self.remove_entry(job_id)
+        spilled_size = self.spilled.pop(job_id, None)
+        if spilled_size is not None:
+            self.spill_size -= spilled_size
+            await run_in_executor(self.delete_spilled_result, job_id)
+
+
+    def remove_entry(self, job_id):
+        entry = self.entries.pop(job_id, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+
+    async def spill(self):
+        """Write the oldest results to the spill file until the results in memory don't exceed max_size. A result
+        stays in memory while it is written, so it can be fetched in the meantime.
+        """
+        while self.size > self.max_size and self.entries:
+            job_id, (result, size) = next(iter(self.entries.items()))
+            try:
+                spilled_size = await run_in_executor(self.write_spilled_result, job_id, result)
+            except (sqlite3.Error, OSError, TypeError, ValueError) as error:
+                self.num_spill_errors += 1
+                logger.error(f'Could not spill job result to {self.spill_file or self.spill_dir or tempfile.gettempdir()}: {error!r}')
+                return
+            if self.entries.get(job_id, (None, ))[0] is result:
+                self.remove_entry(job_id)
+                self.spilled[job_id] = spilled_size
+                self.spill_size += spilled_size
+                self.num_spills += 1
+            else: # Removed or replaced while it was written
+                await run_in_executor(self.delete_spilled_result, job_id)
+
+
+    def write_spilled_result(self, job_id, result):
+        data = json.dumps(result, default=MediaBytes.json_default)
+        with self.connection_lock:
+            if self.connection is None:
+                self.connection = self.open_spill_file()
+            self.connection.execute('INSERT OR REPLACE INTO results (job_id, result) VALUES (?, ?)', (job_id, data))
+        return len(data)
+
+
+    def read_spilled_result(self, job_id):
+        try:
+            with self.connection_lock:
+                row = self.connection.execute('SELECT result FROM results WHERE job_id = ?', (job_id, )).fetchone()
+            return json.loads(row[0]) if row else None
+        except (sqlite3.Error, ValueError) as error:
+            logger.error(f'Could not read spilled job result from {self.spill_file}: {error!r}')
+
+
+    def delete_spilled_result(self, job_id):
+        with self.connection_lock:
+            self.connection.execute('DELETE FROM results WHERE job_id = ?', (job_id, ))
+
+
+    def open_spill_file(self):
+        if self.spill_file is None:
+            self.spill_file = os.path.join(tempfile.mkdtemp(prefix='aime_api_server_results_', dir=self.spill_dir), 'results.sqlite')
+        connection = sqlite3.connect(self.spill_file, check_same_thread=False, isolation_level=None) # Autocommit
+        connection.execute('PRAGMA journal_mode = OFF') # Spilled results don't have to survive a crash
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.execute('CREATE TABLE IF NOT EXISTS results (job_id TEXT PRIMARY KEY, result TEXT)')
+        return connection
+
+
+    def close(self):
+        """Close and remove the spill file and its directory.
+        """
+        if self.spill_task is not None:
+            self.spill_task.cancel()
+        with self.connection_lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+            if self.spill_file is not None:
+                shutil.rmtree(os.path.dirname(self.spill_file), ignore_errors=True)
+
+
+    @staticmethod
+    def get_result_size(result):
+        """Estimate the memory size of the given result from the length of its strings and binary data, which are
+        dominated by base64 encoded or binary media outputs.
+
+        Args:
+            result (dict, list, str or bytes): Result of the job
+
+        Returns:
+            int: Size of the result in bytes
+        """
+        if isinstance(result, (str, bytes)):
+            return len(result)
+        elif isinstance(result, dict):
+            return sum(len(key) + ResultStore.get_result_size(value) for key, value in result.items())
+        elif isinstance(result, (list, tuple)):
+            return sum(ResultStore.get_result_size(value) for value in result)
+        return 8
+
+
+    def get_status(self):
+        return {
+            'num_results': len(self.entries),
+            'resident_size': self.size,
+            'num_spilled_results': len(self.spilled),
+            'spill_size': self.spill_size,
+            'num_spills': self.num_spills,
+            'num_spill_reads': self.num_spill_reads,
+            'num_spill_errors': self.num_spill_errors
+        }
@@ -1,14 +1,13 @@
-import uuid
-import asyncio
 import base64
 import subprocess
 import json
 import re
+import hashlib
 from sanic.log import logging
-import aiofiles
-import tempfile
 
 from .misc import run_in_executor
+from .media_probe import probe_media_header
+from .ffmpeg_executor import FFmpegExecutor
 
 logger = logging.getLogger('API')
 
@@ -46,6 +45,95 @@ class MediaParams(dict):
         })
 
 
+class MediaBytes(bytes):
+    """Binary media data of an input parameter with its media type and format. Media uploaded as multipart/form-data 
+    or application/octet-stream and converted media are kept as MediaBytes in the job data. The base64 representation 
+    is only created when the job data is sent as JSON to an API worker and is cached, so it is encoded at most once.
+    """
+    def __new__(cls, data, media_type=None, media_format=None):
+        media_bytes = super().__new__(cls, data)
+        media_bytes.media_type = media_type
+        media_bytes.media_format = media_format
+        media_bytes.base64_string = None
+        return media_bytes
+
+
+    @classmethod
+    def from_mime_type(cls, data, mime_type):
+        """Create MediaBytes from the given data and its MIME type like 'image/png'.
+
+        Args:
+            data (bytes): Binary media data
+            mime_type (str): MIME type of the media data
+
+        Returns:
+            MediaBytes: Binary media data with media type and format
+        """
+        media_type, _, format_name = (mime_type or '').partition('/')
+        if format_name:
+            return cls(data, media_type, MIME_TYPE_DICT.get(format_name, lambda media_type: format_name)(media_type))
+        return cls(data)
+
+
+    def to_base64_string(self):
+        if self.base64_string is None:
+            self.base64_string = f'data:{self.media_type}/{self.media_format};base64,' + base64.b64encode(self).decode('utf-8')
+        return self.base64_string
+
+
+    @staticmethod
+    def json_default(obj):
+        """Default function for json.dumps() to encode MediaBytes as base64 string.
+        """
+        if isinstance(obj, MediaBytes):
+            return obj.to_base64_string()
+        raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class MediaUpload():
+    """Media input parameter streamed from the request body into a temp file chunk by chunk, so large audio and video 
+    uploads are neither buffered in the request nor copied for decoding. ffprobe and ffmpeg read the media from the 
+    temp file. The SHA-256 hash of the data is computed while receiving it and used for the key of the media cache.
+
+    Args:
+        temp_file (MediaTempFile): Temp file the data is written to
+        media_type (str, optional): Media type of the input parameter like 'audio'. Defaults to None.
+        media_format (str, optional): Media format given by the client. Defaults to None.
+    """
+    def __init__(self, temp_file, media_type=None, media_format=None):
+        self.temp_file = temp_file
+        self.media_type = media_type
+        self.media_format = media_format
+        self.size = 0
+        self.hash = hashlib.sha256()
+
+
+    async def receive(self, stream):
+        """Write the request body stream to the temp file.
+
+        Args:
+            stream (sanic.http.Stream): Stream of the request body
+
+        Returns:
+            MediaUpload: self
+        """
+        try:
+            async for chunk in stream:
+                if chunk:
+                    self.hash.update(chunk)
+                    await self.temp_file.append(chunk)
+                    self.size += len(chunk)
+            await self.temp_file.flush()
+        except BaseException:
+            await self.remove()
+            raise
+        return self
+
+
+    async def remove(self):
+        await self.temp_file.remove()
+
+
 VIDEO_FILTER_FLAG = '-vf'
 FORMAT_FLAG = '-f'
 VIDEO_CODEC_FLAG = '-vcodec'
@@ -194,13 +282,16 @@ class FFmpeg():
         config (dict, optional): Configuration of parameter containing arg_type, resize_method, input_temp_file_config, output_temp_file_config and check_conversion_config. Defaults to {}.
         errors (list, optional): Error list to accumulate errors occuring during media analysis or conversion. If not given, errors will be raise. Defaults to None.
         media_binary (bytes, optional): Binary data of input data as alternative to base64_string. Defaults to None.
+        media_upload (MediaUpload, optional): Input data streamed into a temp file as alternative to base64_string. Defaults to None.
         arg_type (str, optional): Input parameter type. Must be present if no config is given. Supported values: ('image', 'audio', 'video'). Defaults to None.
         resize_method (str, optional): Resize method for input image conversion. Supported values: ('scale', 'crop'). Defaults to None.
         input_temp_file_config (str, optional): Config whether an input temp file is generated. Supported values: ('auto', 'yes', 'no'). Defaults to None.
         output_temp_file_config (str, optional): Config whether an output temp file is generated. Supported values: ('auto', 'yes', 'no'). Defaults to None.
         check_conversion_config (bool, optional): Config whether to check if the media attributes of the input parameter are as supposed after its conversion. Defaults to False.
+        endpoint_name (str, optional): Name of the endpoint the media belongs to, to apply its quota of concurrent ffmpeg processes. Defaults to None.
     """
     ffmpeg_installed = None 
+    executor = FFmpegExecutor() # Pool of the ffmpeg and ffprobe processes of all media inputs, configured in [FFMPEG] of the server config
     def __init__(
         self,
         param_name,
@@ -208,11 +299,13 @@ class FFmpeg():
         config={},
         errors=None,
         media_binary=None,
+        media_upload=None,
         arg_type=None,
         resize_method=None,
         input_temp_file_config=None,
         output_temp_file_config=None,
         check_conversion_config=False,
+        endpoint_name=None
         ):
         """Python binding for FFmpeg to analyze and convert media data.
 
@@ -222,21 +315,25 @@ class FFmpeg():
             config (dict, optional): Configuration of parameter containing arg_type, resize_method, input_temp_file_config, output_temp_file_config and check_conversion_config. Defaults to {}.
             errors (list, optional): Error list to accumulate errors occuring during media analysis or conversion. If not given, errors will be raise. Defaults to None.
             media_binary (bytes, optional): Binary data of input data as alternative to base64_string. Defaults to None.
+            media_upload (MediaUpload, optional): Input data streamed into a temp file as alternative to base64_string. Defaults to None.
             arg_type (str, optional): Input parameter type. Must be present if no config is given. Supported values: ('image', 'audio', 'video'). Defaults to None.
             resize_method (str, optional): Resize method for input image conversion. Supported values: ('scale', 'crop'). Defaults to None.
             input_temp_file_config (str, optional): Config whether an input temp file is generated. Supported values: ('auto', 'yes', 'no'). Defaults to None.
             output_temp_file_config (str, optional): Config whether an output temp file is generated. Supported values: ('auto', 'yes', 'no'). Defaults to None.
             check_conversion_config (bool, optional): Config whether to check if the media attributes of the input parameter are as supposed after its conversion. Defaults to False.
+            endpoint_name (str, optional): Name of the endpoint the media belongs to, to apply its quota of concurrent ffmpeg processes. Defaults to None.
         """        
         self.param_name = param_name
         self.base64_string = base64_string
         self.media_binary = media_binary
+        self.media_upload = media_upload
         self.errors = errors
         self.arg_type = config.get('type') or arg_type
         self.resize_method = resize_method or config.get('resize_method')
         self.input_temp_file_config = input_temp_file_config or config.get('input_temp_file', 'auto')
         self.output_temp_file_config = output_temp_file_config or config.get('output_temp_file', 'auto')
         self.check_conversion_config = check_conversion_config or config.get('check_conversion', True)
+        self.endpoint_name = endpoint_name
 
         self.media_params = MediaParams()
         self.media_converted = False
@@ -247,7 +344,7 @@ class FFmpeg():
     
 
     async def analyze(self, base64_string=None, media_binary=None):
-        """Analyze input parameter with ffprobe. Save the measured media parameters in self.media_params and return it.
+        """Analyze input parameter from its header for common formats or with ffprobe. Save the measured media parameters in self.media_params and return it.
 
         Args:
             base64_string (str, optional): String of base64 encoded input parameter. Defaults to None.
@@ -258,7 +355,14 @@ class FFmpeg():
         """        
        
         self.media_binary = media_binary or self.media_binary
-        if not self.media_binary:
+        if isinstance(self.media_binary, MediaBytes):
+            self.base64_type = self.media_binary.media_type
+            self.base64_format = self.media_binary.media_format
+        elif self.media_upload and not self.media_binary:
+            self.base64_type = self.media_upload.media_type
+            self.base64_format = self.media_upload.media_format
+            self.current_temp_file = self.media_upload.temp_file
+        if not self.media_binary and not self.current_temp_file:
             self.base64_string = base64_string or self.base64_string             
             self.media_binary = await run_in_executor(self.convert_base64_string_to_binary)
         await self.__check_media_with_ffprobe()
@@ -275,20 +379,23 @@ class FFmpeg():
         self.resize_method = resize_method or self.resize_method
         ffmpeg_cmd = self.__make_ffmpeg_cmd(target_media_params)
         if ffmpeg_cmd:
-            ffmpeg_process = await asyncio.create_subprocess_exec(*ffmpeg_cmd, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
             logger.info(f'Input parameter "{self.param_name}" type "{self.arg_type}" converting from {self.format_params_for_logger(self.media_params)} to {self.format_params_for_logger(target_media_params)}')
             
-            self.media_binary, conversion_error = await ffmpeg_process.communicate(input=self.media_binary if not self.current_temp_file else None)
+            self.media_binary, conversion_error, returncode = await self.executor.run(
+                ffmpeg_cmd,
+                self.media_binary if not self.current_temp_file else None,
+                self.endpoint_name,
+                (self.current_temp_file, self.output_temp_file)
+            )
             if self.current_temp_file:
-                await aiofiles.os.remove(self.current_temp_file)
+                await self.current_temp_file.remove()
                 self.current_temp_file = None
-            if ffmpeg_process.returncode != 0:
-                self.__handle_error(f'ffmpeg returned error code {ffmpeg_process.returncode} and the message {conversion_error.decode()}', TypeError)
+            if returncode != 0:
+                self.__handle_error(f'ffmpeg returned error code {returncode} and the message {conversion_error.decode()}', TypeError)
             else:
                 if self.output_temp_file:
                     self.current_temp_file = self.output_temp_file
-                    async with aiofiles.open(self.output_temp_file, 'rb') as file:
-                        self.media_binary = await file.read()
+                    self.media_binary = await self.output_temp_file.read()
                 self.media_converted = True
                 if self.check_conversion_config:
                     await self.__check_media_with_ffprobe()
@@ -301,26 +408,46 @@ class FFmpeg():
                             f"WARNING: The media input parameters do not match the target parameters after the conversion! "+\
                             f"Parameters should be {self.format_params_for_logger(target_media_params)} but are {self.format_params_for_logger(self.media_params)}."
                         )
-        if self.current_temp_file:
-            await aiofiles.os.remove(self.current_temp_file)
+        if self.media_binary is None and self.current_temp_file:
+            self.media_binary = await self.current_temp_file.read()
+        await self.remove_temp_files()
+
+
+    async def remove_temp_files(self):
+        """Remove the input and output temp files of the media. Called at the end of convert(), has to be called 
+        explicitly if the media is only analyzed.
+        """
+        for temp_file in (self.current_temp_file, self.output_temp_file):
+            if temp_file:
+                await temp_file.remove()
+        self.current_temp_file = None
+        self.output_temp_file = None
 
 
     async def get_data(self, output_format='base64'):
         """Get the base64 or binary representation of the stored media data
 
         Args:
-            output_format (str, optional): Desired output format. Supported values: ('base64', 'binary'). Defaults to 'base64'.
+            output_format (str, optional): Desired output format. Supported values: ('base64', 'binary', 'media_bytes'). 
+                With 'media_bytes' the binary data is returned as MediaBytes with media type and format. Defaults to 'base64'.
 
         Returns:
             str or bytes: Base64 or binary representation of stored media data.
         """        
+        if self.media_binary is None and self.current_temp_file:
+            self.media_binary = await self.current_temp_file.read()
         if output_format == 'base64':
-            if self.media_converted:
+            if self.media_converted or not self.base64_string:
                 return await run_in_executor(self.convert_binary_to_base64_string)
             else:
                 return self.base64_string
         elif output_format in ('binary', bytes):
             return self.media_binary
+        elif output_format == 'media_bytes':
+            media_format = self.media_params.get(MediaParams.FORMAT)
+            if isinstance(self.media_binary, MediaBytes) and self.media_binary.media_format == media_format:
+                return self.media_binary
+            return MediaBytes(self.media_binary, self.arg_type, media_format)
 
 
 
@@ -383,26 +510,31 @@ class FFmpeg():
                                 self.media_params[param_name] = value              
 
 
+    def __check_media_header(self):
+        """Parse the media parameters of PNG, JPEG, WebP, WAV and MP3 data from its header in-process.
+
+        Returns:
+            bool: True if the media parameters could be parsed, False if the media has to be analyzed with ffprobe
+        """
+        header_params = probe_media_header(self.media_binary)
+        if header_params:
+            self.media_params = MediaParams()
+            self.media_params.update(header_params)
+            logger.info(f'Header analysis of input parameter "{self.param_name}" type "{self.arg_type}": {self.format_params_for_logger(self.media_params)}')
+            return True
+        return False
+
+
     async def __check_media_with_ffprobe(self):
+        header_parsed = self.__check_media_header()
         if not self.output_temp_file:
-            ffprobe_process = await asyncio.create_subprocess_exec(
-                *self.__make_ffprobe_command(), 
-                stdin=asyncio.subprocess.PIPE, 
-                stdout=asyncio.subprocess.PIPE, 
-                stderr=asyncio.subprocess.PIPE
-            )
-            ffprobe_result, _ = await ffprobe_process.communicate(input=self.media_binary)
-            self.__parse_media_params_from_ffprobe_result(ffprobe_result)
-            logger.info(f'ffprobe analysis of input parameter "{self.param_name}" type "{self.arg_type}": {self.format_params_for_logger(self.media_params)}')
-            try:
-                await ffprobe_process.stdin.wait_closed()
-            except BrokenPipeError:
-                pass    # Non-critical issue in asyncio.create_subprocess_exec, see https://github.com/python/cpython/issues/104340
-                        # Didn't find solution for process being closed before input is fully received.
-                        # BrokenPipeError only handable in process.stdin.wait_closed() but is ignored anyway. Result is still present.
+            if not header_parsed and self.media_binary is not None:
+                ffprobe_result, _, _ = await self.executor.run(self.__make_ffprobe_command(), self.media_binary, self.endpoint_name)
+                self.__parse_media_params_from_ffprobe_result(ffprobe_result)
+                logger.info(f'ffprobe analysis of input parameter "{self.param_name}" type "{self.arg_type}": {self.format_params_for_logger(self.media_params)}')
 
             if self.media_params.get(MediaParams.FORMAT):
-                if self.base64_format not in self.media_params.get(MediaParams.FORMAT, '').split(',') and not self.media_converted:
+                if self.base64_format and self.base64_format not in self.media_params.get(MediaParams.FORMAT, '').split(',') and not self.media_converted:
                     logger.warning(
                         f'Media format "{self.base64_format}" specified in base64 header of {self.param_name} is different to' +\
                         f'media format measured by ffprobe "{self.media_params.get(MediaParams.FORMAT)}"!'
@@ -410,23 +542,35 @@ class FFmpeg():
             auto_temp_file_condition = not self.arg_type == 'image' or self.media_params.get(MediaParams.FORMAT) == 'tiff' or self.base64_format == 'gif'
             if not self.current_temp_file:
                 if self.media_params.get(MediaParams.ENCODER) == 'Chrome':
-                    self.current_temp_file = f'{tempfile.gettempdir()}/{str(uuid.uuid4())[:8]}.{self.media_params.get(MediaParams.FORMAT) or self.base64_format}'
+                    self.current_temp_file = self.executor.create_temp_file(self.media_params.get(MediaParams.FORMAT) or self.base64_format)
                     await self.remux_media_file()
                 elif self.input_temp_file_config == 'yes' or (self.input_temp_file_config == 'auto' and auto_temp_file_condition):
-                    self.current_temp_file = f'{tempfile.gettempdir()}/{str(uuid.uuid4())[:8]}.{self.media_params.get(MediaParams.FORMAT) or self.base64_format}'
-                    async with aiofiles.open(self.current_temp_file, 'wb') as temp_file:
-                        await temp_file.write(self.media_binary)
+                    self.current_temp_file = self.executor.create_temp_file(self.media_params.get(MediaParams.FORMAT) or self.base64_format)
+                    await self.current_temp_file.write(self.media_binary)
             
 
-        if self.current_temp_file:
-            ffprobe_process = await asyncio.create_subprocess_exec(*self.__make_ffprobe_command(self.current_temp_file), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-            ffprobe_result, _ = await ffprobe_process.communicate()
-            self.__parse_media_params_from_ffprobe_result(ffprobe_result)
-            logger.info(f'ffprobe analysis of input parameter with temp file "{self.param_name}" type "{self.arg_type}": {self.format_params_for_logger(self.media_params)}')
+        if self.current_temp_file and not header_parsed:
+            await self.__check_temp_file_with_ffprobe()
+            if self.media_binary is None and self.media_params.get(MediaParams.ENCODER) == 'Chrome':
+                uploaded_temp_file = self.current_temp_file
+                self.current_temp_file = self.executor.create_temp_file(self.media_params.get(MediaParams.FORMAT) or self.base64_format)
+                await self.remux_media_file(uploaded_temp_file)
+                await uploaded_temp_file.remove()
+                await self.__check_temp_file_with_ffprobe()
         if not self.media_params.get(MediaParams.FORMAT):
             self.__handle_error(f'Parameter {self.param_name} denied. Format not recognized by ffprobe.', TypeError)
 
 
+    async def __check_temp_file_with_ffprobe(self):
+        ffprobe_result, _, _ = await self.executor.run(
+            self.__make_ffprobe_command(self.current_temp_file.path),
+            endpoint_name=self.endpoint_name,
+            temp_files=(self.current_temp_file, )
+        )
+        self.__parse_media_params_from_ffprobe_result(ffprobe_result)
+        logger.info(f'ffprobe analysis of input parameter with temp file "{self.param_name}" type "{self.arg_type}": {self.format_params_for_logger(self.media_params)}')
+
+
     def __get_ffprobe_param(self, ffprobe_result_section, param_name):
         ffprobe_label = FFPROBE_DICT.get(param_name, param_name)
         if isinstance(ffprobe_label, tuple):
@@ -439,30 +583,30 @@ class FFmpeg():
                 value = value.replace('_pipe', '').replace('matroska,', '') if param_name == MediaParams.FORMAT else value
                 return value
 
-    async def remux_media_file(self):
+    async def remux_media_file(self, input_temp_file=None):
         cmd = [
             'ffmpeg',
             '-i',
-            'pipe:0',
+            input_temp_file.path if input_temp_file else 'pipe:0',
             '-c',
             'copy',
-            self.current_temp_file
+            *self.__get_memory_file_format_flag(self.current_temp_file, self.media_params.get(MediaParams.FORMAT) or self.base64_format),
+            self.current_temp_file.path
         ]
-        remux_process = await asyncio.create_subprocess_exec(
-            *cmd, 
-            stdin=asyncio.subprocess.PIPE, 
-            stdout=asyncio.subprocess.PIPE, 
-            stderr=asyncio.subprocess.PIPE
+        _, remux_error, returncode = await self.executor.run(
+            cmd,
+            None if input_temp_file else self.media_binary,
+            self.endpoint_name,
+            (input_temp_file, self.current_temp_file)
         )
-        _, remux_error = await remux_process.communicate(input=self.media_binary)
-        if remux_process.returncode != 0:
-            self.__handle_error(f'ffmpeg returned error code {remux_process.returncode} and the message {remux_error.decode()}', TypeError)
+        if returncode != 0:
+            self.__handle_error(f'ffmpeg returned error code {returncode} and the message {remux_error.decode()}', TypeError)
 
 
     def __make_ffmpeg_cmd(self, target_media_params):
         ffmpeg_cmd = list()
         if self.output_temp_file_config == 'yes' or (self.output_temp_file_config == 'auto' and target_media_params.get(MediaParams.FORMAT) == 'mp4'):
-            self.output_temp_file = f'{tempfile.gettempdir()}/{str(uuid.uuid4())[:8]}.{target_media_params.get(MediaParams.FORMAT)}'
+            self.output_temp_file = self.executor.create_temp_file(target_media_params.get(MediaParams.FORMAT))
         for target_param_name, target_param_value in target_media_params.items():
             essential_parameters = {
                 'audio': (MediaParams.FORMAT, MediaParams.CHANNELS, MediaParams.AUDIO_BIT_RATE, MediaParams.AUDIO_CODEC),
@@ -495,8 +639,13 @@ class FFmpeg():
         if ffmpeg_cmd:
             if self.arg_type == 'audio':
                 ffmpeg_cmd += ['-vn']
-            input_source = self.current_temp_file or 'pipe:0'
-            output_target = self.output_temp_file or 'pipe:1'
+            if FORMAT_FLAG not in ffmpeg_cmd:
+                ffmpeg_cmd += self.__get_memory_file_format_flag(
+                    self.output_temp_file,
+                    'image2pipe' if self.arg_type == 'image' else target_media_params.get(MediaParams.FORMAT) or self.media_params.get(MediaParams.FORMAT)
+                )
+            input_source = self.current_temp_file.path if self.current_temp_file else 'pipe:0'
+            output_target = self.output_temp_file.path if self.output_temp_file else 'pipe:1'
             
             ffmpeg_cmd = ['ffmpeg', '-i', input_source, *ffmpeg_cmd, output_target]
             logger.debug(f'ffmpeg command: {ffmpeg_cmd}')
@@ -504,6 +653,15 @@ class FFmpeg():
             return ffmpeg_cmd
 
 
+    @staticmethod
+    def __get_memory_file_format_flag(output_temp_file, media_format):
+        """Memory files have no file extension, so ffmpeg needs the output format given explicitly.
+        """
+        if output_temp_file and output_temp_file.in_memory:
+            return [FORMAT_FLAG, media_format]
+        return []
+
+
     def __get_video_filter_string(self, target_param_value, param_name):
 
         if param_name == MediaParams.SIZE:
@@ -0,0 +1,299 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import os
+import math
+import time
+import uuid
+import asyncio
+import tempfile
+import aiofiles
+import aiofiles.os
+from contextlib import asynccontextmanager, suppress
+from sanic.log import logging
+
+from ..estimator import EWMAStatistic
+
+logger = logging.getLogger('API')
+
+MEMORY_TEMP_FILES_SUPPORTED = hasattr(os, 'memfd_create') and os.path.isdir('/proc/self/fd')
+
+
+class FFmpegBusyError(Exception):
+    """Raised if the queue of the FFmpegExecutor is full.
+
+    Args:
+        retry_after (int): Estimated time in seconds until the queue has free slots again
+    """
+    def __init__(self, retry_after):
+        super().__init__(f'Server busy with media processing! Retry after {retry_after} seconds.')
+        self.retry_after = retry_after
+
+
+class MediaTempFile():
+    """Temporary file of a media input for ffmpeg and ffprobe. In memory it is an anonymous file created with
+    memfd_create(), which is passed to the subprocesses as file descriptor and addressed as /proc/self/fd/<fd>, so the
+    media data never touches the filesystem. Otherwise it is a file in the temp directory.
+
+    Args:
+        media_format (str): Format of the media, used as file extension of files on disk
+        in_memory (bool): Whether to create an anonymous memory file
+    """
+    def __init__(self, media_format, in_memory):
+        self.in_memory = in_memory
+        if in_memory:
+            self.fd = os.memfd_create(f'aime_api_media.{media_format}', os.MFD_CLOEXEC)
+            self.path = f'/proc/self/fd/{self.fd}'
+        else:
+            self.fd = None
+            self.path = f'{tempfile.gettempdir()}/{str(uuid.uuid4())[:8]}.{media_format}'
+        self.append_file = None
+
+
+    @property
+    def pass_fds(self):
+        """File descriptors the subprocess has to inherit to open the file.
+        """
+        return (self.fd, ) if self.fd is not None else ()
+
+
+    async def write(self, data):
+        if self.in_memory:
+            with open(self.fd, 'wb', closefd=False) as file:
+                file.write(data)
+        else:
+            async with aiofiles.open(self.path, 'wb') as file:
+                await file.write(data)
+
+
+    async def append(self, data):
+        """Append data to the file, for writing the file chunk by chunk. Call flush() after the last chunk.
+        """
+        if self.in_memory:
+            data = memoryview(data)
+            while data:
+                data = data[os.write(self.fd, data):]
+        else:
+            if self.append_file is None:
+                self.append_file = await aiofiles.open(self.path, 'wb')
+            await self.append_file.write(data)
+
+
+    async def flush(self):
+        if self.append_file is not None:
+            await self.append_file.close()
+            self.append_file = None
+
+
+    async def read(self):
+        if self.in_memory:
+            return os.pread(self.fd, os.fstat(self.fd).st_size, 0)
+        async with aiofiles.open(self.path, 'rb') as file:
+            return await file.read()
+
+
+    async def remove(self):
+        await self.flush()
+        if self.in_memory:
+            self.close()
+        else:
+            with suppress(FileNotFoundError):
+                await aiofiles.os.remove(self.path)
+
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+    def __del__(self):
+        self.close()
+
+
+    def __str__(self):
+        return self.path
+
+
+class FFmpegExecutor():
+    """Bounded pool for the ffmpeg and ffprobe subprocesses of all media input parameters. At most max_processes
+    subprocesses run at the same time, further calls wait in a queue. If max_queue_length calls are waiting, new calls
+    are rejected with FFmpegBusyError, so a burst of media requests can't fork an unlimited number of processes. An
+    endpoint can be limited to a quota of the processes with set_endpoint_quota(), so a single endpoint can't occupy
+    the whole pool. The queue time and the execution time of the calls are tracked per endpoint.
+
+    Temp files of the media are created with create_temp_file() as anonymous memory files if supported, or on disk.
+
+    Args:
+        max_processes (int, optional): Maximum number of concurrent subprocesses. Defaults to the number of CPUs.
+        max_queue_length (int, optional): Maximum number of waiting calls, 0 = not limited. Defaults to 200.
+        temp_files (str, optional): Where temp files are created. Supported values: ('memory', 'disk'). Defaults to 'memory'.
+    """
+    def __init__(self, max_processes=None, max_queue_length=200, temp_files='memory'):
+        self.max_processes = max_processes or os.cpu_count() or 1
+        self.max_queue_length = max_queue_length
+        self.temp_files_in_memory = temp_files == 'memory' and MEMORY_TEMP_FILES_SUPPORTED
+        self.semaphore = asyncio.Semaphore(self.max_processes)
+        self.endpoint_semaphores = dict() # key: endpoint name, value: asyncio.Semaphore limiting the processes of the endpoint
+        self.metrics = dict() # key: endpoint name, value: dict with queue and execution time statistics
+        self.num_waiting = 0
+        self.num_running = 0
+
+
+    def configure(self, config):
+        """Apply the section [FFMPEG] of the server configuration. Has to be called before the first media is processed.
+
+        Args:
+            config (dict): FFmpeg configuration with max_processes, max_queue_length and temp_files
+        """
+        self.max_processes = config.get('max_processes') or os.cpu_count() or 1
+        self.max_queue_length = config.get('max_queue_length', self.max_queue_length)
+        self.semaphore = asyncio.Semaphore(self.max_processes)
+        temp_files = config.get('temp_files', 'memory')
+        if temp_files == 'memory' and not MEMORY_TEMP_FILES_SUPPORTED:
+            logger.warning('Temp files in memory are not supported on this system, media temp files are written to disk.')
+        self.temp_files_in_memory = temp_files == 'memory' and MEMORY_TEMP_FILES_SUPPORTED
+        logger.info(
+            f'FFmpeg executor: {self.max_processes} concurrent processes, max queue length {self.max_queue_length or "unlimited"}, '
+            f'temp files {"in memory" if self.temp_files_in_memory else "on disk"}'
+        )
+
+
+    def create_temp_file(self, media_format):
+        """Create a temp file for the given media format in memory or on disk, depending on the configuration.
+
+        Args:
+            media_format (str): Format of the media
+
+        Returns:
+            MediaTempFile: Temp file, has to be removed with MediaTempFile.remove()
+        """
+        return MediaTempFile(media_format, self.temp_files_in_memory)
+
+
+    def set_endpoint_quota(self, endpoint_name, max_processes):
+        """Limit the number of concurrent subprocesses of the given endpoint.
+
+        Args:
+            endpoint_name (str): Name of the endpoint
+            max_processes (int): Maximum number of concurrent subprocesses of the endpoint, 0 = only limited by the pool
+        """
+        if max_processes:
+            self.endpoint_semaphores[endpoint_name] = asyncio.Semaphore(max_processes)
+        else:
+            self.endpoint_semaphores.pop(endpoint_name, None)
+
+
+    async def run(self, cmd, input_data=None, endpoint_name=None, temp_files=()):
+        """Run the given ffmpeg or ffprobe command as soon as a process slot is free.
+
+        Args:
+            cmd (list): Command with arguments
+            input_data (bytes, optional): Data sent to stdin of the process. Defaults to None.
+            endpoint_name (str, optional): Name of the endpoint the media belongs to. Defaults to None.
+            temp_files (tuple, optional): MediaTempFile instances used in the command, memory files are inherited by the process. Defaults to ().
+
+        Raises:
+            FFmpegBusyError: If max_queue_length calls are already waiting for a slot
+
+        Returns:
+            tuple(bytes, bytes, int): stdout, stderr and return code of the process
+        """
+        async with self.process_slot(endpoint_name):
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                pass_fds=[fd for temp_file in temp_files if temp_file for fd in temp_file.pass_fds]
+            )
+            try:
+                stdout, stderr = await process.communicate(input=input_data)
+            except asyncio.CancelledError:
+                process.kill()
+                raise
+            try:
+                await process.stdin.wait_closed()
+            except BrokenPipeError:
+                pass    # Non-critical issue in asyncio.create_subprocess_exec, see https://github.com/python/cpython/issues/104340
+                        # Didn't find solution for process being closed before input is fully received.
+                        # BrokenPipeError only handable in process.stdin.wait_closed() but is ignored anyway. Result is still present.
+            return stdout, stderr, process.returncode
+
+
+    @asynccontextmanager
+    async def process_slot(self, endpoint_name=None):
+        metrics = self.get_endpoint_metrics(endpoint_name)
+        if self.max_queue_length and self.num_waiting >= self.max_queue_length:
+            metrics['num_rejected'] += 1
+            raise FFmpegBusyError(self.get_retry_after())
+        semaphores = [semaphore for semaphore in (self.endpoint_semaphores.get(endpoint_name), self.semaphore) if semaphore]
+        acquired_semaphores = list()
+        queue_start_time = time.time()
+        self.num_waiting += 1
+        try:
+            for semaphore in semaphores: # Endpoint quota first, so waiting for the quota doesn't block a slot of the pool
+                await semaphore.acquire()
+                acquired_semaphores.append(semaphore)
+        except BaseException:
+            for semaphore in acquired_semaphores:
+                semaphore.release()
+            raise
+        finally:
+            self.num_waiting -= 1
+        metrics['queue_time'].add(time.time() - queue_start_time)
+        self.num_running += 1
+        execution_start_time = time.time()
+        try:
+            yield
+        finally:
+            self.num_running -= 1
+            for semaphore in acquired_semaphores:
+                semaphore.release()
+            metrics['execution_time'].add(time.time() - execution_start_time)
+            metrics['num_processes'] += 1
+
+
+    def get_endpoint_metrics(self, endpoint_name):
+        return self.metrics.setdefault(
+            endpoint_name,
+            {
+                'queue_time': EWMAStatistic(),
+                'execution_time': EWMAStatistic(),
+                'num_processes': 0,
+                'num_rejected': 0
+            }
+        )
+
+
+    def get_retry_after(self):
+        """Estimate the time until the waiting calls are processed from the mean execution time of all endpoints.
+
+        Returns:
+            int: Time in seconds, at least 1
+        """
+        execution_times = [metrics['execution_time'].mean for metrics in self.metrics.values() if metrics['execution_time'].count]
+        mean_execution_time = sum(execution_times) / len(execution_times) if execution_times else 1
+        return max(1, math.ceil(self.num_waiting / self.max_processes * mean_execution_time))
+
+
+    def get_status(self, endpoint_name=None):
+        """Get the state of the pool and the metrics of the given endpoint.
+
+        Args:
+            endpoint_name (str, optional): Name of the endpoint. Defaults to None.
+
+        Returns:
+            dict: Number of running and waiting processes, queue and execution time statistics in seconds
+        """
+        metrics = self.get_endpoint_metrics(endpoint_name)
+        return {
+            'num_running': self.num_running,
+            'num_waiting': self.num_waiting,
+            'max_processes': self.max_processes,
+            'queue_time': metrics['queue_time'].to_dict(),
+            'execution_time': metrics['execution_time'].to_dict(),
+            'num_processes': metrics['num_processes'],
+            'num_rejected': metrics['num_rejected']
+        }
@@ -0,0 +1,226 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import os
+import json
+import uuid
+import hashlib
+from pathlib import Path
+from collections import OrderedDict
+from sanic.log import logging
+
+from .ffmpeg import MediaBytes, MediaUpload
+from .misc import run_in_executor
+
+logger = logging.getLogger('API')
+
+MEGABYTE = 1024 * 1024
+SPILL_FILE_SUFFIX = '.media'
+
+
+class MediaConversionCache():
+    """Bounded cache of validated and converted media input parameters. The key is a hash of the media input data and
+    the configuration the media was validated and converted with, so a repeatedly sent image or audio file is neither
+    analyzed with ffprobe nor converted with ffmpeg again. The least recently used entries are evicted if the cache
+    exceeds max_size or max_entries. If a spill_dir is given, evicted entries are written to this directory and
+    loaded from there on the next request, until the files exceed spill_max_size. Only the file I/O runs in the thread
+    pool, the bookkeeping of the spill files is done on the event loop.
+
+    Args:
+        max_size (int, optional): Maximum size of the cached media in memory in bytes. Defaults to 256 MB.
+        max_entries (int, optional): Maximum number of entries in memory. Defaults to 1000.
+        spill_dir (str, optional): Directory for entries evicted from memory. Defaults to None (no disk cache).
+        spill_max_size (int, optional): Maximum size of the files in spill_dir in bytes. Defaults to 2048 MB.
+    """
+    def __init__(self, max_size=256 * MEGABYTE, max_entries=1000, spill_dir=None, spill_max_size=2048 * MEGABYTE):
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        self.spill_max_size = spill_max_size
+        self.entries = OrderedDict() # key: cache key, value: validated media as base64 string or MediaBytes
+        self.size = 0
+        self.spill_files = OrderedDict() # key: cache key, value: file size, oldest first
+        self.spill_size = 0
+        self.num_hits = 0
+        self.num_misses = 0
+        if self.spill_dir:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            self.load_spill_files()
+
+
+    @classmethod
+    def from_config(cls, config):
+        """Create the cache from the section [MEDIA_CACHE] of the server configuration.
+
+        Args:
+            config (dict): Media cache configuration with max_size and spill_max_size in MB, max_entries and spill_dir
+
+        Returns:
+            MediaConversionCache: Media cache or None if the cache is disabled with max_size = 0
+        """
+        max_size = config.get('max_size', 256)
+        if max_size:
+            return cls(
+                max_size * MEGABYTE,
+                config.get('max_entries', 1000),
+                config.get('spill_dir') or None,
+                config.get('spill_max_size', 2048) * MEGABYTE
+            )
+
+
+    @staticmethod
+    def get_key(media, *configs):
+        """Get the cache key of the given media input data validated with the given configurations.
+
+        Args:
+            media (str, bytes or MediaUpload): Base64 representation, binary data or streamed upload of media input parameter
+            configs: Configurations affecting validation and conversion of the media, like the endpoint and server
+                configuration of the input parameter
+
+        Returns:
+            str: Hex digest of the hash of media and configurations
+        """
+        if isinstance(media, MediaUpload):
+            key_hash = media.hash.copy() # Hash of the data computed while receiving it
+        else:
+            key_hash = hashlib.sha256(media.encode() if isinstance(media, str) else media)
+        key_hash.update(json.dumps(configs, sort_keys=True, default=str).encode())
+        return key_hash.hexdigest()
+
+
+    async def get(self, key):
+        """Get the cached media of the given key from memory or from the spill directory.
+
+        Args:
+            key (str): Cache key from get_key()
+
+        Returns:
+            str or MediaBytes: Validated and converted media or None if not cached
+        """
+        media = self.entries.get(key)
+        if media is not None:
+            self.entries.move_to_end(key)
+        elif key in self.spill_files:
+            media = await run_in_executor(self.read_spill_file, key)
+            if media is None:
+                self.spill_size -= self.spill_files.pop(key, 0)
+            else:
+                if key in self.spill_files:
+                    self.spill_files.move_to_end(key)
+                await self.put(key, media)
+        if media is None:
+            self.num_misses += 1
+        else:
+            self.num_hits += 1
+        return media
+
+
+    async def put(self, key, media):
+        """Add the validated and converted media to the cache and evict the least recently used entries if the cache is full.
+
+        Args:
+            key (str): Cache key from get_key()
+            media (str or MediaBytes): Validated and converted media
+        """
+        media_size = len(media)
+        if media_size > self.max_size:
+            return
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key))
+        self.entries[key] = media
+        self.size += media_size
+        while self.size > self.max_size or len(self.entries) > self.max_entries:
+            evicted_key, evicted_media = self.entries.popitem(last=False)
+            self.size -= len(evicted_media)
+            if self.spill_dir and evicted_key not in self.spill_files:
+                file_size = await run_in_executor(self.write_spill_file, evicted_key, evicted_media)
+                if file_size is not None:
+                    self.spill_size += file_size - self.spill_files.pop(evicted_key, 0) # Written twice if evicted again meanwhile
+                    self.spill_files[evicted_key] = file_size
+                    await self.evict_spill_files()
+
+
+    def get_spill_file(self, key):
+        return self.spill_dir / f'{key}{SPILL_FILE_SUFFIX}'
+
+
+    def load_spill_files(self):
+        spill_files = sorted(self.spill_dir.glob(f'*{SPILL_FILE_SUFFIX}'), key=lambda spill_file: spill_file.stat().st_mtime)
+        for spill_file in spill_files:
+            self.spill_files[spill_file.stem] = spill_file.stat().st_size
+            self.spill_size += self.spill_files[spill_file.stem]
+        self.remove_spill_files(self.pop_excess_spill_files())
+
+
+    def write_spill_file(self, key, media):
+        """Write media to the spill directory. The first line of the file is a JSON header with the media type and
+        format, followed by the media data. The file is written to a temporary file first and renamed, so other server
+        processes sharing the spill directory never read incomplete files.
+
+        Returns:
+            int: Size of the written file or None if it couldn't be written
+        """
+        if isinstance(media, MediaBytes):
+            header = {'media_type': media.media_type, 'media_format': media.media_format}
+            data = media
+        else:
+            header = {'base64': True}
+            data = media.encode()
+        spill_file = self.get_spill_file(key)
+        temp_file = spill_file.with_name(f'{spill_file.name}.{uuid.uuid4().hex[:8]}.tmp')
+        try:
+            with open(temp_file, 'wb') as file:
+                file.write(json.dumps(header).encode() + b'\n')
+                file.write(data)
+            os.replace(temp_file, spill_file)
+        except OSError as error:
+            logger.warning(f'Could not write media cache file {spill_file}: {error}')
+            return
+        return spill_file.stat().st_size
+
+
+    def read_spill_file(self, key):
+        try:
+            with open(self.get_spill_file(key), 'rb') as file:
+                header = json.loads(file.readline())
+                data = file.read()
+        except (OSError, ValueError):
+            return
+        if header.get('base64'):
+            return data.decode()
+        return MediaBytes(data, header.get('media_type'), header.get('media_format'))
+
+
+    async def evict_spill_files(self):
+        keys = self.pop_excess_spill_files()
+        if keys:
+            await run_in_executor(self.remove_spill_files, keys)
+
+
+    def pop_excess_spill_files(self):
+        keys = list()
+        while self.spill_size > self.spill_max_size and self.spill_files:
+            key, file_size = self.spill_files.popitem(last=False)
+            self.spill_size -= file_size
+            keys.append(key)
+        return keys
+
+
+    def remove_spill_files(self, keys):
+        for key in keys:
+            try:
+                self.get_spill_file(key).unlink()
+            except FileNotFoundError:
+                pass
+
+
+    def get_status(self):
+        return {
+            'num_entries': len(self.entries),
+            'size': self.size,
+            'num_spill_files': len(self.spill_files),
+            'spill_size': self.spill_size,
+            'num_hits': self.num_hits,
+            'num_misses': self.num_misses
+        }
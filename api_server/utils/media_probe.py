@@ -0,0 +1,331 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import struct
+
+# In-process parsers for the headers of common media formats. Each parser returns the media parameters with the same
+# keys and values ffprobe reports for the format, so the ffprobe subprocess can be skipped for these formats. If a file
+# uses a feature the parser doesn't know (animation, 12 bit JPEG, compressed WAV, ...), None is returned and the media
+# is analyzed with ffprobe.
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_PIX_FMT_DICT = { # key: (color type, bit depth), value: pix_fmt of ffmpeg png decoder
+    (0, 1): 'monob', (0, 2): 'gray', (0, 4): 'gray', (0, 8): 'gray', (0, 16): 'gray16be',
+    (2, 8): 'rgb24', (2, 16): 'rgb48be',
+    (3, 1): 'pal8', (3, 2): 'pal8', (3, 4): 'pal8', (3, 8): 'pal8',
+    (4, 8): 'ya8', (4, 16): 'ya16be',
+    (6, 8): 'rgba', (6, 16): 'rgba64be'
+}
+PNG_TRANSPARENCY_PIX_FMT_DICT = {'rgb24': 'rgba', 'rgb48be': 'rgba64be', 'gray': 'ya8', 'gray16be': 'ya16be'}
+
+JPEG_SOF_MARKERS = (0xC0, 0xC1, 0xC2) # Baseline, extended sequential and progressive huffman coded frames
+JPEG_STANDALONE_MARKERS = (0x01, *range(0xD0, 0xD8))
+JPEG_PIX_FMT_DICT = { # key: luma to chroma sampling factors (horizontal, vertical), value: pix_fmt of ffmpeg mjpeg decoder
+    (1, 1): 'yuvj444p',
+    (2, 2): 'yuvj420p',
+    (2, 1): 'yuvj422p',
+    (1, 2): 'yuvj440p',
+    (4, 1): 'yuvj411p'
+}
+
+WAV_CODEC_DICT = { # key: (format tag, bits per sample), value: (codec name, sample_fmt of ffmpeg decoder)
+    (1, 8): ('pcm_u8', 'u8'),
+    (1, 16): ('pcm_s16le', 's16'),
+    (1, 24): ('pcm_s24le', 's32'),
+    (1, 32): ('pcm_s32le', 's32'),
+    (3, 32): ('pcm_f32le', 'flt'),
+    (3, 64): ('pcm_f64le', 'dbl'),
+    (6, 8): ('pcm_alaw', 's16'),
+    (7, 8): ('pcm_mulaw', 's16')
+}
+WAV_FORMAT_EXTENSIBLE = 0xFFFE
+
+MP3_BIT_RATES = { # key: MPEG version 1 or 2 (2 and 2.5), value: kbit/s of layer III bit rate indices
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+}
+MP3_SAMPLE_RATES = { # key: version bits of frame header, value: sample rates of sample rate indices
+    3: (44100, 48000, 32000), # MPEG 1
+    2: (22050, 24000, 16000), # MPEG 2
+    0: (11025, 12000, 8000)   # MPEG 2.5
+}
+
+
+def probe_media_header(media_binary):
+    """Get the media parameters of PNG, JPEG, WebP, WAV and MP3 data from their headers without starting ffprobe.
+
+    Args:
+        media_binary (bytes): Binary media data
+
+    Returns:
+        dict: Media parameters with the keys of MediaParams or None if the format is unknown or not fully supported
+    """
+    if not media_binary:
+        return
+    try:
+        if media_binary.startswith(PNG_SIGNATURE):
+            return probe_png(media_binary)
+        elif media_binary.startswith(b'\xff\xd8\xff'):
+            return probe_jpeg(media_binary)
+        elif media_binary.startswith(b'RIFF') and media_binary[8:12] == b'WEBP':
+            return probe_webp(media_binary)
+        elif media_binary.startswith(b'RIFF') and media_binary[8:12] == b'WAVE':
+            return probe_wav(media_binary)
+        elif media_binary.startswith(b'ID3') or media_binary[:2] in (b'\xff\xfb', b'\xff\xfa', b'\xff\xf3', b'\xff\xf2', b'\xff\xe3', b'\xff\xe2'):
+            return probe_mp3(media_binary)
+    except (struct.error, IndexError, ValueError, ZeroDivisionError):
+        return
+
+
+def probe_png(data):
+    width, height, bit_depth, color_type = struct.unpack_from('>IIBB', data, 16)
+    pix_fmt = PNG_PIX_FMT_DICT.get((color_type, bit_depth))
+    if data[12:16] != b'IHDR' or not pix_fmt or not width or not height:
+        return
+    for chunk_type, _ in iter_chunks(data, 8, '>I4s', chunk_type_first=False):
+        if chunk_type == b'acTL': # Animated PNG
+            return
+        elif chunk_type == b'tRNS':
+            pix_fmt = PNG_TRANSPARENCY_PIX_FMT_DICT.get(pix_fmt, pix_fmt)
+        elif chunk_type == b'IDAT':
+            break
+    return image_params('png', 'png', pix_fmt, width, height)
+
+
+def probe_jpeg(data):
+    offset = 2
+    adobe_transform = None
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            return
+        marker = data[offset + 1]
+        if marker == 0xFF: # Fill byte
+            offset += 1
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            offset += 2
+            continue
+        segment_length, = struct.unpack_from('>H', data, offset + 2)
+        segment = data[offset + 4:offset + 2 + segment_length]
+        if marker == 0xEE and segment.startswith(b'Adobe') and len(segment) >= 12:
+            adobe_transform = segment[11]
+        elif marker in JPEG_SOF_MARKERS:
+            precision, height, width, num_components = struct.unpack_from('>BHHB', segment)
+            if precision != 8 or not height or not width:
+                return
+            if num_components == 1:
+                return image_params('jpeg', 'mjpeg', 'gray', width, height)
+            if num_components != 3 or adobe_transform == 0 or segment[6:13:3] == b'RGB':
+                return
+            sampling_factors = [(segment[7 + 3 * index] >> 4, segment[7 + 3 * index] & 0x0F) for index in range(3)]
+            (luma_h, luma_v), (cb_h, cb_v), (cr_h, cr_v) = sampling_factors
+            if (cb_h, cb_v) != (cr_h, cr_v) or luma_h % cb_h or luma_v % cb_v:
+                return
+            pix_fmt = JPEG_PIX_FMT_DICT.get((luma_h // cb_h, luma_v // cb_v))
+            if pix_fmt:
+                return image_params('jpeg', 'mjpeg', pix_fmt, width, height)
+            return
+        elif marker in (0xD9, 0xDA) or (0xC3 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC)):
+            return # End of image, start of scan or unsupported frame type before a supported frame header
+        offset += 2 + segment_length
+
+
+def probe_webp(data):
+    has_alpha = False
+    chunks = iter_chunks(data, 12, '<4sI', chunk_type_first=True)
+    for chunk_type, chunk in chunks:
+        if chunk_type == b'VP8X':
+            if chunk[0] & 0x02: # Animated WebP
+                return
+            has_alpha = bool(chunk[0] & 0x10)
+        elif chunk_type == b'VP8 ':
+            if chunk[0] & 0x01 or chunk[3:6] != b'\x9d\x01\x2a': # Not a key frame
+                return
+            width, height = struct.unpack_from('<HH', chunk, 6)
+            return image_params('webp', 'webp', 'yuva420p' if has_alpha else 'yuv420p', width & 0x3FFF, height & 0x3FFF)
+        elif chunk_type == b'VP8L':
+            if chunk[0] != 0x2F:
+                return
+            bits, = struct.unpack_from('<I', chunk, 1)
+            return image_params('webp', 'webp', 'argb', (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+
+
+def probe_wav(data):
+    fmt_chunk = data_size = encoder = None
+    for chunk_type, chunk in iter_chunks(data, 12, '<4sI', chunk_type_first=True):
+        if chunk_type == b'fmt ':
+            fmt_chunk = chunk
+        elif chunk_type == b'data':
+            data_size = len(chunk) if chunk.size_exceeds_data else chunk.header_size
+        elif chunk_type == b'LIST' and chunk[:4] == b'INFO':
+            for info_type, info in iter_chunks(chunk, 4, '<4sI', chunk_type_first=True):
+                if info_type == b'ISFT':
+                    encoder = bytes(info).split(b'\x00')[0].decode('latin-1') or None
+    if not fmt_chunk or not data_size:
+        return
+    format_tag, channels, sample_rate, byte_rate, block_align, bits_per_sample = struct.unpack_from('<HHIIHH', fmt_chunk)
+    if format_tag == WAV_FORMAT_EXTENSIBLE:
+        format_tag, = struct.unpack_from('<H', fmt_chunk, 24)
+    codec_name, sample_fmt = WAV_CODEC_DICT.get((format_tag, bits_per_sample), (None, None))
+    if not codec_name or not channels or not sample_rate or not block_align:
+        return
+    return audio_params('wav', codec_name, data_size / block_align / sample_rate, sample_rate, channels, sample_fmt, byte_rate * 8, encoder)
+
+
+def probe_mp3(data):
+    offset, encoder = 0, None
+    if data.startswith(b'ID3'):
+        tag_size = synchsafe_int(data[6:10]) + (20 if data[5] & 0x10 else 10) # Header and optional footer
+        encoder = get_id3v2_text_frame(data[:tag_size], b'TSSE')
+        offset = tag_size
+    while data[offset:offset + 1] == b'\x00': # Padding after ID3v2 tag
+        offset += 1
+    frame = parse_mp3_frame_header(data, offset)
+    if not frame:
+        return
+    next_frame = parse_mp3_frame_header(data, offset + frame['length'])
+    if not next_frame or next_frame['sample_rate'] != frame['sample_rate']:
+        return
+    num_frames, vbr_bytes, is_cbr = get_mp3_vbr_tag(data, offset, frame)
+    bit_rate = frame['bit_rate']
+    if num_frames is not None: # First frame is the VBR tag frame
+        bit_rate = next_frame['bit_rate']
+    if num_frames:
+        duration = num_frames * frame['samples_per_frame'] / frame['sample_rate']
+        if vbr_bytes and not is_cbr:
+            bit_rate = round(vbr_bytes * 8 * frame['sample_rate'] / (num_frames * frame['samples_per_frame']))
+    else:
+        audio_size = len(data) - offset - (128 if data[-128:-125] == b'TAG' else 0)
+        duration = audio_size * 8 / bit_rate
+    return audio_params('mp3', 'mp3', duration, frame['sample_rate'], frame['channels'], 'fltp', bit_rate, encoder)
+
+
+def parse_mp3_frame_header(data, offset):
+    if offset + 4 > len(data):
+        return
+    header, = struct.unpack_from('>I', data, offset)
+    version_bits = (header >> 19) & 0x03
+    layer_bits = (header >> 17) & 0x03
+    bit_rate_index = (header >> 12) & 0x0F
+    sample_rate_index = (header >> 10) & 0x03
+    if header >> 21 != 0x7FF or version_bits == 1 or layer_bits != 1 or bit_rate_index in (0, 15) or sample_rate_index == 3:
+        return # No frame sync, reserved version, no layer III, free format or invalid bit rate or sample rate
+    version = 1 if version_bits == 3 else 2
+    sample_rate = MP3_SAMPLE_RATES[version_bits][sample_rate_index]
+    bit_rate = MP3_BIT_RATES[version][bit_rate_index] * 1000
+    padding = (header >> 9) & 0x01
+    channels = 1 if (header >> 6) & 0x03 == 3 else 2
+    return {
+        'version': version,
+        'sample_rate': sample_rate,
+        'bit_rate': bit_rate,
+        'channels': channels,
+        'samples_per_frame': 1152 if version == 1 else 576,
+        'length': (144 if version == 1 else 72) * bit_rate // sample_rate + padding
+    }
+
+
+def get_mp3_vbr_tag(data, offset, frame):
+    """Get the number of frames and bytes from the Xing, Info or VBRI tag in the first frame of MP3 data.
+
+    Returns:
+        tuple(int, int, bool): Number of frames, number of bytes and whether the tag is a CBR Info tag. The number of frames is None if there is no tag.
+    """
+    side_info_size = {(1, 2): 32, (1, 1): 17, (2, 2): 17, (2, 1): 9}[(frame['version'], frame['channels'])]
+    xing_offset = offset + 4 + side_info_size
+    tag_id = data[xing_offset:xing_offset + 4]
+    if tag_id in (b'Xing', b'Info'):
+        flags, = struct.unpack_from('>I', data, xing_offset + 4)
+        field_offset = xing_offset + 8
+        num_frames = vbr_bytes = 0
+        if flags & 0x01:
+            num_frames, = struct.unpack_from('>I', data, field_offset)
+            field_offset += 4
+        if flags & 0x02:
+            vbr_bytes, = struct.unpack_from('>I', data, field_offset)
+        return num_frames, vbr_bytes, tag_id == b'Info'
+    vbri_offset = offset + 36
+    if data[vbri_offset:vbri_offset + 4] == b'VBRI':
+        vbr_bytes, num_frames = struct.unpack_from('>II', data, vbri_offset + 10)
+        return num_frames, vbr_bytes, False
+    return None, None, False
+
+
+def get_id3v2_text_frame(tag, frame_id):
+    major_version, flags = tag[3], tag[5]
+    if major_version not in (3, 4) or flags & 0xC0: # Only ID3v2.3 and ID3v2.4 tags without unsynchronisation and extended header
+        return
+    offset = 10
+    while offset + 10 <= len(tag) and tag[offset] != 0:
+        frame_size = synchsafe_int(tag[offset + 4:offset + 8]) if major_version == 4 else struct.unpack_from('>I', tag, offset + 4)[0]
+        if tag[offset:offset + 4] == frame_id:
+            encoding, text = tag[offset + 10], tag[offset + 11:offset + 10 + frame_size]
+            text = text.decode(('latin-1', 'utf-16', 'utf-16-be', 'utf-8')[encoding] if encoding < 4 else 'latin-1', errors='replace')
+            return text.split('\x00')[0] or None
+        offset += 10 + frame_size
+
+
+def synchsafe_int(data):
+    value = 0
+    for byte in data:
+        value = (value << 7) | (byte & 0x7F)
+    return value
+
+
+def iter_chunks(data, offset, header_format, chunk_type_first):
+    """Iterate over the chunks of PNG or RIFF data. RIFF chunks are padded to an even size, PNG chunks are followed by a CRC.
+
+    Args:
+        data (bytes): Binary data of the file or of a chunk containing sub chunks
+        offset (int): Offset of the first chunk
+        header_format (str): Struct format of the chunk header, '<4sI' for RIFF and '>I4s' for PNG
+        chunk_type_first (bool): Whether the chunk type precedes the chunk size in the header like in RIFF
+
+    Yields:
+        tuple(bytes, ChunkData): Chunk type and chunk data
+    """
+    trailer_size = 0 if chunk_type_first else 4
+    while offset + 8 <= len(data):
+        chunk_type, chunk_size = struct.unpack_from(header_format, data, offset)
+        if not chunk_type_first:
+            chunk_type, chunk_size = chunk_size, chunk_type
+        chunk_start = offset + 8
+        yield chunk_type, ChunkData(data[chunk_start:chunk_start + chunk_size], chunk_size)
+        offset = chunk_start + chunk_size + trailer_size + (chunk_size & 1 if chunk_type_first else 0)
+
+
+class ChunkData(bytes):
+    """Data of a chunk with the chunk size given in its header, which can differ from the length of the data for
+    truncated files or streamed WAV files.
+    """
+    def __new__(cls, data, header_size):
+        chunk_data = super().__new__(cls, data)
+        chunk_data.header_size = header_size
+        return chunk_data
+
+    @property
+    def size_exceeds_data(self):
+        return self.header_size > len(self)
+
+
+def image_params(media_format, codec, pix_fmt, width, height):
+    return {
+        'format': media_format,
+        'video_codec': codec,
+        'color_space': pix_fmt,
+        'size': (width, height)
+    }
+
+
+def audio_params(media_format, codec, duration, sample_rate, channels, sample_fmt, bit_rate, encoder=None):
+    return {
+        'format': media_format,
+        'audio_codec': codec,
+        'duration': round(duration),
+        'sample_rate': sample_rate,
+        'channels': channels,
+        'sample_bit_depth': sample_fmt,
+        'audio_bit_rate': bit_rate,
+        'encoder': encoder
+    }
@@ -190,7 +190,7 @@ def shorten_strings(obj, max_length=30):
     elif isinstance(obj, str) and len(obj) > max_length:
         return obj[:max_length] + "..."
     elif isinstance(obj, bytes) and len(obj) > max_length:
-        return obj[:max_length] + "..."
+        return bytes(obj[:max_length]) + b"..."
     else:
         return obj
 
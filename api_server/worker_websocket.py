@@ -0,0 +1,202 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+from sanic.log import logging
+from websockets.exceptions import ConnectionClosed
+
+import json
+import asyncio
+
+from .utils.misc import shorten_strings
+from .utils.ffmpeg import MediaBytes
+
+
+class WorkerWebSocket():
+    """Persistent WebSocket channel for API worker interfaces on route /worker_ws as alternative to the
+    HTTP routes /worker_login, /worker_job_request, /worker_job_progress and /worker_job_result.
+    The worker is authenticated once with the 'login' message, all following messages on the connection
+    are processed without validating the auth key again.
+
+    Each message is a JSON object with the command 'cmd' and an optional message id 'msg_id', which is
+    returned in the related response, so responses can be matched to requests. Job requests are processed
+    in the background, so progress and results of running jobs can be sent while waiting for the next job.
+    Jobs of a job request response the worker didn't receive, since the connection was closed, are put back to the queue.
+
+    Args:
+        app (APIServer): Instance of APIServer()
+
+    Examples:
+
+        Messages from API worker interface:
+
+        .. highlight:: python
+        .. code-block:: python
+
+            {'cmd': 'login', 'msg_id': 1, 'worker_parameters': {'auth': 'worker_name', 'job_type': 'llama3', 'auth_key': 'key', ...}, 'model_parameters': {...}}
+            {'cmd': 'job_request', 'msg_id': 2, 'max_job_batch': 8}
+            {'cmd': 'progress', 'msg_id': 3, 'progress': [{'job_id': 'JID1', 'progress': 50, 'progress_data': {'text': 'Test'}}, ...]}
+            {'cmd': 'result', 'msg_id': 4, 'job_id': 'JID1', 'text': 'Test output', ...}
+
+        Responses to API worker interface:
+
+        .. highlight:: python
+        .. code-block:: python
+
+            {'cmd': 'login', 'msg_id': 1, 'success': True, 'request_timeout': 60, 'api_server_version': '1.0.0'}
+            {'cmd': 'job', 'msg_id': 2, 'endpoint_name': 'llama3_chat', 'job_data': [{'job_id': 'JID1', ...}], ...}
+            {'cmd': 'progress', 'msg_id': 3, 'responses': [{'success': True}, ...]}
+            {'cmd': 'ok', 'msg_id': 4}
+
+        Workers logging in with 'binary_media': True in the worker_parameters receive media inputs of the job data 
+        as binary messages instead of base64 strings. Each media input is replaced by a reference 
+        {'binary_frame': 0, 'media_type': 'image', 'media_format': 'png'} to the binary messages following the job message in the same order.
+
+        If a job was canceled by its client, the response to its next progress update is 
+        {'success': True, 'job_id': 'JID1', 'canceled': True} and the worker should stop processing the job.
+    """
+    logger = logging.getLogger('API')
+
+    def __init__(self, app):
+        self.app = app
+        app.add_websocket_route(self.worker_websocket, "/worker_ws", name="worker_ws")
+
+
+    async def worker_websocket(self, request, ws):
+        """Handle the connection of one API worker interface on route /worker_ws until it is closed.
+        The worker is set offline when the connection breaks.
+
+        Args:
+            request (sanic.request.types.Request): Websocket upgrade request of API worker interface
+            ws (sanic.server.websockets.impl.WebsocketImplProtocol): Websocket connection
+        """
+        connection = WorkerConnection(self.app, ws)
+        try:
+            async for message in ws:
+                await connection.handle_message(message)
+        except ConnectionClosed:
+            pass
+        finally:
+            await connection.close()
+
+
+class WorkerConnection():
+    """State of a single worker websocket connection.
+
+    Args:
+        app (APIServer): Instance of APIServer()
+        ws (sanic.server.websockets.impl.WebsocketImplProtocol): Websocket connection
+    """
+    def __init__(self, app, ws):
+        self.app = app
+        self.ws = ws
+        self.auth = None
+        self.binary_media = False
+        self.send_lock = asyncio.Lock()
+        self.job_request_task = None
+
+
+    async def handle_message(self, message):
+        try:
+            req_json = json.loads(message)
+        except (TypeError, ValueError):
+            return await self.send({'cmd': 'error', 'msg': 'Invalid message, JSON object expected'})
+        if not isinstance(req_json, dict):
+            return await self.send({'cmd': 'error', 'msg': 'Invalid message, JSON object expected'})
+
+        cmd = req_json.pop('cmd', None)
+        msg_id = req_json.pop('msg_id', None)
+        WorkerWebSocket.logger.debug(f'Message {cmd} on /worker_ws from {self.auth}: {shorten_strings(req_json)}')
+        if not self.app.job_handler or not self.app.job_handler.job_types:
+            return await self.send({'cmd': 'error', 'msg': 'API Server still initializing'}, msg_id)
+
+        if cmd == 'login':
+            await self.login(req_json, msg_id)
+        elif not self.auth:
+            await self.send({'cmd': 'error', 'msg': 'Worker needs to login before sending other commands'}, msg_id)
+        elif cmd == 'job_request':
+            self.start_job_request(req_json, msg_id)
+        elif cmd == 'progress':
+            await self.update_progress(req_json, msg_id)
+        elif cmd == 'result':
+            await self.set_job_result(req_json, msg_id)
+        else:
+            await self.send({'cmd': 'error', 'msg': f'Unknown command {cmd}'}, msg_id)
+
+
+    async def login(self, req_json, msg_id):
+        response_cmd = await self.app.job_handler.worker_login(req_json)
+        if response_cmd.get('success'):
+            self.auth = req_json.get('worker_parameters', {}).get('auth')
+            self.binary_media = bool(req_json.get('worker_parameters', {}).get('binary_media'))
+        else:
+            self.auth = None
+        await self.send(dict(response_cmd, cmd='login'), msg_id)
+
+
+    def start_job_request(self, req_json, msg_id):
+        if self.job_request_task and not self.job_request_task.done():
+            self.job_request_task.cancel()
+        self.job_request_task = asyncio.ensure_future(self.job_request(req_json, msg_id))
+
+
+    async def job_request(self, req_json, msg_id):
+        req_json['auth'] = self.auth
+        req_json.setdefault('max_job_batch', 1)
+        response_cmd = await self.app.job_handler.worker_job_request(req_json, session_authorized=True)
+        # The jobs of the response are already started, so sending them is shielded from the cancellation of the job request
+        await asyncio.shield(self.send_job_request_response(response_cmd, msg_id))
+
+
+    async def send_job_request_response(self, response_cmd, msg_id):
+        try:
+            await self.send(response_cmd, msg_id)
+        except ConnectionClosed:
+            WorkerWebSocket.logger.warning(f'Worker {self.auth} closed websocket connection before receiving job request response')
+            job_ids = [job_data.get('job_id') for job_data in response_cmd.get('job_data', [])]
+            if job_ids:
+                await self.app.job_handler.worker_requeue_jobs(self.auth, job_ids)
+
+
+    async def update_progress(self, req_json, msg_id):
+        responses = list()
+        for progress_result in req_json.get('progress', []):
+            progress_result['auth'] = self.auth
+            responses.append(await self.app.job_handler.worker_update_progress_state(progress_result, session_authorized=True) or {})
+        await self.send({'cmd': 'progress', 'responses': responses}, msg_id)
+
+
+    async def set_job_result(self, req_json, msg_id):
+        req_json['auth'] = self.auth
+        response_cmd = await self.app.job_handler.worker_set_job_result(req_json, session_authorized=True)
+        await self.send(response_cmd, msg_id)
+
+
+    async def send(self, response_cmd, msg_id=None):
+        if msg_id is not None:
+            response_cmd['msg_id'] = msg_id
+        binary_frames = list()
+        if self.binary_media:
+            message = json.dumps(response_cmd, default=lambda obj: self.add_binary_frame(obj, binary_frames))
+        else:
+            message = json.dumps(response_cmd, default=MediaBytes.json_default)
+        async with self.send_lock:
+            await self.ws.send(message)
+            for binary_frame in binary_frames:
+                await self.ws.send(binary_frame)
+
+
+    @staticmethod
+    def add_binary_frame(obj, binary_frames):
+        if isinstance(obj, MediaBytes):
+            binary_frames.append(obj)
+            return {'binary_frame': len(binary_frames) - 1, 'media_type': obj.media_type, 'media_format': obj.media_format}
+        raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+    async def close(self):
+        if self.job_request_task and not self.job_request_task.done():
+            self.job_request_task.cancel()
+        if self.auth:
+            await self.app.job_handler.set_worker_offline(self.auth)
+            WorkerWebSocket.logger.info(f'Worker {self.auth} closed websocket connection')
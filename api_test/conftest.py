@@ -0,0 +1,48 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import asyncio
+import logging
+import pytest
+from types import SimpleNamespace
+
+from api_server.job_queue import JobHandler, JobSettings, QueueScheduler
+
+
+def make_endpoint(endpoint_name='test_endpoint', client_request_limit=0, max_queue_length=100, job_inactivity_timeout=60, max_time_in_queue=60, result_lifetime=60):
+    """Endpoint with the attributes used by the JobHandler, without routes and config file."""
+    return SimpleNamespace(
+        endpoint_name=endpoint_name,
+        worker_job_type='test_job_type',
+        worker_auth_key='test_worker_auth_key',
+        max_queue_length=max_queue_length,
+        scheduler=QueueScheduler.FIFO,
+        priority_classes=dict(),
+        request_timeout=1,
+        config=dict(),
+        clients_config={'client_request_limit': client_request_limit},
+        job_settings=JobSettings(job_inactivity_timeout, max_time_in_queue, result_lifetime),
+        ep_input_param_config=dict(),
+        ep_progress_param_config=dict(),
+        ep_output_param_config=dict()
+    )
+
+
+@pytest.fixture
+def make_job_handler():
+    """Factory creating a JobHandler for a minimal app. Has to be called inside the event loop the jobs are used in."""
+    def make(server_config=None, **endpoint_config):
+        endpoint = make_endpoint(**endpoint_config)
+        app = SimpleNamespace(
+            endpoints={endpoint.endpoint_name: endpoint},
+            logger=logging.getLogger('test'),
+            server_config=server_config or dict(),
+            admin_telemetry=None,
+            registered_keys=dict(),
+            loop=asyncio.get_running_loop(),
+            job_handler=None
+        )
+        app.job_handler = JobHandler(app)
+        return app.job_handler
+    return make
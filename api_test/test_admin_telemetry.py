@@ -0,0 +1,88 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import asyncio
+
+from api_server.admin_interface import AdminInterface
+from api_server.admin_telemetry import AdminTelemetry
+
+
+class SlowAdminBackend():
+    def __init__(self, delay):
+        self.delay = delay
+        self.batches = list()
+
+    async def admin_log_events_batch(self, batch):
+        await asyncio.sleep(self.delay)
+        self.batches.append(batch)
+
+
+def test_events_are_delivered_in_batches():
+    async def run():
+        admin_backend = SlowAdminBackend(0)
+        telemetry = AdminTelemetry(admin_backend, batch_size=3, flush_interval=0.01)
+        telemetry.start()
+        for index in range(7):
+            telemetry.log_event('admin_log_request_start', job_id=index)
+        await asyncio.sleep(0.1)
+        assert [len(batch) for batch in admin_backend.batches] == [3, 3, 1]
+        assert telemetry.get_status()['num_delivered'] == 7
+        await telemetry.stop()
+    asyncio.run(run())
+
+
+def test_stop_delivers_the_batch_in_flight_and_the_remaining_events():
+    async def run():
+        admin_backend = SlowAdminBackend(0.1)
+        telemetry = AdminTelemetry(admin_backend, batch_size=2, flush_interval=0)
+        telemetry.start()
+        for index in range(5):
+            telemetry.log_event('admin_log_request_start', job_id=index)
+        await asyncio.sleep(0.05) # First batch is being delivered
+        await telemetry.stop()
+        assert [event['args']['job_id'] for batch in admin_backend.batches for event in batch] == [0, 1, 2, 3, 4]
+        status = telemetry.get_status()
+        assert (status['num_buffered'], status['num_delivered'], status['num_failed']) == (0, 5, 0)
+    asyncio.run(run())
+
+
+def test_overflow_policies():
+    telemetry = AdminTelemetry(None, max_events=2, overflow='drop_oldest')
+    for index in range(3):
+        telemetry.log_event('admin_log_request_start', job_id=index)
+    assert [event['args']['job_id'] for event in telemetry.events] == [1, 2]
+
+    telemetry = AdminTelemetry(None, max_events=2, overflow='drop_newest')
+    for index in range(3):
+        telemetry.log_event('admin_log_request_start', job_id=index)
+    assert [event['args']['job_id'] for event in telemetry.events] == [0, 1]
+    assert telemetry.get_status()['num_dropped'] == 1
+
+
+class FailingAdminBackend(AdminInterface):
+    """Admin backend with the default batch implementation and a failing request end handler."""
+    def __init__(self):
+        super().__init__(None, None, None)
+        self.logged_job_ids = list()
+
+    async def admin_log_request_start(self, job_id, **kwargs):
+        self.logged_job_ids.append(job_id)
+
+    async def admin_log_request_end(self, job_id, **kwargs):
+        raise ConnectionError('Database not reachable')
+
+
+def test_failing_event_doesnt_stop_the_batch():
+    async def run():
+        admin_backend = FailingAdminBackend()
+        telemetry = AdminTelemetry(admin_backend, batch_size=10, flush_interval=0)
+        telemetry.start()
+        telemetry.log_event('admin_log_request_start', job_id=0)
+        telemetry.log_event('admin_log_request_end', job_id=0)
+        telemetry.log_event('admin_log_request_start', job_id=1)
+        await telemetry.stop()
+        assert admin_backend.logged_job_ids == [0, 1]
+        status = telemetry.get_status()
+        assert (status['num_delivered'], status['num_failed']) == (2, 1)
+    asyncio.run(run())
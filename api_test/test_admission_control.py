@@ -0,0 +1,53 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import asyncio
+from types import SimpleNamespace
+
+from api_server.api_endpoint import APIEndpoint
+from api_server.estimator import ThroughputModel, estimate_queue_time
+
+
+def make_worker(job_duration, batch_capacity=1, num_running_jobs=0):
+    throughput_model = ThroughputModel()
+    for _ in range(5):
+        throughput_model.add_finished_job(job_duration, batch_capacity)
+    return SimpleNamespace(throughput_model=throughput_model, batch_capacity=batch_capacity, running_jobs=dict.fromkeys(range(num_running_jobs)))
+
+
+def test_queue_time_without_job_duration():
+    workers = [make_worker(10)]
+    assert estimate_queue_time(3, workers).value == 40 # 3 jobs ahead + 1 running job finished by one worker with 10 s per job
+    assert estimate_queue_time(3, workers, include_job_duration=False).value == 30
+    assert estimate_queue_time(0, [make_worker(10, batch_capacity=2)], include_job_duration=False).value == 0 # Free slot
+
+
+class JobHandler():
+    """Job handler returning the estimates of one worker with 100 s per job and num_jobs_ahead queued jobs."""
+    def __init__(self, num_jobs_ahead):
+        self.workers = [make_worker(100)]
+        self.num_jobs_ahead = num_jobs_ahead
+
+    async def endpoint_get_queue_estimate(self, endpoint_name, include_job_duration=True):
+        return estimate_queue_time(self.num_jobs_ahead, self.workers, include_job_duration).to_dict()
+
+
+def get_admission_retry_after(num_jobs_ahead, max_time_in_queue=0, admission_wait_slo=0):
+    endpoint = APIEndpoint.__new__(APIEndpoint) # Only the admission control parameters are needed, no routes and workers
+    endpoint.endpoint_name = 'test_endpoint'
+    endpoint.app = SimpleNamespace(job_handler=JobHandler(num_jobs_ahead))
+    endpoint.max_time_in_queue = max_time_in_queue
+    endpoint.admission_wait_slo = admission_wait_slo
+    return asyncio.run(endpoint.get_admission_retry_after())
+
+
+def test_job_duration_doesnt_count_against_max_time_in_queue():
+    assert get_admission_retry_after(0, max_time_in_queue=60) is None # Starts immediately, even if it takes 100 s
+    assert get_admission_retry_after(1, max_time_in_queue=60) == 40 # Waits 100 s for the job ahead
+
+
+def test_admission_wait_slo_includes_job_duration():
+    assert get_admission_retry_after(0, admission_wait_slo=200) is None
+    assert get_admission_retry_after(0, admission_wait_slo=60) == 40
+    assert get_admission_retry_after(5) is None
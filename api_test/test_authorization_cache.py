@@ -0,0 +1,173 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import asyncio
+import pytest
+
+from api_server.authorization_cache import AuthorizationCache
+
+
+class AdminBackend():
+    """Admin backend counting its calls. Calls block until release is set."""
+    def __init__(self):
+        self.valid_keys = {'valid_key'}
+        self.authorizations = {('valid_key', 'test_endpoint')}
+        self.num_calls = 0
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def admin_is_api_key_valid(self, api_key, ip_address):
+        self.num_calls += 1
+        await self.release.wait()
+        is_valid = api_key in self.valid_keys
+        return {'valid': is_valid, 'error_msg': None if is_valid else 'Invalid API key'}
+
+    async def admin_is_api_key_authorized_for_endpoint(self, api_key, endpoint_name):
+        self.num_calls += 1
+        await self.release.wait()
+        return (api_key, endpoint_name) in self.authorizations
+
+
+def test_answers_are_cached():
+    async def run():
+        admin_backend = AdminBackend()
+        cache = AuthorizationCache(admin_backend)
+        for _ in range(3):
+            assert (await cache.is_api_key_valid('valid_key', '127.0.0.1'))['valid']
+            assert await cache.is_api_key_authorized_for_endpoint('valid_key', 'test_endpoint')
+        assert admin_backend.num_calls == 2
+        assert cache.get_status() == {'num_entries': 2, 'num_hits': 4, 'num_misses': 2}
+        assert (await cache.is_api_key_valid('valid_key', '10.0.0.1'))['valid']
+        assert admin_backend.num_calls == 3 # Validation is cached per IP address
+    asyncio.run(run())
+
+
+def test_returned_validation_is_a_copy():
+    async def run():
+        cache = AuthorizationCache(AdminBackend())
+        response = await cache.is_api_key_valid('valid_key', '127.0.0.1')
+        response['valid'] = False
+        assert (await cache.is_api_key_valid('valid_key', '127.0.0.1'))['valid']
+    asyncio.run(run())
+
+
+def test_positive_and_negative_ttl():
+    async def run():
+        admin_backend = AdminBackend()
+        cache = AuthorizationCache(admin_backend, ttl=0.2, negative_ttl=0.05)
+        await cache.is_api_key_valid('valid_key', '127.0.0.1')
+        await cache.is_api_key_valid('invalid_key', '127.0.0.1')
+        await asyncio.sleep(0.1)
+        await cache.is_api_key_valid('valid_key', '127.0.0.1')
+        assert admin_backend.num_calls == 2
+        assert not (await cache.is_api_key_valid('invalid_key', '127.0.0.1'))['valid']
+        assert admin_backend.num_calls == 3 # Negative answer expired
+        await asyncio.sleep(0.15)
+        await cache.is_api_key_valid('valid_key', '127.0.0.1')
+        assert admin_backend.num_calls == 4 # Positive answer expired
+    asyncio.run(run())
+
+
+def test_zero_ttl_disables_caching():
+    async def run():
+        admin_backend = AdminBackend()
+        cache = AuthorizationCache(admin_backend, ttl=0, negative_ttl=0)
+        for _ in range(3):
+            await cache.is_api_key_authorized_for_endpoint('valid_key', 'test_endpoint')
+        assert admin_backend.num_calls == 3
+        assert not cache.entries
+    asyncio.run(run())
+
+
+def test_least_recently_used_entries_are_evicted():
+    async def run():
+        admin_backend = AdminBackend()
+        cache = AuthorizationCache(admin_backend, max_entries=2)
+        await cache.is_api_key_authorized_for_endpoint('valid_key', 'endpoint_a')
+        await cache.is_api_key_authorized_for_endpoint('valid_key', 'endpoint_b')
+        await cache.is_api_key_authorized_for_endpoint('valid_key', 'endpoint_a')
+        await cache.is_api_key_authorized_for_endpoint('valid_key', 'endpoint_c')
+        assert list(cache.entries) == [('authorized', 'valid_key', 'endpoint_a'), ('authorized', 'valid_key', 'endpoint_c')]
+    asyncio.run(run())
+
+
+def test_concurrent_requests_share_one_call():
+    async def run():
+        admin_backend = AdminBackend()
+        admin_backend.release.clear()
+        cache = AuthorizationCache(admin_backend)
+        requests = [asyncio.ensure_future(cache.is_api_key_valid('valid_key', '127.0.0.1')) for _ in range(5)]
+        await asyncio.sleep(0)
+        requests[0].cancel() # A disconnecting client doesn't cancel the call of the others
+        admin_backend.release.set()
+        responses = await asyncio.gather(*requests[1:])
+        assert all(response['valid'] for response in responses)
+        assert admin_backend.num_calls == 1
+        assert not cache.pending_requests
+    asyncio.run(run())
+
+
+def test_failed_call_is_not_cached():
+    async def run():
+        admin_backend = AdminBackend()
+        cache = AuthorizationCache(admin_backend)
+        async def failing_call(api_key, ip_address):
+            raise ConnectionError('Admin backend not reachable')
+        admin_backend.admin_is_api_key_valid = failing_call
+        with pytest.raises(ConnectionError):
+            await cache.is_api_key_valid('valid_key', '127.0.0.1')
+        assert not cache.entries and not cache.pending_requests
+    asyncio.run(run())
+
+
+def test_invalidate_api_key():
+    async def run():
+        admin_backend = AdminBackend()
+        cache = AuthorizationCache(admin_backend)
+        await cache.is_api_key_valid('valid_key', '127.0.0.1')
+        await cache.is_api_key_valid('other_key', '127.0.0.1')
+        admin_backend.valid_keys = {'other_key'}
+        cache.invalidate_api_key('valid_key')
+        assert not (await cache.is_api_key_valid('valid_key', '127.0.0.1'))['valid']
+        assert not (await cache.is_api_key_valid('other_key', '127.0.0.1'))['valid'] # Still cached
+        cache.invalidate_api_key()
+        assert not cache.entries
+        assert (await cache.is_api_key_valid('other_key', '127.0.0.1'))['valid']
+    asyncio.run(run())
+
+
+def test_invalidate_endpoint():
+    async def run():
+        admin_backend = AdminBackend()
+        cache = AuthorizationCache(admin_backend)
+        await cache.is_api_key_valid('valid_key', '127.0.0.1')
+        await cache.is_api_key_authorized_for_endpoint('valid_key', 'test_endpoint')
+        await cache.is_api_key_authorized_for_endpoint('valid_key', 'other_endpoint')
+        admin_backend.authorizations.clear()
+        cache.invalidate_endpoint('test_endpoint')
+        assert list(cache.entries) == [('authorized', 'valid_key', 'other_endpoint')]
+        assert not await cache.is_api_key_authorized_for_endpoint('valid_key', 'test_endpoint')
+    asyncio.run(run())
+
+
+def test_answer_of_call_started_before_invalidation_is_not_cached():
+    async def run():
+        admin_backend = AdminBackend()
+        admin_backend.release.clear()
+        cache = AuthorizationCache(admin_backend)
+        stale_request = asyncio.ensure_future(cache.is_api_key_valid('valid_key', '127.0.0.1'))
+        await asyncio.sleep(0)
+        admin_backend.valid_keys.clear()
+        cache.invalidate_api_key('valid_key')
+        assert cache.generation == 1
+        fresh_request = asyncio.ensure_future(cache.is_api_key_valid('valid_key', '127.0.0.1'))
+        await asyncio.sleep(0.01)
+        assert admin_backend.num_calls == 2 # The request after the invalidation doesn't join the stale call
+        admin_backend.release.set()
+        await stale_request
+        assert not (await fresh_request)['valid']
+        assert cache.entries[('valid', 'valid_key', '127.0.0.1')][0]['valid'] is False
+        assert not (await cache.is_api_key_valid('valid_key', '127.0.0.1'))['valid']
+        assert admin_backend.num_calls == 2
+    asyncio.run(run())
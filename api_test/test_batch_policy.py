@@ -0,0 +1,41 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+from types import SimpleNamespace
+
+from api_server.job_queue import BatchPolicy
+from api_server.utils.ffmpeg import MediaBytes
+
+
+def get_group_key(batch_group_by, **job_data):
+    return BatchPolicy({'batch_group_by': batch_group_by}).get_group_key(SimpleNamespace(job_data=job_data))
+
+
+def test_bucket_size_zero_requires_equal_strings():
+    assert get_group_key({'sampler': 0}, sampler='ddim') != get_group_key({'sampler': 0}, sampler='plms')
+    assert get_group_key({'sampler': 0}, sampler='ddim') == get_group_key({'sampler': 0}, sampler='ddim')
+
+
+def test_bucket_size_zero_requires_equal_lists():
+    chat_context = [{'role': 'user', 'content': 'Hello'}, {'role': 'assistant', 'content': 'Hi'}]
+    other_chat_context = [{'role': 'user', 'content': 'Hallo'}, {'role': 'assistant', 'content': 'Hi'}]
+    assert get_group_key({'chat_context': 0}, chat_context=chat_context) != get_group_key({'chat_context': 0}, chat_context=other_chat_context)
+    assert get_group_key({'chat_context': 0}, chat_context=chat_context) == get_group_key({'chat_context': 0}, chat_context=[dict(item) for item in chat_context])
+    assert get_group_key({'stop': 0}, stop=['a', 'b']) != get_group_key({'stop': 0}, stop=['b', 'a'])
+
+
+def test_bucket_size_zero_for_numbers_and_media():
+    assert get_group_key({'height': 0, 'width': 0}, height=512, width=768) == (512, 768)
+    image = MediaBytes(b'\x89PNG\r\n\x1a\n' + bytes(1000), 'image', 'png')
+    other_image = MediaBytes(b'\x89PNG\r\n\x1a\n' + bytes(999) + b'\x01', 'image', 'png')
+    assert get_group_key({'image': 0}, image=image) == get_group_key({'image': 0}, image=MediaBytes(bytes(image)))
+    assert get_group_key({'image': 0}, image=image) != get_group_key({'image': 0}, image=other_image)
+    assert get_group_key({'image': 0}) == (None, )
+
+
+def test_buckets_by_length():
+    batch_group_by = {'prompt': 10, 'chat_context': 100, 'steps': 5}
+    assert get_group_key(batch_group_by, prompt='a' * 15, chat_context=[{'content': 'x' * 150}], steps=7) == (1, 1, 1)
+    assert get_group_key(batch_group_by, prompt='b' * 19, chat_context=[{'content': 'y' * 50}, {'content': 'z' * 60}], steps=9) == (1, 1, 1)
+    assert get_group_key({'audio': 1000}, audio=MediaBytes(bytes(2500))) == (2, )
@@ -0,0 +1,42 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import asyncio
+
+
+def new_job_data():
+    return {'endpoint_name': 'test_endpoint', 'prompt': 'a cat'}
+
+
+def test_concurrent_requests_dont_exceed_the_limit(make_job_handler):
+    async def run():
+        job_handler = make_job_handler(client_request_limit=2)
+        jobs = await asyncio.gather(*(job_handler.endpoint_new_job(new_job_data(), 'client_key') for _ in range(5)))
+        assert sum(1 for job in jobs if job) == 2
+        assert await job_handler.endpoint_new_job(new_job_data(), 'other_client_key')
+    asyncio.run(run())
+
+
+def test_finished_jobs_are_removed_from_client_jobs(make_job_handler):
+    async def run():
+        job_handler = make_job_handler(client_request_limit=3)
+        job_type = job_handler.get_job_type(endpoint_name='test_endpoint')
+        canceled_job, lapsed_job, deleted_job = [await job_handler.endpoint_new_job(new_job_data(), 'client_key') for _ in range(3)]
+        assert await job_handler.is_client_request_limit_reached('test_endpoint', 'client_key')
+
+        await job_type.cancel_job(canceled_job)
+        await job_type.lapse_job(lapsed_job)
+        await job_type.delete_job(deleted_job)
+        assert job_type.client_jobs == {}
+        assert not await job_handler.is_client_request_limit_reached('test_endpoint', 'client_key')
+    asyncio.run(run())
+
+
+def test_no_limit(make_job_handler):
+    async def run():
+        job_handler = make_job_handler(client_request_limit=0)
+        jobs = [await job_handler.endpoint_new_job(new_job_data(), 'client_key') for _ in range(5)]
+        assert all(jobs)
+        assert job_handler.get_job_type(endpoint_name='test_endpoint').client_jobs == {}
+    asyncio.run(run())
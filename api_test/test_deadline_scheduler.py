@@ -0,0 +1,95 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import asyncio
+import logging
+import time
+
+from api_server.job_queue import DeadlineScheduler, JobState
+
+
+def test_callback_fires_at_deadline():
+    async def run():
+        scheduler = DeadlineScheduler()
+        fired = list()
+        async def callback(job_id, reason):
+            fired.append((job_id, reason, time.time()))
+        deadline = time.time() + 0.1
+        scheduler.schedule('job#1', deadline, callback, 'job#1', 'lapsed')
+        assert len(scheduler) == 1
+        await asyncio.sleep(0.05)
+        assert fired == []
+        await asyncio.sleep(0.1)
+        assert [(job_id, reason) for job_id, reason, _ in fired] == [('job#1', 'lapsed')]
+        assert fired[0][2] >= deadline - 0.01
+        assert len(scheduler) == 0
+    asyncio.run(run())
+
+
+def test_past_deadline_fires_immediately():
+    async def run():
+        scheduler = DeadlineScheduler()
+        fired = asyncio.Event()
+        async def callback():
+            fired.set()
+        scheduler.schedule('job#1', time.time() - 10, callback)
+        await asyncio.wait_for(fired.wait(), 0.1)
+    asyncio.run(run())
+
+
+def test_schedule_replaces_pending_deadline():
+    async def run():
+        scheduler = DeadlineScheduler()
+        fired = list()
+        async def callback(name):
+            fired.append(name)
+        scheduler.schedule('job#1', time.time() + 0.05, callback, 'first')
+        scheduler.schedule('job#1', time.time() + 0.1, callback, 'second')
+        scheduler.schedule('job#2', time.time() + 0.05, callback, 'other job')
+        assert len(scheduler) == 2
+        await asyncio.sleep(0.2)
+        assert fired == ['other job', 'second']
+    asyncio.run(run())
+
+
+def test_cancel():
+    async def run():
+        scheduler = DeadlineScheduler()
+        fired = list()
+        async def callback():
+            fired.append(True)
+        scheduler.schedule('job#1', time.time() + 0.05, callback)
+        scheduler.cancel('job#1')
+        scheduler.cancel('unknown job')
+        assert len(scheduler) == 0
+        await asyncio.sleep(0.1)
+        assert fired == []
+    asyncio.run(run())
+
+
+def test_queued_job_lapses_after_max_time_in_queue(make_job_handler):
+    async def run():
+        job_handler = make_job_handler(max_time_in_queue=0.1)
+        job = await job_handler.endpoint_new_job({'endpoint_name': 'test_endpoint', 'prompt': 'a cat'}, 'client_key')
+        assert job.state == JobState.QUEUED
+        assert len(job_handler.deadlines) == 1
+        await asyncio.sleep(0.2)
+        assert job.state == JobState.LAPSED
+        assert job_handler.get_job_type(endpoint_name='test_endpoint').queue.qsize() == 0
+        result = await asyncio.wait_for(job_handler.endpoint_wait_for_job_result(job), 1) # Requests waiting for the result don't hang
+        assert result == {'error': 'Job lapsed in queue'}
+    asyncio.run(run())
+
+
+def test_exception_in_callback_is_logged(caplog):
+    async def run():
+        scheduler = DeadlineScheduler()
+        async def failing_callback():
+            raise RuntimeError('deadline callback failed')
+        scheduler.schedule('job#1', time.time(), failing_callback)
+        await asyncio.sleep(0.05)
+    with caplog.at_level(logging.ERROR, logger='API'):
+        asyncio.run(run())
+    assert 'Deadline callback failing_callback of job job#1 failed' in caplog.text
+    assert 'deadline callback failed' in caplog.text
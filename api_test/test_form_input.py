@@ -0,0 +1,77 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import asyncio
+import pytest
+from sanic import Sanic
+from sanic.request import Request
+from sanic.compat import Header
+
+from api_server.api_endpoint import APIEndpoint
+from api_server.input_validation import InputValidationHandler, parse_string_value
+
+
+EP_INPUT_PARAM_CONFIG = {
+    'prompt': {'type': 'string'},
+    'steps': {'type': 'int'},
+    'scale': {'type': 'float'},
+    'seed_random': {'type': 'bool'},
+    'wait_for_result': {'type': 'bool'}
+}
+
+app = Sanic('test_form_input')
+
+
+def make_endpoint():
+    endpoint = APIEndpoint.__new__(APIEndpoint) # Only the input parameters are needed, no routes and workers
+    endpoint.ep_input_param_config = EP_INPUT_PARAM_CONFIG
+    endpoint.input_param_specs = InputValidationHandler.compile_input_param_specs(EP_INPUT_PARAM_CONFIG)
+    return endpoint
+
+
+def make_multipart_request(fields):
+    body = b''.join(
+        f'--boundary\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode() for name, value in fields.items()
+    ) + b'--boundary--\r\n'
+    request = Request(b'/test_endpoint', Header({'content-type': 'multipart/form-data; boundary=boundary'}), '1.1', 'POST', None, app)
+    request.body = body
+    return request
+
+
+def validate(endpoint, input_args):
+    return asyncio.run(InputValidationHandler(input_args, EP_INPUT_PARAM_CONFIG, {}, input_param_specs=endpoint.input_param_specs).validate_input_parameters())
+
+
+def test_multipart_int_float_and_bool_fields():
+    endpoint = make_endpoint()
+    request = make_multipart_request({'prompt': 'a cat', 'steps': '25', 'scale': '7.5', 'seed_random': 'true', 'wait_for_result': 'false'})
+    input_args = endpoint.get_input_args(request)
+    assert input_args == {'prompt': 'a cat', 'steps': 25, 'scale': 7.5, 'seed_random': True, 'wait_for_result': False}
+
+    job_data, validation_errors = validate(endpoint, input_args)
+    assert validation_errors == []
+    assert job_data['steps'] == 25 and isinstance(job_data['steps'], int)
+    assert job_data['scale'] == 7.5
+    assert job_data['seed_random'] is True
+    assert job_data['wait_for_result'] is False
+
+
+def test_multipart_invalid_values_are_rejected():
+    endpoint = make_endpoint()
+    request = make_multipart_request({'steps': 'many', 'seed_random': 'maybe'})
+    input_args = endpoint.get_input_args(request)
+    assert input_args == {'steps': 'many', 'seed_random': 'maybe'}
+
+    _, validation_errors = validate(endpoint, input_args)
+    assert len(validation_errors) == 2
+
+
+@pytest.mark.parametrize('value, expected', [('true', True), ('True', True), ('1', True), ('false', False), ('FALSE', False), ('0', False)])
+def test_parse_bool_strings(value, expected):
+    assert parse_string_value(value, bool) is expected
+
+
+def test_parse_invalid_bool_string():
+    with pytest.raises(ValueError):
+        parse_string_value('yes please', bool)
@@ -0,0 +1,130 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import asyncio
+import json
+import pytest
+
+from api_server.job_journal import JobJournal, JobJournalError
+from api_server.job_queue import JobState
+
+
+def log_new_job(journal, job_id):
+    journal.log_event('new', job_id, endpoint_name='test_endpoint', job_data={'job_id': job_id, 'prompt': 'a cat'})
+
+
+def test_events_are_group_committed_and_replayed(tmp_path):
+    async def run():
+        journal = JobJournal(tmp_path / 'jobs.journal', flush_interval=0.01)
+        journal.open()
+        journal.start()
+        for index in range(3):
+            log_new_job(journal, f'JID{index}')
+        journal.log_event('start', 'JID1', worker_auth='test_worker')
+        journal.log_event('progress', 'JID1', progress_state={'progress': 10})
+        journal.log_event('progress', 'JID1', progress_state={'progress': 20}) # Replaces the buffered progress event
+        journal.log_event('delete', 'JID0')
+        await asyncio.sleep(0.1)
+        status = journal.get_status()
+        assert (status['num_commits'], status['num_events'], status['num_buffered_events']) == (1, 6, 0)
+        await journal.stop()
+
+        jobs = JobJournal(tmp_path / 'jobs.journal').replay()
+        assert list(jobs) == ['JID1', 'JID2']
+        assert jobs['JID1']['start']['worker_auth'] == 'test_worker'
+        assert jobs['JID1']['progress']['progress_state'] == {'progress': 20}
+        assert set(jobs['JID2']) == {'new'}
+    asyncio.run(run())
+
+
+def test_torn_lines_are_skipped(tmp_path):
+    journal_file = tmp_path / 'jobs.journal'
+    lines = [
+        {'event': 'new', 'job_id': 'JID1', 'endpoint_name': 'test_endpoint', 'job_data': {}},
+        {'event': 'new', 'job_id': 'JID2', 'endpoint_name': 'test_endpoint', 'job_data': {}},
+    ]
+    journal_file.write_bytes(b''.join(json.dumps(line).encode() + b'\n' for line in lines) + b'{"event": "result", "job_id": "JI')
+    jobs = JobJournal(journal_file).replay()
+    assert list(jobs) == ['JID1', 'JID2']
+    assert 'result' not in jobs['JID2']
+
+
+def test_missing_journal_file(tmp_path):
+    assert JobJournal(tmp_path / 'jobs.journal').replay() == {}
+
+
+def test_compaction_keeps_the_lock_and_later_events(tmp_path):
+    async def run():
+        journal = JobJournal(tmp_path / 'jobs.journal', flush_interval=0)
+        journal.open()
+        for index in range(10):
+            log_new_job(journal, f'JID{index}')
+            journal.log_event('delete', f'JID{index}')
+        log_new_job(journal, 'JID10')
+        await journal.commit()
+        size_before = journal.size
+
+        async def get_snapshot():
+            return [{'event': 'new', 'job_id': 'JID10', 'endpoint_name': 'test_endpoint', 'job_data': {}}]
+        journal.get_snapshot = get_snapshot
+        await journal.compact()
+        assert journal.size < size_before
+        assert journal.get_status()['num_compactions'] == 1
+        assert not (tmp_path / 'jobs.journal.tmp').exists()
+
+        with pytest.raises(JobJournalError): # Still locked after the journal file was replaced
+            JobJournal(tmp_path / 'jobs.journal').open()
+
+        journal.log_event('start', 'JID10', worker_auth='test_worker')
+        await journal.stop()
+        assert journal.size == (tmp_path / 'jobs.journal').stat().st_size
+        jobs = JobJournal(tmp_path / 'jobs.journal').replay()
+        assert list(jobs) == ['JID10']
+        assert jobs['JID10']['start']['worker_auth'] == 'test_worker'
+    asyncio.run(run())
+
+
+def test_journal_is_locked_by_one_process(tmp_path):
+    async def run():
+        journal = JobJournal(tmp_path / 'jobs.journal')
+        journal.open()
+        with pytest.raises(JobJournalError):
+            JobJournal(tmp_path / 'jobs.journal').open()
+        await journal.stop()
+        other_journal = JobJournal(tmp_path / 'jobs.journal')
+        other_journal.open()
+        await other_journal.stop()
+    asyncio.run(run())
+
+
+def test_jobs_are_restored_after_restart(tmp_path, make_job_handler):
+    server_config = {'JOB_JOURNAL': {'enabled': True, 'file': str(tmp_path / 'jobs.journal'), 'flush_interval': 0}}
+
+    async def run_first_server():
+        job_handler = make_job_handler(server_config)
+        await job_handler.restore_jobs_from_journal()
+        job_type = job_handler.get_job_type(endpoint_name='test_endpoint')
+        jobs = [await job_handler.endpoint_new_job({'endpoint_name': 'test_endpoint', 'prompt': f'prompt {index}'}, 'client_key') for index in range(4)]
+        await job_type.cancel_job(jobs[2])
+        await job_type.lapse_job(jobs[3], 'Job lapsed in queue')
+        await job_handler.stop_journal()
+        return [job.id for job in jobs]
+
+    async def run_second_server(job_ids):
+        job_handler = make_job_handler(server_config)
+        await job_handler.restore_jobs_from_journal()
+        queued_job_ids = [job.id for job in job_handler.get_queue('test_endpoint').get_queue()]
+        assert queued_job_ids == job_ids[:2]
+        canceled_job = job_handler.get_job(job_ids[2])
+        assert canceled_job.state == JobState.CANCELED
+        assert (await job_handler.result_store.get(canceled_job.id)).get('error')
+        lapsed_job = job_handler.get_job(job_ids[3])
+        assert lapsed_job.state == JobState.LAPSED
+        assert await asyncio.wait_for(job_handler.endpoint_wait_for_job_result(lapsed_job), 1) == {'error': 'Job lapsed in queue'}
+        new_job = await job_handler.endpoint_new_job({'endpoint_name': 'test_endpoint', 'prompt': 'new prompt'})
+        assert int(new_job.id.rpartition('#')[2]) > max(int(job_id.rpartition('#')[2]) for job_id in job_ids)
+        await job_handler.stop_journal()
+
+    job_ids = asyncio.run(run_first_server())
+    asyncio.run(run_second_server(job_ids))
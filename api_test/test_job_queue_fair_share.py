@@ -0,0 +1,86 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import collections
+from types import SimpleNamespace
+
+from api_server.job_queue import JobQueue, QueueScheduler
+
+
+def make_job(api_key, index, priority_class=None):
+    return SimpleNamespace(id=f'{api_key}#{index}', queue_seq=None, api_key=api_key, priority_class=priority_class, flow_key=None, flow_seq=None)
+
+
+def make_fair_share_queue(priority_classes=None):
+    return JobQueue(0, scheduler=QueueScheduler.FAIR_SHARE, priority_classes=priority_classes)
+
+
+def get_all(queue):
+    return [queue.get_nowait() for _ in range(queue.qsize())]
+
+
+def test_api_keys_are_served_in_round_robin():
+    queue = make_fair_share_queue()
+    jobs_a = [make_job('key_a', index) for index in range(4)]
+    jobs_b = [make_job('key_b', index) for index in range(2)]
+    for job in jobs_a + jobs_b:
+        queue.put_nowait(job)
+    assert get_all(queue) == [jobs_a[0], jobs_b[0], jobs_a[1], jobs_b[1], jobs_a[2], jobs_a[3]]
+    assert queue.qsize() == 0
+
+
+def test_priority_class_weights():
+    queue = make_fair_share_queue({'premium': 2})
+    for index in range(30):
+        queue.put_nowait(make_job('key_basic', index))
+        queue.put_nowait(make_job('key_premium', index, 'premium'))
+    served_jobs = [queue.get_nowait() for _ in range(30)]
+    assert collections.Counter(job.api_key for job in served_jobs) == {'key_premium': 20, 'key_basic': 10}
+    for api_key in ('key_basic', 'key_premium'):
+        indices = [int(job.id.split('#')[1]) for job in served_jobs if job.api_key == api_key]
+        assert indices == sorted(indices) # FIFO within a flow
+
+
+def test_removed_jobs_are_skipped():
+    queue = make_fair_share_queue()
+    jobs_a = [make_job('key_a', index) for index in range(3)]
+    jobs_b = [make_job('key_b', index) for index in range(2)]
+    for job in jobs_a + jobs_b:
+        queue.put_nowait(job)
+    assert queue.remove(jobs_a[0])
+    assert queue.remove(jobs_b[1])
+    assert queue.qsize() == 3
+    assert get_all(queue) == [jobs_a[1], jobs_b[0], jobs_a[2]]
+
+
+def test_fair_share_rank():
+    queue = make_fair_share_queue()
+    jobs_a = [make_job('key_a', index) for index in range(10)]
+    job_b = make_job('key_b', 0)
+    for job in jobs_a + [job_b]:
+        queue.put_nowait(job)
+    assert queue.get_rank(job_b) == 2 # Served after the first job of key_a, not after all ten
+    assert queue.get_rank(jobs_a[0]) == 2
+    assert queue.get_rank(jobs_a[9]) == 11
+    served_jobs = get_all(queue)
+    assert served_jobs.index(job_b) < 2
+    assert queue.get_rank(job_b) == 0
+
+
+def test_api_key_gets_one_share_across_priority_classes():
+    queue = make_fair_share_queue({'interactive': 1, 'bulk': 1})
+    for index in range(10):
+        queue.put_nowait(make_job('key_a', index, ('interactive', 'bulk')[index % 2]))
+        queue.put_nowait(make_job('key_b', index, 'bulk'))
+    served_jobs = [queue.get_nowait() for _ in range(10)]
+    assert collections.Counter(job.api_key for job in served_jobs) == {'key_a': 5, 'key_b': 5}
+
+
+def test_weight_of_the_next_job_of_a_flow():
+    queue = make_fair_share_queue({'premium': 3})
+    for index in range(6):
+        queue.put_nowait(make_job('key_a', index, 'premium' if index < 3 else None))
+        queue.put_nowait(make_job('key_b', index))
+    served_jobs = [queue.get_nowait() for _ in range(8)]
+    assert [job.api_key for job in served_jobs] == ['key_a', 'key_a', 'key_a', 'key_b', 'key_a', 'key_b', 'key_a', 'key_b']
@@ -0,0 +1,78 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import random
+from types import SimpleNamespace
+
+from api_server.job_queue import FenwickTree, JobQueue, RANK_INDEX_MIN_SIZE
+
+
+def make_job(index):
+    return SimpleNamespace(id=f'JID{index}', queue_seq=None, api_key=None, priority_class=None, flow_key=None, flow_seq=None)
+
+
+def test_fenwick_tree_prefix_and_range_sums():
+    values = [3, 0, 5, 1, 0, 2, 7, 4]
+    tree = FenwickTree(len(values))
+    for index, value in enumerate(values):
+        tree.add(index, value)
+    for end in range(len(values) + 1):
+        assert tree.prefix_sum(end) == sum(values[:end])
+    for start in range(len(values)):
+        for end in range(len(values)):
+            expected = sum(values[start:end]) if start <= end else sum(values[start:]) + sum(values[:end])
+            assert tree.range_sum(start, end) == expected
+    tree.add(2, -5)
+    assert tree.prefix_sum(len(values)) == sum(values) - 5
+
+
+def test_rank_of_fifo_queue():
+    queue = JobQueue(0)
+    jobs = [make_job(index) for index in range(5)]
+    for job in jobs:
+        queue.put_nowait(job)
+    assert [queue.get_rank(job) for job in jobs] == [1, 2, 3, 4, 5]
+    queue.remove(jobs[2])
+    assert [queue.get_rank(job) for job in jobs] == [1, 2, 0, 3, 4]
+    assert queue.get_nowait() is jobs[0]
+    assert [queue.get_rank(job) for job in jobs] == [0, 1, 0, 2, 3]
+    assert len(queue) == 3
+    assert queue.get_queue() == [jobs[1], jobs[3], jobs[4]]
+
+
+def test_rank_matches_list_model_with_random_operations():
+    random_generator = random.Random(42)
+    queue = JobQueue(0)
+    model = list()
+    num_jobs = 0
+    for _ in range(5000):
+        operation = random_generator.random()
+        if operation < 0.5 or not model:
+            job = make_job(num_jobs)
+            num_jobs += 1
+            queue.put_nowait(job)
+            model.append(job)
+        elif operation < 0.75:
+            assert queue.get_nowait() is model.pop(0)
+        else:
+            job = model.pop(random_generator.randrange(len(model)))
+            assert queue.remove(job)
+            assert not queue.remove(job)
+        assert len(queue) == len(model)
+        if model:
+            for job in random_generator.sample(model, min(5, len(model))):
+                assert queue.get_rank(job) == model.index(job) + 1
+    assert num_jobs > RANK_INDEX_MIN_SIZE # The sequence numbers wrapped around the rank index
+    assert queue.get_queue() == model
+
+
+def test_rank_index_grows_with_the_queue():
+    queue = JobQueue(0)
+    jobs = [make_job(index) for index in range(3 * RANK_INDEX_MIN_SIZE)]
+    for job in jobs:
+        queue.put_nowait(job)
+    for job in jobs[::2]:
+        queue.remove(job)
+    remaining_jobs = jobs[1::2]
+    assert [queue.get_rank(job) for job in remaining_jobs] == list(range(1, len(remaining_jobs) + 1))
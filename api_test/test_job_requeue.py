@@ -0,0 +1,66 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import asyncio
+
+from api_server.job_queue import JobState
+
+
+WORKER_LOGIN = {'worker_parameters': {'auth': 'test_worker', 'job_type': 'test_job_type', 'auth_key': 'test_worker_auth_key', 'max_batch_size': 2}}
+
+
+async def login_worker_and_add_jobs(job_handler, num_jobs):
+    assert (await job_handler.worker_login(WORKER_LOGIN)).get('success')
+    return [await job_handler.endpoint_new_job({'endpoint_name': 'test_endpoint', 'prompt': f'prompt {index}'}) for index in range(num_jobs)]
+
+
+def test_jobs_of_undelivered_job_request_are_requeued(make_job_handler):
+    async def run():
+        job_handler = make_job_handler()
+        jobs = await login_worker_and_add_jobs(job_handler, 3)
+        response_cmd = await job_handler.worker_job_request({'auth': 'test_worker', 'max_job_batch': 2}, session_authorized=True)
+        job_ids = [job_data['job_id'] for job_data in response_cmd['job_data']]
+        assert job_ids == [jobs[0].id, jobs[1].id]
+        assert all(job.state == JobState.PROCESSING for job in jobs[:2])
+
+        await job_handler.worker_requeue_jobs('test_worker', job_ids)
+        assert all(job.state == JobState.QUEUED and not job.worker_auth for job in jobs[:2])
+        assert job_handler.get_worker('test_worker').running_jobs == {}
+        queue = job_handler.get_queue('test_endpoint')
+        assert [job.id for job in queue.get_queue()] == [jobs[2].id, jobs[0].id, jobs[1].id]
+    asyncio.run(run())
+
+
+def test_finished_jobs_are_not_requeued(make_job_handler):
+    async def run():
+        job_handler = make_job_handler()
+        jobs = await login_worker_and_add_jobs(job_handler, 1)
+        await job_handler.worker_job_request({'auth': 'test_worker', 'max_job_batch': 1}, session_authorized=True)
+        await job_handler.get_job_type(endpoint_name='test_endpoint').cancel_job(jobs[0])
+        await job_handler.worker_requeue_jobs('test_worker', [jobs[0].id])
+        assert jobs[0].state == JobState.CANCELED
+        assert len(job_handler.get_queue('test_endpoint')) == 0
+    asyncio.run(run())
+
+
+def test_canceled_job_request_requeues_the_dequeued_jobs(make_job_handler):
+    async def run():
+        job_handler = make_job_handler()
+        job_type = job_handler.get_job_type(endpoint_name='test_endpoint')
+        assert (await job_handler.worker_login(WORKER_LOGIN)).get('success')
+        start_job_batch = job_type.start_job_batch
+        async def slow_start_job_batch(*args):
+            await asyncio.sleep(0.05) # Job request is canceled after the dequeue while the batch is started
+            return await start_job_batch(*args)
+        job_type.start_job_batch = slow_start_job_batch
+
+        job_request = asyncio.ensure_future(job_handler.worker_job_request({'auth': 'test_worker', 'max_job_batch': 1}, session_authorized=True))
+        await asyncio.sleep(0.01)
+        job = await job_handler.endpoint_new_job({'endpoint_name': 'test_endpoint', 'prompt': 'a cat'})
+        await asyncio.sleep(0.01)
+        job_request.cancel()
+        await asyncio.sleep(0.1)
+        assert job.state == JobState.QUEUED
+        assert [queued_job.id for queued_job in job_handler.get_queue('test_endpoint').get_queue()] == [job.id]
+    asyncio.run(run())
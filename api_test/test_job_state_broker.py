@@ -0,0 +1,117 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import asyncio
+import logging
+import pytest
+from types import SimpleNamespace
+
+from api_server.job_state_broker import JobHandlerClient, JobStateBroker, JobStateBrokerError, write_frame, read_frame
+from api_server.job_queue import JobState
+from api_server.utils.ffmpeg import MediaBytes
+
+
+class StreamBuffer():
+    """Minimal stream writer collecting the written frames."""
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data.extend(data)
+
+    async def drain(self):
+        pass
+
+
+async def encode_and_decode(message):
+    buffer = StreamBuffer()
+    write_frame(buffer, message)
+    reader = asyncio.StreamReader()
+    reader.feed_data(bytes(buffer.data))
+    reader.feed_eof()
+    return await read_frame(reader), await read_frame(reader)
+
+
+def test_frame_without_attachments():
+    message = {'id': 1, 'method': 'endpoint_get_job', 'args': ['job#1'], 'kwargs': {}}
+    decoded, end = asyncio.run(encode_and_decode(message))
+    assert decoded == message
+    assert end is None
+
+
+def test_frame_with_attachments():
+    image = MediaBytes(b'\x89PNG\r\n\x1a\n' + bytes(range(256)), 'image', 'png')
+    audio = MediaBytes(b'RIFF\x00\x00\x00\x00WAVE', 'audio', 'wav')
+    message = {'id': 2, 'method': 'endpoint_new_job', 'args': [{'image': image, 'audio': audio, 'prompt': 'a cat'}]}
+    decoded, _ = asyncio.run(encode_and_decode(message))
+    job_data = decoded['args'][0]
+    assert job_data['prompt'] == 'a cat'
+    for name, media in (('image', image), ('audio', audio)):
+        assert isinstance(job_data[name], MediaBytes)
+        assert job_data[name] == media
+        assert (job_data[name].media_type, job_data[name].media_format) == (media.media_type, media.media_format)
+
+
+def test_truncated_frame():
+    async def read_truncated():
+        buffer = StreamBuffer()
+        write_frame(buffer, {'id': 3, 'args': [MediaBytes(b'data')]})
+        reader = asyncio.StreamReader()
+        reader.feed_data(bytes(buffer.data[:-2]))
+        reader.feed_eof()
+        return await read_frame(reader)
+    assert asyncio.run(read_truncated()) is None
+
+
+def test_client_fails_fast_after_broker_is_killed(tmp_path):
+    socket_path = str(tmp_path / 'broker.sock')
+    app = SimpleNamespace(endpoints={}, registered_keys={}, logger=logging.getLogger('test'))
+
+    async def run():
+        broker_connections = list()
+        async def handle_connection(reader, writer):
+            broker_connections.append(writer)
+            await read_frame(reader) # Never answers the call
+        server = await asyncio.start_unix_server(handle_connection, path=socket_path)
+        client = JobHandlerClient(app, socket_path)
+        await client.connect()
+        assert client.connected
+
+        pending_call = asyncio.ensure_future(client.call('get_num_workers_online'))
+        await asyncio.sleep(0.1)
+        server.close() # Kill the broker
+        for writer in broker_connections:
+            writer.close()
+        with pytest.raises(JobStateBrokerError):
+            await asyncio.wait_for(pending_call, 1)
+        assert not client.connected
+        assert not client.pending_calls
+
+        with pytest.raises(JobStateBrokerError):
+            await asyncio.wait_for(client.call('get_num_workers_online'), 1)
+        assert not client.pending_calls
+
+    asyncio.run(run())
+
+
+def test_broker_calls_with_deleted_job(tmp_path, make_job_handler):
+    async def run():
+        app = make_job_handler().app
+        broker = app.job_handler = JobStateBroker(app, str(tmp_path / 'broker.sock'))
+        job = await broker.endpoint_new_job({'endpoint_name': 'test_endpoint', 'prompt': 'a cat'})
+        encoded_job = broker.encode(job)
+        await broker.get_job_type(job.id).delete_job(job)
+
+        writer = StreamBuffer()
+        broker.connections[writer] = {'write_lock': asyncio.Lock(), 'calls': dict()}
+        for call_id, method in enumerate(('endpoint_wait_for_job_result', 'endpoint_get_progress_state', 'is_job_future_done', 'endpoint_cancel_job', 'get_job_snapshot')):
+            await broker.handle_request(writer, {'id': call_id, 'method': method, 'args': [encoded_job]})
+        reader = asyncio.StreamReader()
+        reader.feed_data(bytes(writer.data))
+        reader.feed_eof()
+        responses = [await read_frame(reader) for _ in range(5)]
+        assert all('error' not in response for response in responses)
+        assert responses[0]['result'] == {'error': 'Client has no active request with this job id'}
+        assert [response['result'] for response in responses[1:]] == [None, False, False, {'state': JobState.UNKNOWN}]
+    asyncio.run(run())
@@ -0,0 +1,102 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import asyncio
+
+from api_server.utils.media_cache import MediaConversionCache, SPILL_FILE_SUFFIX
+from api_server.utils.ffmpeg import MediaBytes
+
+
+def make_media(index, size=100):
+    return MediaBytes(bytes([index % 256]) * size, 'image', 'png')
+
+
+def test_get_key_depends_on_media_and_config():
+    key = MediaConversionCache.get_key(b'media', {'format': 'png'})
+    assert key == MediaConversionCache.get_key(b'media', {'format': 'png'})
+    assert key != MediaConversionCache.get_key(b'media', {'format': 'jpeg'})
+    assert key != MediaConversionCache.get_key(b'other media', {'format': 'png'})
+
+
+def test_least_recently_used_entries_are_evicted():
+    async def run():
+        cache = MediaConversionCache(max_size=300, max_entries=10)
+        for index in range(3):
+            await cache.put(f'key{index}', make_media(index))
+        assert await cache.get('key0') == make_media(0) # key1 is now the least recently used entry
+        await cache.put('key3', make_media(3))
+        assert await cache.get('key1') is None
+        assert [await cache.get(key) is not None for key in ('key0', 'key2', 'key3')] == [True, True, True]
+        assert cache.size == 300
+        status = cache.get_status()
+        assert (status['num_entries'], status['num_hits'], status['num_misses']) == (3, 4, 1)
+    asyncio.run(run())
+
+
+def test_max_entries_and_oversized_media():
+    async def run():
+        cache = MediaConversionCache(max_size=1000, max_entries=2)
+        for index in range(3):
+            await cache.put(f'key{index}', make_media(index, 10))
+        assert list(cache.entries) == ['key1', 'key2']
+        await cache.put('huge', make_media(0, 2000))
+        assert 'huge' not in cache.entries
+    asyncio.run(run())
+
+
+def test_evicted_entries_are_spilled_and_read_back(tmp_path):
+    async def run():
+        cache = MediaConversionCache(max_size=200, max_entries=10, spill_dir=tmp_path, spill_max_size=10000)
+        await cache.put('key0', make_media(0))
+        await cache.put('key1', 'data:image/png;base64,' + 'A' * 80)
+        await cache.put('key2', make_media(2))
+        await cache.put('key3', make_media(3))
+        assert set(cache.spill_files) == {'key0', 'key1'}
+        assert cache.spill_size == sum(spill_file.stat().st_size for spill_file in tmp_path.glob(f'*{SPILL_FILE_SUFFIX}'))
+
+        media = await cache.get('key0')
+        assert media == make_media(0)
+        assert (media.media_type, media.media_format) == ('image', 'png')
+        assert await cache.get('key1') == 'data:image/png;base64,' + 'A' * 80
+        assert 'key1' in cache.entries # Read back into memory, key0 is evicted again
+
+        restarted_cache = MediaConversionCache(max_size=200, max_entries=10, spill_dir=tmp_path, spill_max_size=10000)
+        assert set(restarted_cache.spill_files) == set(cache.spill_files)
+        assert restarted_cache.spill_size == cache.spill_size
+    asyncio.run(run())
+
+
+def test_spill_files_are_evicted_above_spill_max_size(tmp_path):
+    async def run():
+        cache = MediaConversionCache(max_size=100, max_entries=10, spill_dir=tmp_path, spill_max_size=300)
+        for index in range(6):
+            await cache.put(f'key{index}', make_media(index))
+        assert cache.spill_size <= 300
+        assert list(cache.spill_files) == ['key3', 'key4'] # Each file has a header, so only two fit
+        assert sorted(spill_file.stem for spill_file in tmp_path.glob(f'*{SPILL_FILE_SUFFIX}')) == ['key3', 'key4']
+        assert cache.spill_size == sum(spill_file.stat().st_size for spill_file in tmp_path.glob(f'*{SPILL_FILE_SUFFIX}'))
+    asyncio.run(run())
+
+
+def test_missing_spill_file_is_dropped(tmp_path):
+    async def run():
+        cache = MediaConversionCache(max_size=100, max_entries=10, spill_dir=tmp_path, spill_max_size=10000)
+        await cache.put('key0', make_media(0))
+        await cache.put('key1', make_media(1))
+        cache.get_spill_file('key0').unlink()
+        assert await cache.get('key0') is None
+        assert 'key0' not in cache.spill_files
+        assert cache.spill_size == 0
+    asyncio.run(run())
+
+
+def test_concurrent_puts_keep_spill_size_consistent(tmp_path):
+    async def run():
+        cache = MediaConversionCache(max_size=500, max_entries=5, spill_dir=tmp_path, spill_max_size=3000)
+        await asyncio.gather(*(cache.put(f'key{index}', make_media(index)) for index in range(60)))
+        await asyncio.gather(*(cache.get(f'key{index}') for index in range(60)))
+        assert cache.spill_size == sum(cache.spill_files.values())
+        assert cache.spill_size == sum(spill_file.stat().st_size for spill_file in tmp_path.glob(f'*{SPILL_FILE_SUFFIX}'))
+        assert cache.spill_size <= 3000
+    asyncio.run(run())
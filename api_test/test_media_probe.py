@@ -0,0 +1,170 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import io
+import json
+import shutil
+import struct
+import subprocess
+import wave
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from api_server.utils.media_probe import probe_media_header
+from api_server.utils.ffmpeg import FFPROBE_DICT, MediaParams
+
+
+TEST_DIR = Path(__file__).parent
+MP3_FRAME_HEADER = b'\xff\xfb\x90\x00' # MPEG 1 layer III, 128 kbit/s, 44100 Hz, stereo
+MP3_FRAME_LENGTH = 417
+
+
+def make_wav(sample_width=2, channels=1, sample_rate=16000, num_frames=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(sample_width)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(b'\x00' * sample_width * channels * num_frames)
+    return buffer.getvalue()
+
+
+def make_image(media_format, mode='RGB', size=(64, 48), color='red', **save_kwargs):
+    buffer = io.BytesIO()
+    Image.new(mode, size, color).save(buffer, media_format, **save_kwargs)
+    return buffer.getvalue()
+
+
+def make_mp3(num_frames=100, frame_header=MP3_FRAME_HEADER, first_frame=None, id3_tag=b''):
+    frame = frame_header.ljust(MP3_FRAME_LENGTH, b'\x00')
+    return id3_tag + (first_frame or b'') + frame * num_frames
+
+
+def make_xing_frame(num_frames, num_bytes):
+    return (MP3_FRAME_HEADER + b'\x00' * 32 + b'Xing' + struct.pack('>III', 0x03, num_frames, num_bytes)).ljust(MP3_FRAME_LENGTH, b'\x00')
+
+
+def make_id3_tag(encoder):
+    text = b'\x00' + encoder.encode('latin-1')
+    frame = b'TSSE' + struct.pack('>I', len(text)) + b'\x00\x00' + text
+    size = len(frame)
+    synchsafe_size = bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    return b'ID3\x03\x00\x00' + synchsafe_size + frame
+
+
+def test_png():
+    assert probe_media_header((TEST_DIR / 'test_image.png').read_bytes()) == {
+        'format': 'png', 'video_codec': 'png', 'color_space': 'rgb24', 'size': (512, 512)
+    }
+    assert probe_media_header(make_image('PNG', 'RGBA'))['color_space'] == 'rgba'
+    assert probe_media_header(make_image('PNG', 'L'))['color_space'] == 'gray'
+    assert probe_media_header(make_image('PNG', 'P'))['color_space'] == 'pal8'
+    assert probe_media_header(make_image('PNG', 'RGB', transparency=(255, 0, 0)))['color_space'] == 'rgba'
+
+
+def test_animated_png_is_left_to_ffprobe():
+    frames = [Image.new('RGB', (8, 8), color) for color in ('red', 'blue')]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, 'PNG', save_all=True, append_images=frames[1:])
+    assert probe_media_header(buffer.getvalue()) is None
+
+
+def test_jpeg():
+    assert probe_media_header((TEST_DIR / 'test_image.jpg').read_bytes()) == {
+        'format': 'jpeg', 'video_codec': 'mjpeg', 'color_space': 'yuvj420p', 'size': (512, 512)
+    }
+    assert probe_media_header(make_image('JPEG', subsampling=0))['color_space'] == 'yuvj444p'
+    assert probe_media_header(make_image('JPEG', subsampling=1))['color_space'] == 'yuvj422p'
+    assert probe_media_header(make_image('JPEG', 'L'))['color_space'] == 'gray'
+    assert probe_media_header(make_image('JPEG', progressive=True))['size'] == (64, 48)
+    assert probe_media_header(make_image('JPEG', 'CMYK')) is None
+
+
+def test_webp():
+    assert probe_media_header(make_image('WEBP')) == {'format': 'webp', 'video_codec': 'webp', 'color_space': 'yuv420p', 'size': (64, 48)}
+    assert probe_media_header(make_image('WEBP', 'RGBA', color=(255, 0, 0, 128)))['color_space'] == 'yuva420p'
+    assert probe_media_header(make_image('WEBP', lossless=True)) == {'format': 'webp', 'video_codec': 'webp', 'color_space': 'argb', 'size': (64, 48)}
+
+
+def test_wav():
+    assert probe_media_header(make_wav()) == {
+        'format': 'wav', 'audio_codec': 'pcm_s16le', 'duration': 1, 'sample_rate': 16000, 'channels': 1,
+        'sample_bit_depth': 's16', 'audio_bit_rate': 256000, 'encoder': None
+    }
+    params = probe_media_header(make_wav(sample_width=1, channels=2, sample_rate=8000, num_frames=24000))
+    assert (params['audio_codec'], params['sample_bit_depth'], params['channels'], params['duration']) == ('pcm_u8', 'u8', 2, 3)
+    assert probe_media_header(make_wav(sample_width=3))['audio_codec'] == 'pcm_s24le'
+
+
+def test_streamed_wav_without_data_size():
+    data = bytearray(make_wav(num_frames=32000))
+    data_offset = data.index(b'data')
+    data[data_offset + 4:data_offset + 8] = b'\xff\xff\xff\xff'
+    assert probe_media_header(bytes(data))['duration'] == 2
+
+
+def test_cbr_mp3():
+    assert probe_media_header(make_mp3()) == {
+        'format': 'mp3', 'audio_codec': 'mp3', 'duration': 3, 'sample_rate': 44100, 'channels': 2,
+        'sample_bit_depth': 'fltp', 'audio_bit_rate': 128000, 'encoder': None
+    }
+    assert probe_media_header(make_mp3(frame_header=b'\xff\xfb\x90\xc0'))['channels'] == 1
+
+
+def test_vbr_mp3_with_xing_tag_and_id3_encoder():
+    params = probe_media_header(make_mp3(first_frame=make_xing_frame(1000, 1000 * MP3_FRAME_LENGTH), id3_tag=make_id3_tag('Lavf60.3.100')))
+    assert params['duration'] == 26 # 1000 frames * 1152 samples / 44100 Hz
+    assert params['audio_bit_rate'] == 127706
+    assert params['encoder'] == 'Lavf60.3.100'
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'not a media file',
+    (TEST_DIR / 'test_image.png').read_bytes()[:20],
+    (TEST_DIR / 'test_image.jpg').read_bytes()[:100],
+    make_wav()[:30],
+    make_mp3(num_frames=1)
+])
+def test_unknown_or_truncated_media_is_left_to_ffprobe(data):
+    assert probe_media_header(data) is None
+
+
+def ffprobe_media_params(data):
+    """Media parameters of data analyzed by ffprobe with the keys and conversions of MediaParams."""
+    result = subprocess.run(
+        ['ffprobe', '-i', 'pipe:0', '-show_entries', 'format=format_name,duration,bit_rate:stream=codec_name,channels,sample_rate,sample_fmt,width,height,pix_fmt', '-v', 'quiet', '-of', 'json'],
+        input=data, capture_output=True, check=True
+    )
+    result = json.loads(result.stdout)
+    sections = {**result['format'], **result['streams'][0]}
+    sections['format_name'] = sections['format_name'].replace('_pipe', '')
+    media_params = dict()
+    for param_name, ffprobe_label in FFPROBE_DICT.items():
+        value = tuple(int(sections[label]) for label in ffprobe_label) if isinstance(ffprobe_label, tuple) else sections.get(ffprobe_label)
+        if param_name in (MediaParams.DURATION, MediaParams.SAMPLE_RATE, MediaParams.CHANNELS, MediaParams.AUDIO_BIT_RATE) and value is not None:
+            value = round(float(value))
+        media_params[param_name] = value
+    return media_params
+
+
+@pytest.mark.skipif(not shutil.which('ffprobe'), reason='ffprobe not installed')
+@pytest.mark.parametrize('data', [
+    (TEST_DIR / 'test_image.png').read_bytes(),
+    (TEST_DIR / 'test_image.jpg').read_bytes(),
+    make_image('PNG', 'RGBA'),
+    make_image('JPEG', subsampling=0),
+    make_image('WEBP'),
+    make_image('WEBP', lossless=True),
+    make_wav(),
+    make_wav(sample_width=1, channels=2)
+])
+def test_header_params_match_ffprobe(data):
+    header_params = probe_media_header(data)
+    ffprobe_params = ffprobe_media_params(data)
+    for param_name, value in header_params.items():
+        if value is not None:
+            assert value == ffprobe_params[param_name], param_name
@@ -0,0 +1,45 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import logging
+
+from api_server.api_endpoint import APIEndpoint
+from api_server.job_queue import QueueScheduler
+
+
+def make_endpoint(endpoint_config, clients_config=None):
+    endpoint = APIEndpoint.__new__(APIEndpoint) # Only the scheduler parameters are needed, no routes and workers
+    endpoint.endpoint_name = 'test_endpoint'
+    endpoint.config = {'ENDPOINT': endpoint_config}
+    endpoint.clients_config = clients_config or dict()
+    endpoint.scheduler, endpoint.priority_classes, endpoint.default_priority_class = endpoint.get_scheduler_params()
+    return endpoint
+
+
+def test_only_listed_api_keys_can_select_priority_classes():
+    endpoint = make_endpoint(
+        {'scheduler': QueueScheduler.FAIR_SHARE, 'priority_classes': {'interactive': 4, 'bulk': 1}, 'default_priority_class': 'bulk'},
+        {'priority_class_keys': {'interactive': ['premium_key']}}
+    )
+    assert endpoint.is_priority_class_authorized('premium_key', 'interactive')
+    assert not endpoint.is_priority_class_authorized('bulk_key', 'interactive')
+    assert endpoint.is_priority_class_authorized('bulk_key', 'bulk')
+    assert endpoint.is_priority_class_authorized('bulk_key', None)
+
+
+def test_non_default_priority_classes_are_restricted_by_default():
+    endpoint = make_endpoint({'scheduler': QueueScheduler.FAIR_SHARE, 'priority_classes': {'interactive': 4, 'bulk': 1}})
+    assert endpoint.default_priority_class == 'interactive'
+    assert endpoint.is_priority_class_authorized('any_key', 'interactive')
+    assert not endpoint.is_priority_class_authorized('any_key', 'bulk')
+
+
+def test_priority_classes_with_fifo_scheduler_are_reported(caplog):
+    with caplog.at_level(logging.WARNING, logger='API'):
+        make_endpoint({'priority_classes': {'interactive': 4, 'bulk': 1}})
+    assert 'Priority classes of endpoint test_endpoint are ignored' in caplog.text
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger='API'):
+        make_endpoint({'scheduler': QueueScheduler.FAIR_SHARE, 'priority_classes': {'interactive': 4, 'bulk': 1}})
+    assert caplog.text == ''
@@ -0,0 +1,71 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import asyncio
+import time
+import pytest
+
+from api_server.api_endpoint import APIEndpoint
+
+
+@pytest.mark.parametrize('input_args, expected', [({}, None), ({'since_version': 3}, 3), ({'since_version': '12'}, 12), ({'since_version': 0}, 0)])
+def test_version_arg(input_args, expected):
+    assert APIEndpoint.get_version_arg(input_args, 'since_version') == expected
+
+
+@pytest.mark.parametrize('value', ['abc', '1.5', 1.5, float('inf'), True, [1], ''])
+def test_invalid_version_arg(value):
+    with pytest.raises(ValueError):
+        APIEndpoint.get_version_arg({'since_queue_version': value}, 'since_queue_version')
+
+
+def new_job_data():
+    return {'endpoint_name': 'test_endpoint', 'prompt': 'a cat'}
+
+
+def test_queue_position_change_ends_long_poll_of_queued_job(make_job_handler):
+    async def run():
+        job_handler = make_job_handler()
+        first_job = await job_handler.endpoint_new_job(new_job_data())
+        job = await job_handler.endpoint_new_job(new_job_data())
+        waiter = asyncio.ensure_future(
+            job_handler.endpoint_wait_for_job_update(job, job.progress_version, 5, job.queue_position_version)
+        )
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        start_time = time.time()
+        await job_handler.endpoint_cancel_job(first_job)
+        await asyncio.wait_for(waiter, 1)
+        assert time.time() - start_time < 1
+    asyncio.run(run())
+
+
+def test_long_poll_without_queue_version_waits_for_progress(make_job_handler):
+    async def run():
+        job_handler = make_job_handler()
+        first_job = await job_handler.endpoint_new_job(new_job_data())
+        job = await job_handler.endpoint_new_job(new_job_data())
+        waiter = asyncio.ensure_future(job_handler.endpoint_wait_for_job_update(job, job.progress_version, 0.3))
+        await job_handler.endpoint_cancel_job(first_job)
+        await asyncio.sleep(0.1)
+        assert not waiter.done()
+        await asyncio.wait_for(waiter, 1)
+    asyncio.run(run())
+
+
+def test_canceled_long_poll_cancels_its_waiters(make_job_handler):
+    async def run():
+        job_handler = make_job_handler()
+        await job_handler.endpoint_new_job(new_job_data())
+        job = await job_handler.endpoint_new_job(new_job_data())
+        waiter = asyncio.ensure_future(
+            job_handler.endpoint_wait_for_job_update(job, job.progress_version, 5, job.queue_position_version)
+        )
+        await asyncio.sleep(0.05)
+        waiter.cancel() # Client disconnected
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0.01)
+        assert asyncio.all_tasks() == {asyncio.current_task()}
+    asyncio.run(run())
@@ -0,0 +1,117 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import os
+import json
+import asyncio
+
+from api_server.result_store import ResultStore, MEGABYTE
+from api_server.utils.ffmpeg import MediaBytes
+
+
+def make_result(index, size=1000):
+    return {'job_id': f'JID{index}', 'text': 'x' * size, 'num_generated_tokens': index}
+
+
+def test_result_size():
+    assert ResultStore.get_result_size({'text': 'abc', 'images': [b'12345', 'xy'], 'seed': 42}) == 4 + 3 + 6 + 5 + 2 + 4 + 8
+
+
+def test_results_within_max_size_stay_in_memory(tmp_path):
+    async def run():
+        result_store = ResultStore(max_size=10000, spill_dir=str(tmp_path))
+        result_store.put('JID1', make_result(1))
+        assert result_store.spill_task is None
+        assert await result_store.get('JID1') == make_result(1)
+        assert await result_store.get('unknown') is None
+        assert result_store.spill_file is None
+        assert os.listdir(tmp_path) == []
+        result_store.close()
+    asyncio.run(run())
+
+
+def test_oldest_results_are_spilled_and_read_back(tmp_path):
+    async def run():
+        result_store = ResultStore(max_size=3500, spill_dir=str(tmp_path))
+        for index in range(5):
+            result_store.put(f'JID{index}', make_result(index))
+        await result_store.spill_task
+        assert list(result_store.entries) == ['JID2', 'JID3', 'JID4']
+        assert result_store.size <= result_store.max_size
+        assert set(result_store.spilled) == {'JID0', 'JID1'}
+        spill_file_dir = os.path.dirname(result_store.spill_file)
+        assert os.path.dirname(spill_file_dir) == str(tmp_path)
+        assert os.stat(spill_file_dir).st_mode & 0o777 == 0o700 # Private directory of the server process
+        for index in range(5):
+            assert await result_store.get(f'JID{index}') == make_result(index)
+        status = result_store.get_status()
+        assert (status['num_results'], status['num_spilled_results'], status['num_spills'], status['num_spill_reads']) == (3, 2, 2, 2)
+        assert status['spill_size'] == sum(result_store.spilled.values()) > 0
+
+        result_store.close()
+        assert os.listdir(tmp_path) == []
+    asyncio.run(run())
+
+
+def test_results_are_spilled_as_json(tmp_path):
+    async def run():
+        result_store = ResultStore(max_size=0, spill_dir=str(tmp_path))
+        image = MediaBytes(b'\x89PNG\r\n\x1a\n' + bytes(1000), 'image', 'png')
+        result_store.put('JID1', {'image': image, 'seed': 42, 'images': ['data:image/png;base64,AAAA']})
+        await result_store.spill_task
+        assert not result_store.entries
+        row = result_store.connection.execute('SELECT result FROM results WHERE job_id = ?', ('JID1', )).fetchone()
+        assert json.loads(row[0])['seed'] == 42
+        result = await result_store.get('JID1')
+        assert result == {'image': image.to_base64_string(), 'seed': 42, 'images': ['data:image/png;base64,AAAA']}
+        result_store.close()
+    asyncio.run(run())
+
+
+def test_remove_spilled_result(tmp_path):
+    async def run():
+        result_store = ResultStore(max_size=0, spill_dir=str(tmp_path))
+        result_store.put('JID1', make_result(1))
+        result_store.put('JID2', make_result(2))
+        await result_store.spill_task
+        await result_store.remove('JID1')
+        assert await result_store.get('JID1') is None
+        assert list(result_store.spilled) == ['JID2']
+        assert result_store.spill_size == result_store.spilled['JID2']
+        assert result_store.read_spilled_result('JID1') is None
+        result_store.close()
+    asyncio.run(run())
+
+
+def test_result_removed_or_replaced_while_spilled(tmp_path):
+    async def run():
+        result_store = ResultStore(max_size=0, spill_dir=str(tmp_path))
+        result_store.put('JID1', make_result(1))
+        result_store.put('JID2', make_result(2))
+        await asyncio.sleep(0) # Spill task writes JID1
+        result_store.remove_entry('JID1')
+        result_store.put('JID2', make_result(3))
+        await result_store.spill_task
+        assert await result_store.get('JID1') is None
+        assert await result_store.get('JID2') == make_result(3)
+        assert result_store.read_spilled_result('JID1') is None
+        result_store.close()
+    asyncio.run(run())
+
+
+def test_spill_error_keeps_results_in_memory(tmp_path):
+    async def run():
+        result_store = ResultStore(max_size=0, spill_dir=str(tmp_path / 'missing_dir'))
+        result_store.put('JID1', make_result(1))
+        await result_store.spill_task
+        assert result_store.num_spill_errors == 1
+        assert await result_store.get('JID1') == make_result(1)
+        result_store.close()
+    asyncio.run(run())
+
+
+def test_from_config(tmp_path):
+    result_store = ResultStore.from_config({'max_size': 2, 'spill_dir': str(tmp_path)})
+    assert result_store.max_size == 2 * MEGABYTE
+    assert result_store.spill_dir == str(tmp_path)
@@ -0,0 +1,95 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import asyncio
+import json
+from types import SimpleNamespace
+from websockets.exceptions import ConnectionClosed
+
+from api_server.worker_websocket import WorkerConnection
+
+
+JOB_RESPONSE = {'cmd': 'job', 'endpoint_name': 'test_endpoint', 'job_data': [{'job_id': 'JID1'}, {'job_id': 'JID2'}]}
+
+
+class FakeJobHandler():
+    def __init__(self, job_request_delay=0):
+        self.job_types = {'test_job_type': None}
+        self.job_request_delay = job_request_delay
+        self.requeued_jobs = list()
+
+    async def worker_job_request(self, req_json, session_authorized=False):
+        await asyncio.sleep(self.job_request_delay)
+        return dict(JOB_RESPONSE)
+
+    async def worker_requeue_jobs(self, worker_auth, job_ids):
+        self.requeued_jobs.append((worker_auth, job_ids))
+
+    async def set_worker_offline(self, auth):
+        pass
+
+
+class FakeWebSocket():
+    def __init__(self, send_delay=0, closed=False):
+        self.send_delay = send_delay
+        self.closed = closed
+        self.messages = list()
+
+    async def send(self, message):
+        await asyncio.sleep(self.send_delay)
+        if self.closed:
+            raise ConnectionClosed(None, None)
+        self.messages.append(json.loads(message))
+
+
+def make_connection(job_handler, ws):
+    connection = WorkerConnection(SimpleNamespace(job_handler=job_handler), ws)
+    connection.auth = 'test_worker'
+    return connection
+
+
+def test_jobs_are_sent_to_the_worker():
+    async def run():
+        job_handler = FakeJobHandler()
+        ws = FakeWebSocket()
+        await make_connection(job_handler, ws).job_request({}, 1)
+        assert ws.messages == [dict(JOB_RESPONSE, msg_id=1)]
+        assert job_handler.requeued_jobs == []
+    asyncio.run(run())
+
+
+def test_jobs_are_requeued_if_the_connection_is_closed():
+    async def run():
+        job_handler = FakeJobHandler()
+        await make_connection(job_handler, FakeWebSocket(closed=True)).job_request({}, 1)
+        assert job_handler.requeued_jobs == [('test_worker', ['JID1', 'JID2'])]
+    asyncio.run(run())
+
+
+def test_canceled_job_request_still_sends_the_started_jobs():
+    async def run():
+        job_handler = FakeJobHandler()
+        ws = FakeWebSocket(send_delay=0.05)
+        connection = make_connection(job_handler, ws)
+        connection.start_job_request({}, 1)
+        await asyncio.sleep(0.01) # Job request response is being sent
+        connection.start_job_request({}, 2)
+        await asyncio.sleep(0.2)
+        assert [message['msg_id'] for message in ws.messages] == [1, 2]
+        assert job_handler.requeued_jobs == []
+    asyncio.run(run())
+
+
+def test_jobs_are_requeued_if_the_connection_closes_while_sending():
+    async def run():
+        job_handler = FakeJobHandler()
+        ws = FakeWebSocket(send_delay=0.05)
+        connection = make_connection(job_handler, ws)
+        connection.start_job_request({}, 1)
+        await asyncio.sleep(0.01)
+        ws.closed = True
+        await connection.close()
+        await asyncio.sleep(0.1)
+        assert job_handler.requeued_jobs == [('test_worker', ['JID1', 'JID2'])]
+    asyncio.run(run())
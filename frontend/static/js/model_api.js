@@ -150,7 +150,7 @@ class ModelAPI {
      * @param {Object} params - The parameters of the API request.
      * @param {function} resultCallback - The callback after the request is completed.
      * @param {function} [progressCallback=null] - The callback for progress updates.
-     * @param {boolean} [progressStream=false] - Specifies whether the progress should be streamed (default: false). Attention: The stream feature is not yet fully implemented.
+     * @param {boolean} [progressStream=false] - Specifies whether the progress should be received as server-sent events on /stream_progress instead of polling (default: false).
      */
     async doAPIRequest(params, resultCallback, progressCallback = null, progressStream = false) {
         const url = `/${this.endpointName}`;
@@ -196,33 +196,45 @@ class ModelAPI {
      * Method to set up a progress stream.
      * @async
      * @param {string} jobID - The ID of the job for the progress stream.
+     * @param {function} resultCallback - The callback with the job result or the error response.
      * @param {function} progressCallback - The callback for progress updates.
      */
     async setupProgressStream(jobID, resultCallback, progressCallback) {
-        console.error('Error: The stream feature is not yet fully implemented. Please call doAPIRequest() without progressStream=true.');
-        alert('Attention: The stream feature is not yet fully implemented. Please call doAPIRequest() without progressStream=true.')
         const eventSourceURL = `/stream_progress?client_session_auth_key=${encodeURIComponent(this.clientSessionAuthKey)}&job_id=${encodeURIComponent(jobID)}`;
         const eventSource = new EventSource(eventSourceURL);
 
         eventSource.onmessage = (event) => {
-            const data = JSON.parse(event.data);
-            console.log('eventSource.onmessage data:', data);
-            const progressInfo = {
-                progress: data.progress,
-                queue_position: data.queue_position,
-                estimate: -1
-            };
-
-            progressCallback(progressInfo, data.progress_data);
-
-            if (data.job_state === 'done') {
-                const jobResult = data.job_result;
-                jobResult.job_id = data.job_id;
-                jobResult.success = data.success;
-                resultCallback(jobResult);
+            const result = JSON.parse(event.data);
+            if (!result.success) { // Lapsed job or invalid request
                 eventSource.close();
-            } else if (data.job_state === 'canceled') {
+                resultCallback(result);
+                return;
+            }
+            if (result.job_state === 'done') {
                 eventSource.close();
+                if (result.job_result) {
+                    resultCallback(result.job_result);
+                }
+            } else {
+                const progress = result.progress;
+                const progressInfo = {
+                    progress: progress.progress,
+                    queue_position: progress.queue_position,
+                    estimate: progress.estimate,
+                    num_workers_online: progress.num_workers_online
+                };
+
+                progressCallback(progressInfo, progress.progress_data);
+
+                if (result.job_state !== 'queued' && result.job_state !== 'processing') {
+                    eventSource.close();
+                }
+            }
+        };
+
+        eventSource.onerror = () => {
+            if (eventSource.readyState === EventSource.CLOSED) { // Request rejected by the server, no reconnect
+                resultCallback({ success: false, job_id: jobID, error: 'Progress stream was rejected by the server' });
             }
         };
     }
@@ -277,6 +289,23 @@ class ModelAPI {
         }
         checkProgress(this.defaultProgressIntervall);
     }
+
+    /**
+     * Method to cancel a queued or running job.
+     * @async
+     * @param {string} jobID - The ID of the job to cancel.
+     * @returns {Object} The response of the API server containing the job_state after the cancel request.
+     */
+    async cancelRequest(jobID) {
+        const url = `/${this.endpointName}/cancel`;
+        const params = {
+            client_session_auth_key: this.clientSessionAuthKey,
+            key: this.apiKey,
+            job_id: jobID
+        };
+        return await this.fetchAsync(url, params, true);
+    }
+
     async stringifyObjects(params) {
         var transformedParams = new Object()
         for (let key in params) {
@@ -0,0 +1,372 @@
+# Copyright (c) AIME GmbH and affiliates. Find more info at https://www.aime.info/api
+#
+# This software may be used and distributed according to the terms of the AIME COMMUNITY LICENSE AGREEMENT
+
+import argparse
+import asyncio
+import copy
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+import toml
+from PIL import Image
+
+from api_server.input_validation import InputValidationHandler
+from api_server.job_queue import Job, JobSettings
+from api_server.openai import OpenAI
+from api_server.utils.ffmpeg import FFmpeg
+from api_server.utils.misc import shorten_strings
+
+
+ROOT_DIR = Path(__file__).parent
+SERVER_CONFIG_FILE = ROOT_DIR / 'aime_api_server.cfg'
+CHAT_EP_CONFIG_FILE = ROOT_DIR / 'endpoints/llama3_chat/aime_api_endpoint.cfg'
+IMG2IMG_EP_CONFIG_FILE = ROOT_DIR / 'endpoints/stable_diffusion_xl/img2img/aime_api_endpoint.cfg'
+WHISPERX_EP_CONFIG_FILE = ROOT_DIR / 'endpoints/whisperx/aime_api_endpoint.cfg'
+DEFAULT_BASELINE_FILE = ROOT_DIR / 'api_test/validation_benchmark_baseline.json'
+
+NUM_CHAT_MESSAGES = 200
+CHAT_MESSAGE_TEXT = 'The quick brown fox jumps over the lazy dog while the API server validates the chat context. ' * 20
+IMAGE_SIZE = (1024, 1024)
+AUDIO_DURATION = 60 # seconds
+NUM_RETAINED_JOBS = 1000 # KiB/op of the case retain_1000_jobs is about the number of bytes per retained job
+
+RED = '\033[91m'
+GREEN = '\033[92m'
+RESET = '\033[0m'
+
+
+class BenchmarkCase():
+    """Single operation measured by the validation benchmark.
+
+    Args:
+        name (str): Name of the case, key in the baseline file
+        function (callable): Function or coroutine function to measure
+        setup (callable, optional): Returns the arguments of function for each operation. Not included in the measured time. Defaults to None.
+        requires_ffmpeg (bool, optional): Whether the case is skipped if FFmpeg is not installed. Defaults to False.
+    """
+    def __init__(self, name, function, setup=None, requires_ffmpeg=False):
+        self.name = name
+        self.function = function
+        self.setup = setup or tuple
+        self.requires_ffmpeg = requires_ffmpeg
+
+
+    async def run_once(self):
+        """Run the operation once.
+
+        Returns:
+            float: Duration of the operation in seconds without setup
+        """
+        args = self.setup()
+        start_time = time.perf_counter()
+        result = self.function(*args)
+        if asyncio.iscoroutine(result):
+            await result
+        return time.perf_counter() - start_time
+
+
+class ValidationBenchmark():
+    """Offline benchmark of the CPU cost of the API server per request. Measures InputValidationHandler, FFmpeg.analyze()
+    and FFmpeg.convert(), shorten_strings() and the conversion of OpenAI chat contexts with payloads based on the endpoint
+    configs: large chat contexts, 1024x1024 PNG images and 60 s MP3 files. Reports operations per second and the peak
+    memory allocated per operation and compares them to a stored baseline. The memory of the jobs retained until their
+    result_lifetime expired is measured by creating 1000 jobs.
+    """
+    def __init__(self):
+        self.args = self.load_flags()
+        FFmpeg.is_ffmpeg_installed()
+        InputValidationHandler.media_cache = None # Measure the validation, not the cache
+        self.server_input_param_config = toml.load(SERVER_CONFIG_FILE).get('INPUTS', {})
+        self.chat_input_param_config = toml.load(CHAT_EP_CONFIG_FILE).get('INPUTS', {})
+        self.img2img_input_param_config = toml.load(IMG2IMG_EP_CONFIG_FILE).get('INPUTS', {})
+        self.whisperx_input_param_config = toml.load(WHISPERX_EP_CONFIG_FILE).get('INPUTS', {})
+        self.input_param_specs = dict() # key: id of endpoint input parameter config, value: compiled input parameters
+        self.png_image = self.create_png_image()
+        self.mp3_audio = self.create_mp3_audio()
+        self.chat_context = self.create_chat_context()
+        self.openai_messages = self.create_openai_messages()
+        self.openai = OpenAI.__new__(OpenAI) # Conversion doesn't need the routes of an initialized instance
+        self.job_app = SimpleNamespace( # Jobs only need the job settings of their endpoint and the event loop
+            endpoints={'llama3_chat': SimpleNamespace(job_settings=JobSettings.from_config(toml.load(CHAT_EP_CONFIG_FILE).get('ENDPOINT', {})))},
+            loop=None
+        )
+        self.cases = self.get_cases()
+
+
+    def get_cases(self):
+        chat_context_json = json.dumps(self.chat_context)
+        return [
+            BenchmarkCase(
+                'validate_chat_context',
+                self.validate_input_parameters,
+                lambda: ({'chat_context': chat_context_json, **self.get_default_values(self.chat_input_param_config)}, self.chat_input_param_config)
+            ),
+            BenchmarkCase(
+                'validate_img2img_parameters',
+                self.validate_input_parameters,
+                lambda: ({**self.get_default_values(self.img2img_input_param_config), 'text': 'Astronaut on mars', 'ddim_steps': 60}, self.img2img_input_param_config)
+            ),
+            BenchmarkCase(
+                'validate_whisperx_parameters',
+                self.validate_input_parameters,
+                lambda: ({'text_input': 'x', 'src_lang': 'zh'}, self.whisperx_input_param_config)
+            ),
+            BenchmarkCase(
+                'ffmpeg_analyze_png_1024',
+                self.analyze_media,
+                lambda: ('image', self.png_image, self.img2img_input_param_config)
+            ),
+            BenchmarkCase(
+                'ffmpeg_analyze_mp3_60s',
+                self.analyze_media,
+                lambda: ('audio_input', self.mp3_audio, self.whisperx_input_param_config)
+            ),
+            BenchmarkCase(
+                'validate_and_convert_png_1024',
+                self.validate_input_parameters,
+                lambda: ({'image': self.png_image}, self.img2img_input_param_config),
+                requires_ffmpeg=True
+            ),
+            BenchmarkCase(
+                'validate_and_convert_mp3_60s',
+                self.validate_input_parameters,
+                lambda: ({'audio_input': self.mp3_audio}, self.whisperx_input_param_config),
+                requires_ffmpeg=True
+            ),
+            BenchmarkCase(
+                'shorten_strings_chat_context',
+                shorten_strings,
+                lambda: ({'chat_context': self.chat_context, 'image': self.png_image}, )
+            ),
+            BenchmarkCase(
+                'openai_convert_chat_context',
+                self.openai._OpenAI__convert_chat_context_from_openai,
+                lambda: (copy.deepcopy(self.openai_messages), 'You are a helpful assistant.')
+            ),
+            BenchmarkCase(
+                f'retain_{NUM_RETAINED_JOBS}_jobs',
+                self.create_jobs
+            )
+        ]
+
+
+    async def validate_input_parameters(self, input_params, ep_input_param_config):
+        input_param_specs = self.input_param_specs.get(id(ep_input_param_config))
+        if input_param_specs is None: # Compiled once per endpoint like in APIEndpoint
+            input_param_specs = self.input_param_specs[id(ep_input_param_config)] = InputValidationHandler.compile_input_param_specs(ep_input_param_config)
+        input_validator = InputValidationHandler(input_params, ep_input_param_config, self.server_input_param_config, input_param_specs=input_param_specs)
+        _, validation_errors = await input_validator.validate_input_parameters()
+        if validation_errors:
+            raise ValueError(f'Benchmark payload is invalid: {validation_errors}')
+
+
+    async def analyze_media(self, param_name, media_binary, ep_input_param_config):
+        param_config = ep_input_param_config[param_name]
+        ffmpeg_media = FFmpeg(param_name, config=param_config, media_binary=media_binary, arg_type=param_config.get('type'))
+        try:
+            await ffmpeg_media.analyze()
+        finally:
+            await ffmpeg_media.remove_temp_files()
+
+
+    async def create_jobs(self):
+        self.job_app.loop = asyncio.get_running_loop()
+        return [await Job.new({'endpoint_name': 'llama3_chat'}, self.job_app) for _ in range(NUM_RETAINED_JOBS)]
+
+
+    async def run(self):
+        baseline = self.load_baseline()
+        results = dict()
+        for case in self.cases:
+            if self.args.filter and self.args.filter not in case.name:
+                continue
+            if case.requires_ffmpeg and not FFmpeg.ffmpeg_installed:
+                print(f'{case.name:<32} skipped, FFmpeg is not installed')
+                continue
+            results[case.name] = await self.measure(case)
+            self.print_result(case.name, results[case.name], baseline.get('results', {}).get(case.name))
+        if self.args.save_baseline:
+            self.save_baseline(results)
+        else:
+            regressions = [name for name, result in results.items() if self.is_regression(result, baseline.get('results', {}).get(name))]
+            if regressions:
+                print(f'{RED}Regressions: {", ".join(regressions)}{RESET}')
+                sys.exit(1)
+
+
+    async def measure(self, case):
+        """Measure operations per second and the peak memory allocated per operation of the given case. The time is
+        measured without tracemalloc, the allocations in a separate run with tracemalloc.
+
+        Args:
+            case (BenchmarkCase): Case to measure
+
+        Returns:
+            dict: Operations per second, number of operations and peak allocated KiB per operation
+        """
+        for _ in range(self.args.warmup):
+            await case.run_once()
+        num_operations = 0
+        total_duration = 0
+        start_time = time.perf_counter()
+        while num_operations < self.args.min_operations or time.perf_counter() - start_time < self.args.duration:
+            total_duration += await case.run_once()
+            num_operations += 1
+
+        tracemalloc.start()
+        peak_allocated = 0
+        for _ in range(self.args.allocation_operations):
+            tracemalloc.reset_peak()
+            allocated_before = tracemalloc.get_traced_memory()[0]
+            await case.run_once()
+            peak_allocated += tracemalloc.get_traced_memory()[1] - allocated_before
+        tracemalloc.stop()
+        return {
+            'ops_per_second': round(num_operations / total_duration, 2),
+            'num_operations': num_operations,
+            'peak_allocated_kib': round(peak_allocated / self.args.allocation_operations / 1024, 1)
+        }
+
+
+    def is_regression(self, result, baseline_result):
+        if not baseline_result:
+            return False
+        tolerance = self.args.tolerance
+        return result['ops_per_second'] < baseline_result['ops_per_second'] * (1 - tolerance) or \
+            result['peak_allocated_kib'] > baseline_result['peak_allocated_kib'] * (1 + tolerance) + 1
+
+
+    def print_result(self, name, result, baseline_result):
+        line = f'{name:<32} {result["ops_per_second"]:>12.1f} ops/s {result["peak_allocated_kib"]:>10.1f} KiB/op'
+        if baseline_result:
+            speed_ratio = result['ops_per_second'] / baseline_result['ops_per_second']
+            memory_ratio = result['peak_allocated_kib'] / baseline_result['peak_allocated_kib'] if baseline_result['peak_allocated_kib'] else 1
+            color = RED if self.is_regression(result, baseline_result) else GREEN
+            line += f'   {color}x{speed_ratio:.2f} speed, x{memory_ratio:.2f} memory vs. baseline{RESET}'
+        print(line, flush=True)
+
+
+    def load_baseline(self):
+        try:
+            with open(self.args.baseline, 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            print(f'No baseline found at {self.args.baseline}')
+        except json.decoder.JSONDecodeError:
+            print(f'Baseline is no valid json file {self.args.baseline}')
+        return dict()
+
+
+    def save_baseline(self, results):
+        baseline = {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'ffmpeg_installed': FFmpeg.ffmpeg_installed,
+            'results': {**self.load_baseline().get('results', {}), **results}
+        }
+        with open(self.args.baseline, 'w') as file:
+            json.dump(baseline, file, indent=4)
+            file.write('\n')
+        print(f'Baseline saved to {self.args.baseline}')
+
+
+    @staticmethod
+    def get_default_values(ep_input_param_config):
+        return {param_name: param_config['default'] for param_name, param_config in ep_input_param_config.items() if 'default' in param_config}
+
+
+    @staticmethod
+    def create_chat_context():
+        chat_context = [{'role': 'system', 'content': 'You are a helpful assistant.'}]
+        for index in range(NUM_CHAT_MESSAGES):
+            chat_context.append({'role': 'user' if index % 2 else 'assistant', 'content': f'{index}: {CHAT_MESSAGE_TEXT}'})
+        return chat_context
+
+
+    @staticmethod
+    def create_openai_messages():
+        messages = [{'role': 'developer', 'content': 'You are a helpful assistant.'}]
+        for index in range(NUM_CHAT_MESSAGES):
+            messages.append({
+                'role': 'user' if index % 2 else 'assistant',
+                'content': [
+                    {'type': 'text', 'text': f'{index}: {CHAT_MESSAGE_TEXT}'},
+                    {'type': 'image_url', 'image_url': {'url': 'data:image/png;base64,iVBORw0KGgo='}}
+                ]
+            })
+        return messages
+
+
+    @staticmethod
+    def create_png_image():
+        """Create a PNG image with a color gradient, so it has a realistic compressed size.
+        """
+        width, height = IMAGE_SIZE
+        red = Image.linear_gradient('L').resize(IMAGE_SIZE)
+        green = red.transpose(Image.Transpose.ROTATE_90)
+        blue = Image.effect_noise(IMAGE_SIZE, 32)
+        image = Image.merge('RGB', (red, green, blue))
+        with io.BytesIO() as buffer:
+            image.save(buffer, format='PNG')
+            return buffer.getvalue()
+
+
+    @staticmethod
+    def create_mp3_audio():
+        """Create an MP3 file of silent MPEG-1 Layer III frames with 128 kbit/s, 44.1 kHz and mono.
+        """
+        frame_header = bytes((0xFF, 0xFB, 0x90, 0xC0))
+        frame_length = 144 * 128000 // 44100
+        num_frames = AUDIO_DURATION * 44100 // 1152
+        return (frame_header + bytes(frame_length - len(frame_header))) * num_frames
+
+
+    def load_flags(self):
+        """Parsing the command line arguments.
+
+        Returns:
+            argparse.Namespace: The argparse object containing the command line arguments
+        """
+        parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        parser.add_argument(
+            '-d', '--duration', type=float, default=1.0, help='Minimum measuring time per benchmark case in seconds'
+        )
+        parser.add_argument(
+            '-mo', '--min_operations', type=int, default=5, help='Minimum number of operations per benchmark case'
+        )
+        parser.add_argument(
+            '-w', '--warmup', type=int, default=2, help='Number of unmeasured operations before measuring'
+        )
+        parser.add_argument(
+            '-ao', '--allocation_operations', type=int, default=3, help='Number of operations measuring the allocated memory with tracemalloc'
+        )
+        parser.add_argument(
+            '-f', '--filter', type=str, help='Only run benchmark cases containing the given string in their name'
+        )
+        parser.add_argument(
+            '-b', '--baseline', type=str, default=str(DEFAULT_BASELINE_FILE), help='Baseline json file to compare the results with'
+        )
+        parser.add_argument(
+            '-s', '--save_baseline', action='store_true', help='Save the results as new baseline instead of comparing them'
+        )
+        parser.add_argument(
+            '-t', '--tolerance', type=float, default=0.25,
+            help='Relative tolerance until a lower ops/s or a higher allocated memory than the baseline is reported as regression'
+        )
+        return parser.parse_args()
+
+
+def main():
+    validation_benchmark = ValidationBenchmark()
+    asyncio.run(validation_benchmark.run())
+
+
+if __name__ == "__main__":
+    main()